@@ -0,0 +1,80 @@
+#!/usr/bin/env python3
+
+import os
+import json
+import time
+import click
+import pandas as pd
+from helpers.rating_analytics import load_reps, unit_scores, notebook_totals, leaderboard
+
+group_columns = ["model", "prompt", "dandiset_id", "question"]
+
+
+def load_json_list(fname: str):
+    if not os.path.exists(fname):
+        return []
+    with open(fname, "r") as f:
+        return json.load(f)
+
+
+@click.command()
+@click.option("--ratings", default="ratings.json", help="Notebook ratings file")
+@click.option("--plot-ratings", default="plot_ratings.json", help="Plot ratings file")
+@click.option("--by", default="model,prompt", help=f"Comma-separated columns to group by ({', '.join(group_columns)})")
+@click.option("--question", "questions", multiple=True, help="Only include these questions (can be repeated)")
+@click.option("--min-n", type=int, default=1, help="Only show groups with at least this many rows")
+@click.option("--bootstrap", "num_samples", type=int, default=1000, help="Number of bootstrap samples for the confidence intervals")
+@click.option("--confidence", type=float, default=0.95, help="Confidence level of the intervals")
+@click.option("--seed", type=int, default=0, help="Random seed for the bootstrap")
+@click.option("--csv", "csv_dir", default=None, help="Also write the leaderboards as CSV files to this directory")
+@click.option("--include-incomplete", is_flag=True, help="Include notebooks whose rating was interrupted before every question was done")
+def main(ratings, plot_ratings, by, questions, min_n, num_samples, confidence, seed, csv_dir, include_incomplete):
+    """Leaderboards of notebook and plot ratings per model and prompt (or other groupings).
+
+    For each group: the mean score, its bootstrap confidence interval, the
+    standard deviation across notebooks (or plots), and the mean variance
+    across the repetitions of each rating.
+    """
+    by_columns = [c.strip() for c in by.split(",")]
+    for c in by_columns:
+        if c not in group_columns:
+            raise click.BadParameter(f"Unknown column {c}", param_hint="--by")
+
+    timer = time.perf_counter()
+    reps = load_reps(load_json_list(ratings), load_json_list(plot_ratings), include_incomplete=include_incomplete)
+    if questions:
+        reps = reps[reps["question"].isin(questions)]
+    units = unit_scores(reps)
+    load_seconds = time.perf_counter() - timer
+
+    timer = time.perf_counter()
+    opts = dict(num_samples=num_samples, confidence=confidence, seed=seed)
+    boards = {}
+    if "question" not in by_columns:
+        # the overall score of a notebook is only defined over all of its questions
+        boards["overall"] = ("Overall notebook score (sum over questions)", leaderboard(notebook_totals(units), by_columns, **opts))
+    notebook_units = units[units["kind"] == "notebook"]
+    plot_units = units[units["kind"] == "plot"]
+    if len(notebook_units):
+        boards["questions"] = ("Notebook question score", leaderboard(notebook_units, by_columns, **opts))
+    if len(plot_units):
+        boards["plots"] = ("Plot score", leaderboard(plot_units, by_columns, **opts))
+    compute_seconds = time.perf_counter() - timer
+
+    print(f"{len(reps)} repetitions, {len(units)} rated units ({load_seconds * 1000:.0f} ms to load, {compute_seconds * 1000:.0f} ms to compute)")
+    with pd.option_context("display.max_rows", None, "display.width", 200, "display.float_format", "{:.2f}".format):
+        for name, (title, board) in boards.items():
+            board = board[board["n"] >= min_n]
+            print(f"\n{title}")
+            # the list of question versions is long, so only show it when it differs between rows
+            if "rubric_version" in board.columns and board["rubric_version"].nunique() <= 1:
+                print(board.drop(columns="rubric_version").to_string(index=False))
+            else:
+                print(board.to_string(index=False))
+            if csv_dir:
+                os.makedirs(csv_dir, exist_ok=True)
+                board.to_csv(os.path.join(csv_dir, f"leaderboard_{name}.csv"), index=False)
+
+
+if __name__ == "__main__":
+    main()
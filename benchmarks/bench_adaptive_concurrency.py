@@ -0,0 +1,105 @@
+#!/usr/bin/env python3
+
+"""Simulate the adaptive concurrency controller of run_completion against rate-limited models.
+
+Usage: python benchmarks/bench_adaptive_concurrency.py [--requests N] [--threads N] [--latency-ms MS]
+
+Run from the repository root. Nothing is sent: post_request is replaced by a
+fake server that serves each model at a fixed capacity. Latency grows with the
+requests in flight beyond the capacity, and a 429 (with Retry-After) is
+returned beyond twice the capacity. The capacities of the two models differ,
+as between a Flash model and a Sonnet model. Each model gets --requests
+requests from --threads caller threads. Every configuration runs with fixed
+caller concurrency (a 429 fails the request) and with the controller.
+"""
+
+import os
+import sys
+import json
+import time
+import threading
+from concurrent.futures import ThreadPoolExecutor
+import click
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from helpers import run_completion as rc  # noqa: E402
+
+capacities = {"google/gemini-2.0-flash-001": 24, "anthropic/claude-3.7-sonnet": 3}
+
+
+class FakeResponse:
+    def __init__(self, status_code: int, headers=None):
+        self.status_code = status_code
+        self.headers = headers or {}
+        self.text = "" if status_code == 200 else "rate limited"
+
+    def json(self):
+        return {"choices": [{"message": {"content": "ok"}}], "usage": {"prompt_tokens": 1, "completion_tokens": 1}}
+
+
+def make_fake_server(latency_ms: float):
+    lock = threading.Lock()
+    in_flight = {model: 0 for model in capacities}
+
+    def fake_post(url, *, headers, body):
+        model = json.loads(body)["model"]
+        with lock:
+            if in_flight[model] >= 2 * capacities[model]:
+                return FakeResponse(429, {"Retry-After": str(latency_ms / 1000)})
+            in_flight[model] += 1
+            load = in_flight[model] / capacities[model]
+        time.sleep(latency_ms / 1000 * max(1.0, load))
+        with lock:
+            in_flight[model] -= 1
+        return FakeResponse(200)
+
+    return fake_post
+
+
+def run(model: str, *, num_requests: int, num_threads: int, adaptive: bool, latency_ms: float):
+    rc.post_request = make_fake_server(latency_ms)
+    rc.adaptive_concurrency = adaptive
+    rc.controllers.clear()
+    rc.latencies = rc.LatencyTracker(rc.latency_window)
+    failed = []
+
+    def one(_):
+        try:
+            rc.run_completion([{"role": "user", "content": "hello"}], model=model)
+        except RuntimeError:
+            failed.append(1)
+
+    timer = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=num_threads) as executor:
+        list(executor.map(one, range(num_requests)))
+    seconds = time.perf_counter() - timer
+    return seconds, len(failed), rc.get_telemetry()["concurrency"].get(model)
+
+
+@click.command()
+@click.option("--requests", "num_requests", type=int, default=600, help="Requests per model and configuration")
+@click.option("--threads", "num_threads", type=int, default=48, help="Caller threads (the fixed concurrency)")
+@click.option("--latency-ms", type=float, default=20, help="Simulated latency at or below capacity")
+def main(num_requests, num_threads, latency_ms):
+    os.environ.setdefault("OPENROUTER_API_KEY", "unused")
+    stdout = sys.stdout
+    for model, capacity in capacities.items():
+        print(f"\n{model} (capacity {capacity}, 429 beyond {2 * capacity} in flight), {num_requests} requests, {num_threads} threads")
+        for threads, adaptive in [(1, False), (capacity, False), (num_threads, False), (num_threads, True)]:
+            # the print statements of run_completion are silenced
+            sys.stdout = open(os.devnull, "w")
+            try:
+                seconds, num_failed, stats = run(model, num_requests=num_requests, num_threads=threads, adaptive=adaptive, latency_ms=latency_ms)
+            finally:
+                sys.stdout.close()
+                sys.stdout = stdout
+            label = f"{'adaptive' if adaptive else 'fixed'}, {threads} threads"
+            line = f"  {label:>22}: {num_requests / seconds:>7.1f} requests/s, {num_failed:>4} failed"
+            if stats:
+                line += f", final limit {stats['limit']}, {stats['throttled']} throttled, max in flight {stats['max_in_flight']}"
+            print(line)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,104 @@
+#!/usr/bin/env python3
+
+"""Simulate hedged requests in run_completion against a heavy-tailed latency distribution.
+
+Usage: python benchmarks/bench_hedging.py [--requests N] [--median-ms MS] [--tail-fraction F] [--tail-factor X]
+
+Run from the repository root. Nothing is sent: post_request is replaced by a
+fake that sleeps for a latency drawn from a lognormal distribution, with a
+fraction of the requests tail-factor times slower (as when a provider stalls).
+The same sequence of requests runs without and with hedging, reporting the
+latency percentiles seen by the caller and the extra requests sent.
+"""
+
+import os
+import sys
+import time
+import random
+import threading
+import statistics
+import click
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from helpers import run_completion as rc  # noqa: E402
+
+model = "google/gemini-2.0-flash-001"
+
+
+class FakeResponse:
+    status_code = 200
+    text = ""
+
+    def json(self):
+        return {"choices": [{"message": {"content": "ok"}}], "usage": {"prompt_tokens": 1, "completion_tokens": 1}}
+
+
+def make_fake_post(*, median_ms: float, tail_fraction: float, tail_factor: float, seed: int):
+    rng = random.Random(seed)
+    lock = threading.Lock()
+    counts = {"sent": 0}
+
+    def fake_post(url, *, headers, body):
+        with lock:
+            counts["sent"] += 1
+            seconds = median_ms / 1000 * rng.lognormvariate(0, 0.3)
+            if rng.random() < tail_fraction:
+                seconds *= tail_factor
+        time.sleep(seconds)
+        return FakeResponse()
+
+    return fake_post, counts
+
+
+def run(num_requests: int, *, hedge: bool, **fake_options):
+    fake_post, counts = make_fake_post(**fake_options)
+    rc.post_request = fake_post
+    rc.hedge_requests = hedge
+    rc.latencies = rc.LatencyTracker(rc.latency_window)
+    for key in rc.hedge_counters:
+        rc.hedge_counters[key] = 0
+    os.environ.setdefault("OPENROUTER_API_KEY", "unused")
+    seconds = []
+    for _ in range(num_requests):
+        timer = time.perf_counter()
+        rc.run_completion([{"role": "user", "content": "hello"}], model=model)
+        seconds.append(time.perf_counter() - timer)
+    return seconds, counts["sent"], dict(rc.hedge_counters)
+
+
+def percentile(values, p):
+    return statistics.quantiles(values, n=100, method="inclusive")[p - 1]
+
+
+@click.command()
+@click.option("--requests", "num_requests", type=int, default=400, help="Requests per run")
+@click.option("--median-ms", type=float, default=20, help="Median simulated latency")
+@click.option("--tail-fraction", type=float, default=0.03, help="Fraction of the requests that stall")
+@click.option("--tail-factor", type=float, default=20, help="How much slower a stalled request is")
+def main(num_requests, median_ms, tail_fraction, tail_factor):
+    fake_options = dict(median_ms=median_ms, tail_fraction=tail_fraction, tail_factor=tail_factor, seed=0)
+    # print statements of run_completion are silenced
+    stdout = sys.stdout
+    results = {}
+    for hedge in [False, True]:
+        sys.stdout = open(os.devnull, "w")
+        try:
+            results[hedge] = run(num_requests, hedge=hedge, **fake_options)
+        finally:
+            sys.stdout.close()
+            sys.stdout = stdout
+    print(f"{num_requests} requests, median {median_ms} ms, {tail_fraction:.0%} stalled x{tail_factor}, "
+          f"hedging at p{rc.hedge_percentile} with a budget of {rc.hedge_budget:.0%}")
+    for hedge, (seconds, sent, counters) in results.items():
+        print(f"\n{'hedged' if hedge else 'not hedged'}:")
+        for p in [50, 95, 99]:
+            print(f"  p{p}: {percentile(seconds, p) * 1000:>8.1f} ms")
+        print(f"  max: {max(seconds) * 1000:>8.1f} ms")
+        print(f"  total: {sum(seconds):.2f} s, {sent} requests sent")
+        if hedge:
+            print(f"  counters: {counters}")
+
+
+if __name__ == "__main__":
+    main()
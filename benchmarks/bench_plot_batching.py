@@ -0,0 +1,152 @@
+#!/usr/bin/env python3
+
+"""Compare rating each plot in its own request with rating several plots per request.
+
+Usage: python benchmarks/bench_plot_batching.py [--batch-size N] [--live K] [NOTEBOOK ...]
+
+Run from the repository root. Without --live, the request count and prompt
+tokens of both paths are estimated offline for the notebooks (default: all
+notebooks in dandisets/). With --live K, the plots of the first K notebooks are
+also rated with both paths through the API, reporting the actual requests,
+tokens, wall time and how much the mean scores differ. The live ratings are
+not saved to plot_ratings.json.
+"""
+
+import os
+import sys
+import json
+import time
+import statistics
+import click
+import yaml
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+import run_plot_ratings  # noqa: E402
+from run_plot_ratings import find_notebooks, create_plot_messages, create_plot_batch_messages, rate_notebook_plots  # noqa: E402
+from helpers.token_estimate import estimate_message_tokens  # noqa: E402
+
+default_model = "google/gemini-2.0-flash-001"
+
+
+def get_plots(notebook_path: str):
+    with open(notebook_path, "r") as f:
+        notebook = json.load(f)
+    plots = []
+    for cell_idx, cell in enumerate(notebook["cells"]):
+        if cell["cell_type"] != "code":
+            continue
+        for output_idx, output in enumerate(cell.get("outputs", [])):
+            if output["output_type"] in ["display_data", "execute_result"] and "image/png" in output["data"]:
+                plots.append((f"cell_{cell_idx}_output_{output_idx}", f"data:image/png;base64,{output['data']['image/png']}"))
+    return plots
+
+
+def estimate_tokens(messages, *, model: str) -> int:
+    estimate = estimate_message_tokens(messages, model=model)
+    return estimate["text_tokens"] + estimate["image_tokens"]
+
+
+def estimate_paths(plots, questions, *, batch_size: int, num_repeats: int, model: str):
+    single = {"requests": 0, "prompt_tokens": 0}
+    batched = {"requests": 0, "prompt_tokens": 0}
+    for question in questions:
+        for _, url in plots:
+            single["requests"] += num_repeats
+            single["prompt_tokens"] += num_repeats * estimate_tokens(create_plot_messages(url, question), model=model)
+        for i in range(0, len(plots), batch_size):
+            batched["requests"] += num_repeats
+            batched["prompt_tokens"] += num_repeats * estimate_tokens(create_plot_batch_messages(plots[i:i + batch_size], question), model=model)
+    return single, batched
+
+
+class CountingCompletion:
+    """Wraps run_completion to count the requests and tokens of a live run."""
+
+    def __init__(self, run_completion):
+        self.run_completion = run_completion
+        self.requests = 0
+        self.prompt_tokens = 0
+        self.completion_tokens = 0
+
+    def __call__(self, messages, **kwargs):
+        content, conversation, prompt_tokens, completion_tokens = self.run_completion(messages, **kwargs)
+        self.requests += 1
+        self.prompt_tokens += prompt_tokens
+        self.completion_tokens += completion_tokens
+        return content, conversation, prompt_tokens, completion_tokens
+
+
+def run_live(notebook_path: str, *, batch_size: int, model: str):
+    original = run_plot_ratings.run_completion
+    counter = CountingCompletion(original)
+    run_plot_ratings.run_completion = counter
+    try:
+        timer = time.perf_counter()
+        result = rate_notebook_plots(notebook_path=notebook_path, model=model, plot_batch_size=batch_size)
+        elapsed = time.perf_counter() - timer
+    finally:
+        run_plot_ratings.run_completion = original
+    scores = {(p["plot_id"], s["name"]): s["score"] for p in result["plots"] for s in p["scores"]}
+    return {
+        "requests": counter.requests,
+        "prompt_tokens": counter.prompt_tokens,
+        "completion_tokens": counter.completion_tokens,
+        "seconds": elapsed,
+        "scores": scores,
+    }
+
+
+def report(label: str, single, batched, keys):
+    print(label)
+    for key in keys:
+        ratio = batched[key] / single[key] if single[key] else float("nan")
+        print(f"  {key:>18}: {single[key]:>10.0f} -> {batched[key]:>10.0f}  ({ratio:.2f}x)")
+
+
+@click.command()
+@click.option("--batch-size", type=int, default=4, help="Plots per request in the batched path")
+@click.option("--model", default=default_model, help="Model for the estimates and the live ratings")
+@click.option("--live", "num_live", type=int, default=0, help="Also rate the plots of this many notebooks with both paths (calls the API)")
+@click.argument("notebooks", nargs=-1)
+def main(batch_size, model, num_live, notebooks):
+    notebook_paths = list(notebooks) or [p for _, p in find_notebooks("dandisets")]
+    with open("plot_rubric.yml", "r") as f:
+        questions = yaml.safe_load(f)["questions"]
+    num_repeats = run_plot_ratings.num_repeats
+
+    single_total = {"requests": 0, "prompt_tokens": 0}
+    batched_total = {"requests": 0, "prompt_tokens": 0}
+    num_plots = 0
+    for notebook_path in notebook_paths:
+        plots = get_plots(notebook_path)
+        num_plots += len(plots)
+        single, batched = estimate_paths(plots, questions, batch_size=batch_size, num_repeats=num_repeats, model=model)
+        for key in single_total:
+            single_total[key] += single[key]
+            batched_total[key] += batched[key]
+    print(f"{len(notebook_paths)} notebooks, {num_plots} plots, {len(questions)} questions, {num_repeats} repetitions, batch size {batch_size}")
+    report("Estimated (single -> batched)", single_total, batched_total, ["requests", "prompt_tokens"])
+
+    live_notebooks = [p for p in notebook_paths if get_plots(p)][:num_live]
+    if not live_notebooks:
+        return
+    single_total = {"requests": 0, "prompt_tokens": 0, "completion_tokens": 0, "seconds": 0.0}
+    batched_total = dict(single_total)
+    differences = []
+    for notebook_path in live_notebooks:
+        print(f"\nRating {notebook_path}")
+        single = run_live(notebook_path, batch_size=1, model=model)
+        batched = run_live(notebook_path, batch_size=batch_size, model=model)
+        for key in single_total:
+            single_total[key] += single[key]
+            batched_total[key] += batched[key]
+        differences.extend(abs(batched["scores"][k] - s) for k, s in single["scores"].items() if k in batched["scores"])
+    print("")
+    report(f"Live, {len(live_notebooks)} notebooks (single -> batched)", single_total, batched_total, ["requests", "prompt_tokens", "completion_tokens", "seconds"])
+    if differences:
+        print(f"  Mean absolute score difference per (plot, question): {statistics.mean(differences):.2f} over {len(differences)}")
+
+
+if __name__ == "__main__":
+    main()
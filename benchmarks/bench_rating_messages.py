@@ -0,0 +1,113 @@
+#!/usr/bin/env python3
+
+"""Measure the CPU time and peak memory of building and serializing the rating requests of notebooks.
+
+Usage: python benchmarks/bench_rating_messages.py [--synthetic-images N] [NOTEBOOK ...]
+
+Run from the repository root. For every (question, rep) of rubric.yml, the
+"before" path rebuilds the messages from the notebook and serializes the whole
+payload, as run_ratings.py used to. The "after" path builds the notebook
+prefix once per notebook and splices its cached serialization into each
+request. Nothing is sent. Each path runs in its own process so that the peak
+RSS of one does not hide the other. --synthetic-images N adds a generated
+notebook with N large image outputs.
+"""
+
+import os
+import sys
+import json
+import time
+import base64
+import random
+import resource
+import subprocess
+import tempfile
+import click
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+import run_ratings  # noqa: E402
+from run_ratings import find_notebooks, load_rubric, load_notebook, create_notebook_prefix, create_messages_for_question, num_repeats  # noqa: E402
+from helpers.run_completion import build_request_body  # noqa: E402
+
+model = "google/gemini-2.0-flash-001"
+
+
+def make_synthetic_notebook(path: str, *, num_images: int, image_bytes: int = 150_000):
+    rng = random.Random(0)
+    cells = []
+    for i in range(num_images):
+        png = b"\x89PNG\r\n\x1a\n" + rng.randbytes(image_bytes)
+        cells.append({"cell_type": "markdown", "metadata": {}, "source": [f"## Figure {i}\n"]})
+        cells.append({
+            "cell_type": "code",
+            "metadata": {},
+            "source": [f"plot_figure({i})\n"],
+            "outputs": [{"output_type": "display_data", "metadata": {}, "data": {"image/png": base64.b64encode(png).decode()}}],
+        })
+    with open(path, "w") as f:
+        json.dump({"cells": cells, "metadata": {}, "nbformat": 4, "nbformat_minor": 5}, f)
+
+
+def run_path(path: str, notebook_paths):
+    num_bytes = 0
+    cpu = time.process_time()
+    for notebook_path in notebook_paths:
+        if path == "before":
+            # the rubric was loaded for every notebook, and the messages rebuilt for every request
+            questions = run_ratings._load_rubric.__wrapped__("rubric.yml", 0)
+        else:
+            questions = load_rubric()
+        _, notebook = load_notebook(notebook_path)
+        cells = notebook["cells"]
+        prefix = create_notebook_prefix(cells) if path == "after" else None
+        for question in questions["questions"]:
+            for _ in range(num_repeats):
+                messages = create_messages_for_question(cells, question, prefix)
+                body = build_request_body({"model": model, "messages": messages}, prefix=prefix)
+                num_bytes += len(body)
+                del messages, body
+    return {
+        "cpu_seconds": time.process_time() - cpu,
+        "peak_rss_mb": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024,
+        "request_bytes": num_bytes,
+    }
+
+
+@click.command()
+@click.option("--synthetic-images", type=int, default=0, help="Add a generated notebook with this many image outputs")
+@click.option("--run-path", "path_to_run", type=click.Choice(["before", "after"]), default=None, hidden=True)
+@click.argument("notebooks", nargs=-1)
+def main(synthetic_images, path_to_run, notebooks):
+    notebook_paths = list(notebooks)
+    if path_to_run:
+        # in the child process
+        print(json.dumps(run_path(path_to_run, notebook_paths)))
+        return
+
+    if not notebook_paths:
+        notebook_paths = [p for _, p in find_notebooks("dandisets")]
+    tmp_dir = tempfile.mkdtemp()
+    if synthetic_images:
+        # named like a notebook in dandisets/ so that the result has a dandiset_id and subfolder
+        synthetic_path = os.path.join(tmp_dir, "000000", "synthetic", "000000.ipynb")
+        os.makedirs(os.path.dirname(synthetic_path))
+        make_synthetic_notebook(synthetic_path, num_images=synthetic_images)
+        notebook_paths.append(synthetic_path)
+
+    num_questions = len(load_rubric()["questions"])
+    print(f"{len(notebook_paths)} notebooks, {num_questions} questions x {num_repeats} repetitions each")
+    results = {}
+    for path in ["before", "after"]:
+        out = subprocess.run(
+            [sys.executable, os.path.abspath(__file__), "--run-path", path] + notebook_paths,
+            check=True, capture_output=True, text=True
+        ).stdout
+        results[path] = json.loads(out.strip().splitlines()[-1])
+    for key in ["cpu_seconds", "peak_rss_mb", "request_bytes"]:
+        before, after = results["before"][key], results["after"][key]
+        print(f"  {key:>14}: {before:>14.2f} -> {after:>14.2f}  ({after / before if before else float('nan'):.2f}x)")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,82 @@
+#!/usr/bin/env python3
+
+"""Compare ways of encoding rating requests: encode time and bytes on the wire.
+
+Usage: python benchmarks/bench_request_encoding.py [--synthetic-images N] [--repeats N] [NOTEBOOK ...]
+
+Run from the repository root. For each notebook, the request for the first
+question of rubric.yml is encoded with:
+
+- json: json.dumps of the whole payload, as requests.post(json=...) does
+- orjson: orjson.dumps of the whole payload (if orjson is installed)
+- prefix: build_request_body with the notebook prefix already serialized,
+  which is the cost of every request of a notebook after the first
+- gzip-1, gzip-6: the body compressed at that level
+
+The times are per request, the median over the repeats.
+"""
+
+import os
+import sys
+import gzip
+import json
+import time
+import tempfile
+import statistics
+import click
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from run_ratings import find_notebooks, load_rubric, load_notebook, create_notebook_prefix, create_messages_for_question  # noqa: E402
+from helpers.run_completion import build_request_body, orjson  # noqa: E402
+from bench_rating_messages import make_synthetic_notebook  # noqa: E402
+
+model = "google/gemini-2.0-flash-001"
+
+
+def time_call(fn, *, repeats: int):
+    times = []
+    for _ in range(repeats):
+        timer = time.perf_counter()
+        result = fn()
+        times.append(time.perf_counter() - timer)
+    return statistics.median(times), result
+
+
+@click.command()
+@click.option("--synthetic-images", type=int, default=20, help="Add a generated notebook with this many image outputs (0 for none)")
+@click.option("--repeats", type=int, default=5, help="Encodings per method")
+@click.argument("notebooks", nargs=-1)
+def main(synthetic_images, repeats, notebooks):
+    notebook_paths = list(notebooks) or [p for _, p in find_notebooks("dandisets")]
+    if synthetic_images:
+        synthetic_path = os.path.join(tempfile.mkdtemp(), "000000", "synthetic", "000000.ipynb")
+        os.makedirs(os.path.dirname(synthetic_path))
+        make_synthetic_notebook(synthetic_path, num_images=synthetic_images)
+        notebook_paths.append(synthetic_path)
+    question = load_rubric()["questions"][0]
+
+    for notebook_path in notebook_paths:
+        _, notebook = load_notebook(notebook_path)
+        prefix = create_notebook_prefix(notebook["cells"])
+        prefix.json_bytes()
+        payload = {"model": model, "messages": create_messages_for_question(notebook["cells"], question, prefix)}
+
+        methods = {"json": lambda: json.dumps(payload).encode()}
+        if orjson is not None:
+            methods["orjson"] = lambda: orjson.dumps(payload)
+        methods["prefix"] = lambda: build_request_body(payload, prefix=prefix)
+        body = build_request_body(payload, prefix=prefix)
+        methods["gzip-1"] = lambda: gzip.compress(body, compresslevel=1)
+        methods["gzip-6"] = lambda: gzip.compress(body, compresslevel=6)
+
+        print(f"\n{notebook_path}")
+        for name, fn in methods.items():
+            seconds, result = time_call(fn, repeats=repeats)
+            print(f"  {name:>8}: {seconds * 1000:>9.2f} ms  {len(result) / 1e6:>8.2f} MB")
+    if orjson is None:
+        print("\norjson is not installed, so run_completion uses json")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,60 @@
+#!/usr/bin/env python3
+
+"""Compare the latency of tools_cli.py invocations with and without a running tools server.
+
+Usage: python benchmarks/bench_tools_startup.py [--repeats N] [-- COMMAND ...]
+
+The default command is --help, which measures start-up overhead only. Pass a
+real command (e.g. -- dandiset-info 000673) to include the tool itself.
+"""
+
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+import click
+
+templates_dir = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "templates")
+
+
+def time_command(args, *, env, repeats: int):
+    times = []
+    for _ in range(repeats):
+        timer = time.perf_counter()
+        subprocess.run(["python"] + args, cwd=templates_dir, env=env, check=True, capture_output=True)
+        times.append(time.perf_counter() - timer)
+    return times
+
+
+def report(label: str, times):
+    print(f"{label}: median {statistics.median(times) * 1000:.1f} ms, min {min(times) * 1000:.1f} ms, max {max(times) * 1000:.1f} ms")
+
+
+@click.command(context_settings={"ignore_unknown_options": True})
+@click.option("--repeats", type=int, default=10, help="Number of invocations per path")
+@click.argument("command", nargs=-1, type=click.UNPROCESSED)
+def main(repeats, command):
+    command = list(command) or ["--help"]
+    socket_path = os.path.join(tempfile.mkdtemp(), "tools.sock")
+    env = dict(os.environ, DANDI_TOOLS_SOCKET=socket_path)
+
+    print(f"Command: {' '.join(command)} ({repeats} repeats)")
+    report("tools_cli.py, no server", time_command(["tools_cli.py"] + command, env=env, repeats=repeats))
+
+    server = subprocess.Popen(["python", "tools_cli.py", "serve", "--socket", socket_path], cwd=templates_dir, env=env)
+    try:
+        while not os.path.exists(socket_path):
+            time.sleep(0.05)
+        # the first request pays for any lazy imports in the server
+        time_command(["tools_client.py"] + command, env=env, repeats=1)
+        report("tools_client.py, server", time_command(["tools_client.py"] + command, env=env, repeats=repeats))
+        report("tools_cli.py, server", time_command(["tools_cli.py"] + command, env=env, repeats=repeats))
+    finally:
+        server.terminate()
+        server.wait()
+
+
+if __name__ == "__main__":
+    main()
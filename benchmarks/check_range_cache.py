@@ -0,0 +1,186 @@
+#!/usr/bin/env python3
+
+"""Check templates/range_cache.py against a local HTTP server with Range support.
+
+Usage: python benchmarks/check_range_cache.py [--file-mb N] [--block-kb N] [--seed N]
+
+A random file is served from a temporary directory by a local http.server
+that answers HEAD and single-range GET requests (206). The script checks:
+
+- reads: random reads, reads across block boundaries and reads at the end
+  of the file return the bytes of the file
+- cache hits: reading the file again with a new file object sends no request
+- eviction: a cache bounded to a few blocks stays near its bound, and keeps the
+  most recently used blocks
+- a server that ignores Range (200 with the whole file) still gives the right bytes
+- concurrent reads from several threads through one cache
+
+Exits with status 1 if a check fails.
+"""
+
+import os
+import sys
+import random
+import tempfile
+import threading
+from http.server import SimpleHTTPRequestHandler, ThreadingHTTPServer
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+import click
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "templates"))
+
+from range_cache import BlockCache, CachedHTTPFile, open_url  # noqa: E402
+
+
+class RangeRequestHandler(SimpleHTTPRequestHandler):
+    """Serves files with support for a single "Range: bytes=start-end" header, counting the requests."""
+
+    counts = {"HEAD": 0, "GET": 0}
+    ignore_range = False
+    lock = threading.Lock()
+
+    def log_message(self, format, *args):
+        pass
+
+    def do_HEAD(self):
+        with self.lock:
+            self.counts["HEAD"] += 1
+        super().do_HEAD()
+
+    def do_GET(self):
+        with self.lock:
+            self.counts["GET"] += 1
+        range_header = self.headers.get("Range")
+        if range_header is None or self.ignore_range:
+            super().do_GET()
+            return
+        path = self.translate_path(self.path)
+        with open(path, "rb") as f:
+            data = f.read()
+        start, end = (int(x) for x in range_header.removeprefix("bytes=").split("-"))
+        end = min(end, len(data) - 1)
+        body = data[start:end + 1]
+        self.send_response(206)
+        self.send_header("Content-Range", f"bytes {start}-{end}/{len(data)}")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+
+def get_cache_bytes(cache_dir: str) -> int:
+    total = 0
+    for dirpath, _, filenames in os.walk(cache_dir):
+        for fname in filenames:
+            if fname != "meta.json" and not fname.startswith("."):
+                total += os.path.getsize(os.path.join(dirpath, fname))
+    return total
+
+
+@click.command()
+@click.option("--file-mb", type=float, default=4, help="Size of the served file")
+@click.option("--block-kb", type=int, default=64, help="Block size of the cache")
+@click.option("--seed", type=int, default=0, help="Random seed for the file and the reads")
+def main(file_mb, block_kb, seed):
+    rng = random.Random(seed)
+    block_size = block_kb * 1024
+    serve_dir = tempfile.mkdtemp()
+    data = rng.randbytes(int(file_mb * 1024 * 1024))
+    with open(os.path.join(serve_dir, "data.bin"), "wb") as f:
+        f.write(data)
+    handler = partial(RangeRequestHandler, directory=serve_dir)
+    server = ThreadingHTTPServer(("127.0.0.1", 0), handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    url = f"http://127.0.0.1:{server.server_address[1]}/data.bin"
+    counts = RangeRequestHandler.counts
+    failures = []
+
+    def check(name: str, ok: bool, detail: str = ""):
+        print(f"{'ok  ' if ok else 'FAIL'} {name}{f' ({detail})' if detail else ''}")
+        if not ok:
+            failures.append(name)
+
+    def reset_counts():
+        counts["HEAD"] = counts["GET"] = 0
+
+    try:
+        cache = BlockCache(tempfile.mkdtemp(), block_size=block_size, max_bytes=1 << 40)
+        f = CachedHTTPFile(url, cache=cache)
+        check("size from HEAD", f.size == len(data), f"{f.size} bytes")
+
+        reads = [(rng.randrange(len(data)), rng.randrange(1, 3 * block_size)) for _ in range(100)]
+        # across each of the first block boundaries, and up to and past the end of the file
+        reads += [(i * block_size - 10, 20) for i in range(1, 5)]
+        reads += [(len(data) - 100, 100), (len(data) - 10, 1000), (len(data), 10)]
+        wrong = 0
+        for offset, length in reads:
+            f.seek(offset)
+            if f.read(length) != data[offset:offset + length]:
+                wrong += 1
+        check("random and boundary reads", wrong == 0, f"{wrong} of {len(reads)} wrong")
+        f.seek(0)
+        check("full read", f.read() == data)
+        f.close()
+
+        reset_counts()
+        with open_url(url, cache=cache) as f2:
+            check("cache hits", f2.read() == data and counts["GET"] == 0 and counts["HEAD"] == 0,
+                  f"{counts['GET']} GET, {counts['HEAD']} HEAD")
+
+        max_blocks = 4
+        small_cache_dir = tempfile.mkdtemp()
+        small_cache = BlockCache(small_cache_dir, block_size=block_size, max_bytes=max_blocks * block_size)
+        num_blocks = (len(data) + block_size - 1) // block_size
+        f3 = CachedHTTPFile(url, cache=small_cache)
+        for i in range(num_blocks):
+            f3.seek(i * block_size)
+            f3.read(1)
+        cache_bytes = get_cache_bytes(small_cache_dir)
+        # eviction runs after a block is written, so the cache can exceed its bound by at most a block
+        check("eviction bound", cache_bytes <= (max_blocks + 1) * block_size,
+              f"{cache_bytes} bytes for a bound of {max_blocks * block_size}")
+        reset_counts()
+        f3.seek((num_blocks - 1) * block_size)
+        f3.read(1)
+        check("most recent block kept", counts["GET"] == 0, f"{counts['GET']} GET")
+        reset_counts()
+        f3.seek(0)
+        check("oldest block evicted", f3.read(block_size) == data[:block_size] and counts["GET"] == 1, f"{counts['GET']} GET")
+        f3.close()
+
+        RangeRequestHandler.ignore_range = True
+        try:
+            no_range_cache = BlockCache(tempfile.mkdtemp(), block_size=block_size, max_bytes=1 << 40)
+            with open_url(url, cache=no_range_cache) as f4:
+                f4.seek(block_size + 5)
+                check("server without Range support", f4.read(block_size) == data[block_size + 5:2 * block_size + 5])
+        finally:
+            RangeRequestHandler.ignore_range = False
+
+        shared_cache = BlockCache(tempfile.mkdtemp(), block_size=block_size, max_bytes=1 << 40)
+
+        def read_randomly(thread_seed: int) -> int:
+            thread_rng = random.Random(thread_seed)
+            wrong = 0
+            with open_url(url, cache=shared_cache) as f5:
+                for _ in range(50):
+                    offset, length = thread_rng.randrange(len(data)), thread_rng.randrange(1, 2 * block_size)
+                    f5.seek(offset)
+                    if f5.read(length) != data[offset:offset + length]:
+                        wrong += 1
+            return wrong
+
+        with ThreadPoolExecutor(max_workers=8) as executor:
+            wrong = sum(executor.map(read_randomly, range(8)))
+        check("concurrent reads", wrong == 0, f"{wrong} wrong")
+    finally:
+        server.shutdown()
+
+    if failures:
+        print(f"\n{len(failures)} checks failed")
+        sys.exit(1)
+    print("\nAll checks passed")
+
+
+if __name__ == "__main__":
+    main()
@@ -7,12 +7,16 @@ from pathlib import Path
 from typing import Dict, Any
 from typing import List, Tuple
 import re
-from helpers.run_completion import run_completion
+from helpers.run_completion import run_completion, print_telemetry
+from helpers.output_compaction import OutputCompactor
+from helpers.batch_requests import BatchPending, BatchWriter, BatchResults, make_custom_id
 
 prompt_version = '1'
 
 model_for_cells = "google/gemini-2.0-flash-001"
 model_for_summary = "anthropic/claude-3.7-sonnet"
+# limits on the notebook outputs sent to the critic (see helpers/output_compaction.py), or None to send them verbatim
+output_compaction = None
 
 def find_notebooks(base_dir: str, *, prefix: str) -> List[Tuple[str, str]]:
     """Find notebooks matching the pattern dandisets/<DANDISET_ID>/subfolder/<DANDISET_ID>.ipynb."""
@@ -56,8 +60,14 @@ def read_notebook_critic_summary_system_prompt() -> str:
         content = f.read()
     return content
 
-def create_user_message_content_for_cell(cell: Dict[str, Any]) -> List[Dict[str, Any]]:
-    """Create user message content for a given cell."""
+def create_user_message_content_for_cell(
+    cell: Dict[str, Any], compactor: OutputCompactor | None = None
+) -> List[Dict[str, Any]]:
+    """Create user message content for a given cell.
+
+    If a compactor is provided, text and HTML outputs are truncated and images
+    are dropped according to its limits.
+    """
     content: List[Dict[str, Any]] = []
     if cell["cell_type"] == "markdown":
         markdown_source = cell["source"]
@@ -70,28 +80,41 @@ def create_user_message_content_for_cell(cell: Dict[str, Any]) -> List[Dict[str,
         for x in cell["outputs"]:
             output_type = x["output_type"]
             if output_type == "stream":
+                text = "\n".join(x["text"])
+                if compactor is not None:
+                    text = compactor.compact_text(text)
                 content.append(
-                    {"type": "text", "text": "OUTPUT-TEXT: " + "\n".join(x["text"])}
+                    {"type": "text", "text": "OUTPUT-TEXT: " + text}
                 )
             elif output_type == "display_data" or output_type == "execute_result":
-                if "image/png" in x["data"]:
+                if "image/png" in x["data"] and compactor is not None and not compactor.allow_image():
+                    content.append(
+                        {"type": "text", "text": "OUTPUT-IMAGE: [image omitted: the notebook's image limit was reached]"}
+                    )
+                elif "image/png" in x["data"]:
                     png_base64 = x["data"]["image/png"]
                     image_data_url = f"data:image/png;base64,{png_base64}"
                     content.append(
                         {"type": "image_url", "image_url": {"url": image_data_url}}
                     )
                 elif "text/plain" in x["data"]:
+                    text = "".join(x["data"]["text/plain"])
+                    if compactor is not None:
+                        text = compactor.compact_text(text)
                     content.append(
                         {
                             "type": "text",
-                            "text": "OUTPUT-TEXT: " + "".join(x["data"]["text/plain"]),
+                            "text": "OUTPUT-TEXT: " + text,
                         }
                     )
                 elif "text/html" in x["data"]:
+                    html = "".join(x["data"]["text/html"])
+                    if compactor is not None:
+                        html = compactor.compact_html(html)
                     content.append(
                         {
                             "type": "text",
-                            "text": "OUTPUT-HTML: " + "".join(x["data"]["text/html"]),
+                            "text": "OUTPUT-HTML: " + html,
                         }
                     )
                 else:
@@ -163,10 +186,11 @@ def critique_notebook(*,
             "content": system_prompt,
         }
     ]
+    compactor = OutputCompactor(output_compaction) if output_compaction is not None else None
     for i, cell in enumerate(cells):
         print(f'Processing cell {i + 1}/{len(cells)}')
         print("==================")
-        content = create_user_message_content_for_cell(cell)
+        content = create_user_message_content_for_cell(cell, compactor)
         messages.append(
             {
                 "role": "user",
@@ -187,8 +211,13 @@ def critique_notebook(*,
 
     return result, total_prompt_tokens, total_completion_tokens
 
-def get_summary_critique(cell_critiques: List[Dict[str, Any]]) -> Tuple[str, int, int]:
-    """Get summary critique for the notebook."""
+def get_summary_critique(cell_critiques: List[Dict[str, Any]], *, batch=None, batch_key: str = "") -> Tuple[str, int, int]:
+    """Get summary critique for the notebook.
+
+    If batch is provided (see helpers/batch_requests.py), the completion comes
+    from it instead of the API, with a custom ID derived from batch_key, and
+    BatchPending propagates.
+    """
     system_prompt = read_notebook_critic_summary_system_prompt()
     messages: List[Dict[str, Any]] = [
         {
@@ -207,9 +236,15 @@ def get_summary_critique(cell_critiques: List[Dict[str, Any]]) -> Tuple[str, int
             "content": user_message
         }
     )
-    assistant_response, _, prompt_tokens, completion_tokens = run_completion(
-        messages=messages, model=model_for_summary
-    )
+    if batch is not None:
+        custom_id = make_custom_id("summary_critique", batch_key, prompt_version, model_for_summary, messages)
+        assistant_response, prompt_tokens, completion_tokens = batch(
+            custom_id, messages=messages, model=model_for_summary
+        )
+    else:
+        assistant_response, _, prompt_tokens, completion_tokens = run_completion(
+            messages=messages, model=model_for_summary
+        )
     print(assistant_response)
     print("")
     return assistant_response, prompt_tokens, completion_tokens
@@ -260,7 +295,13 @@ def do_cell_critiques():
         print(f"Total completion tokens: {total_completion_tokens}")
 
 
-def do_summary_critiques():
+def do_summary_critiques(*, export_batch: str | None = None, import_batch: str | None = None):
+    batch = None
+    if export_batch:
+        batch = BatchWriter(export_batch)
+    elif import_batch:
+        batch = BatchResults(import_batch)
+
     notebooks = find_notebooks("dandisets", prefix="2025-04-16")
     print(f"Found {len(notebooks)} notebooks to process")
 
@@ -292,9 +333,12 @@ def do_summary_critiques():
             continue
 
         if not existing_notebook_critique.get("summary_critique"):
-            summary_critique, prompt_tokens, completion_tokens = get_summary_critique(
-                existing_notebook_critique.get("cell_critiques")
-            )
+            try:
+                summary_critique, prompt_tokens, completion_tokens = get_summary_critique(
+                    existing_notebook_critique.get("cell_critiques"), batch=batch, batch_key=notebook_path
+                )
+            except BatchPending:
+                continue
             total_prompt_tokens += prompt_tokens
             total_completion_tokens += completion_tokens
             existing_notebook_critique["summary_critique"] = summary_critique
@@ -304,16 +348,31 @@ def do_summary_critiques():
             print(f"Total prompt tokens: {total_prompt_tokens}")
             print(f"Total completion tokens: {total_completion_tokens}")
 
+    if isinstance(batch, BatchWriter):
+        batch.save()
+    elif isinstance(batch, BatchResults):
+        batch.report()
+    print_telemetry()
+
 
 if __name__ == "__main__":
     import sys
 
-    if len(sys.argv) != 2 or sys.argv[1] not in ["cells", "summaries"]:
-        print("Usage: python critique_notebooks.py <cells|summaries>")
+    # the cell critiques are a conversation (each request includes the previous responses), so only summaries can be batched
+    usage = "Usage: python critique_notebooks.py <cells|summaries> [--export-batch FILE | --import-batch FILE]"
+    if len(sys.argv) not in [2, 4] or sys.argv[1] not in ["cells", "summaries"]:
+        print(usage)
+        sys.exit(1)
+    if len(sys.argv) == 4 and (sys.argv[1] != "summaries" or sys.argv[2] not in ["--export-batch", "--import-batch"]):
+        print(usage)
         sys.exit(1)
 
     mode = sys.argv[1]
     if mode == "cells":
         do_cell_critiques()
+    elif len(sys.argv) == 4 and sys.argv[2] == "--export-batch":
+        do_summary_critiques(export_batch=sys.argv[3])
+    elif len(sys.argv) == 4:
+        do_summary_critiques(import_batch=sys.argv[3])
     else:
         do_summary_critiques()
@@ -38,7 +38,8 @@ function App() {
         axios.get('https://raw.githubusercontent.com/dandi-ai-notebooks/dandi-ai-notebooks-2/refs/heads/main/ratings.json'),
         axios.get('https://raw.githubusercontent.com/dandi-ai-notebooks/dandi-ai-notebooks-2/refs/heads/main/plot_ratings.json')
       ]);
-      setRatings(ratingsResponse.data);
+      // ratings saved before every question was done have a partial overall_score
+      setRatings(ratingsResponse.data.filter((r: Rating) => !r.incomplete));
       setPlotRatings(plotRatingsResponse.data);
     } catch (err) {
       setError('Failed to load ratings data');
@@ -3,6 +3,7 @@ export interface Rating {
   dandiset_id: string;
   subfolder: string;
   overall_score: number;
+  incomplete?: boolean;
   scores: Score[];
   metadata?: RatingMetadata;
 }
@@ -0,0 +1,278 @@
+#!/usr/bin/env python3
+
+"""Export ratings, plot ratings and critiques to Parquet tables.
+
+    python export_parquet.py [-o parquet]
+
+Tables (one file each in the output directory):
+
+- scores: one row per notebook question, with the mean score
+- reps: one row per repetition of a notebook question, with the rater's thinking
+- plots: one row per plot question, with the mean score
+- plot_reps: one row per repetition of a plot question, with the rater's thinking
+- critiques: one row per critiqued notebook
+- metadata: one row per rated notebook, with the generation tokens and elapsed time,
+  and whether the rating is incomplete (its overall_score is then partial)
+
+Every table has a notebook column. The export is incremental: manifest.json
+records a hash of each notebook's entry in the source files, and only the
+rows of notebooks that changed are rebuilt.
+"""
+
+import os
+import json
+import hashlib
+import click
+import pyarrow as pa
+import pyarrow.compute as pc
+import pyarrow.parquet as pq
+from typing import Any, Callable, Dict, List
+from helpers.run_info import get_run_info
+from helpers.json_io import save_json_atomic
+
+run_fields = [
+    ("notebook", pa.string()),
+    ("dandiset_id", pa.string()),
+    ("subfolder", pa.string()),
+    ("date", pa.string()),
+    ("model", pa.string()),
+    ("prompt", pa.string()),
+]
+
+schemas = {
+    "scores": pa.schema(run_fields + [
+        ("question", pa.string()),
+        ("version", pa.int64()),
+        ("score", pa.float64()),
+        ("num_reps", pa.int64()),
+    ]),
+    "reps": pa.schema([
+        ("notebook", pa.string()),
+        ("question", pa.string()),
+        ("version", pa.int64()),
+        ("repnum", pa.int64()),
+        ("score", pa.float64()),
+        ("thinking", pa.string()),
+    ]),
+    "plots": pa.schema(run_fields + [
+        ("plot_id", pa.string()),
+        ("cell_index", pa.int64()),
+        ("output_index", pa.int64()),
+        ("question", pa.string()),
+        ("version", pa.int64()),
+        ("score", pa.float64()),
+        ("num_reps", pa.int64()),
+    ]),
+    "plot_reps": pa.schema([
+        ("notebook", pa.string()),
+        ("plot_id", pa.string()),
+        ("question", pa.string()),
+        ("version", pa.int64()),
+        ("repnum", pa.int64()),
+        ("score", pa.float64()),
+        ("thinking", pa.string()),
+    ]),
+    "critiques": pa.schema([
+        ("notebook", pa.string()),
+        ("dandiset_id", pa.string()),
+        ("subfolder", pa.string()),
+        ("prompt_version", pa.string()),
+        ("cell_critiques", pa.list_(pa.string())),
+        ("summary_critique", pa.string()),
+    ]),
+    "metadata": pa.schema(run_fields + [
+        ("overall_score", pa.float64()),
+        ("incomplete", pa.bool_()),
+        ("total_prompt_tokens", pa.int64()),
+        ("total_completion_tokens", pa.int64()),
+        ("total_vision_prompt_tokens", pa.int64()),
+        ("total_vision_completion_tokens", pa.int64()),
+        ("elapsed_time_seconds", pa.float64()),
+        ("timestamp", pa.string()),
+        ("dandi_notebook_gen_version", pa.string()),
+    ]),
+}
+
+
+def get_run_row(entry: Dict[str, Any]) -> Dict[str, Any]:
+    run_info = get_run_info(entry)
+    return {
+        "notebook": entry["notebook"],
+        "dandiset_id": entry["dandiset_id"],
+        "subfolder": entry["subfolder"],
+        "date": run_info["date"],
+        "model": run_info["model"],
+        "prompt": run_info["prompt"],
+    }
+
+
+def rows_from_rating(rating: Dict[str, Any]) -> Dict[str, List[Dict[str, Any]]]:
+    run_row = get_run_row(rating)
+    metadata = rating.get("metadata", {})
+    rows: Dict[str, List[Dict[str, Any]]] = {"scores": [], "reps": [], "metadata": []}
+    for score in rating["scores"]:
+        rows["scores"].append(dict(run_row, question=score["name"], version=score["version"], score=score["score"], num_reps=len(score["reps"])))
+        for rep in score["reps"]:
+            rows["reps"].append({
+                "notebook": rating["notebook"],
+                "question": score["name"],
+                "version": score["version"],
+                "repnum": rep["repnum"],
+                "score": rep["score"],
+                "thinking": rep.get("thinking"),
+            })
+    rows["metadata"].append(dict(
+        run_row,
+        overall_score=rating.get("overall_score"),
+        incomplete=bool(rating.get("incomplete")),
+        **{k: metadata.get(k) for k in [
+            "total_prompt_tokens", "total_completion_tokens", "total_vision_prompt_tokens",
+            "total_vision_completion_tokens", "elapsed_time_seconds", "timestamp", "dandi_notebook_gen_version"
+        ]}
+    ))
+    return rows
+
+
+def rows_from_plot_rating(rating: Dict[str, Any]) -> Dict[str, List[Dict[str, Any]]]:
+    run_row = get_run_row(rating)
+    rows: Dict[str, List[Dict[str, Any]]] = {"plots": [], "plot_reps": []}
+    for plot in rating["plots"]:
+        for score in plot["scores"]:
+            rows["plots"].append(dict(
+                run_row,
+                plot_id=plot["plot_id"],
+                cell_index=plot["cell_index"],
+                output_index=plot["output_index"],
+                question=score["name"],
+                version=score["version"],
+                score=score["score"],
+                num_reps=len(score["reps"]),
+            ))
+            for rep in score["reps"]:
+                rows["plot_reps"].append({
+                    "notebook": rating["notebook"],
+                    "plot_id": plot["plot_id"],
+                    "question": score["name"],
+                    "version": score["version"],
+                    "repnum": rep["repnum"],
+                    "score": rep["score"],
+                    "thinking": rep.get("thinking"),
+                })
+    return rows
+
+
+def rows_from_critique(critique: Dict[str, Any]) -> Dict[str, List[Dict[str, Any]]]:
+    return {"critiques": [{
+        "notebook": critique["notebook"],
+        "dandiset_id": critique["dandiset_id"],
+        "subfolder": critique["subfolder"],
+        "prompt_version": critique.get("prompt_version"),
+        "cell_critiques": critique.get("cell_critiques"),
+        "summary_critique": critique.get("summary_critique"),
+    }]}
+
+
+# source name -> (row builder, tables built from it)
+sources: Dict[str, tuple[Callable[[Dict[str, Any]], Dict[str, List[Dict[str, Any]]]], List[str]]] = {
+    "ratings": (rows_from_rating, ["scores", "reps", "metadata"]),
+    "plot_ratings": (rows_from_plot_rating, ["plots", "plot_reps"]),
+    "critiques": (rows_from_critique, ["critiques"]),
+}
+
+
+def hash_entry(entry: Dict[str, Any]) -> str:
+    return hashlib.sha256(json.dumps(entry, sort_keys=True).encode()).hexdigest()
+
+
+def write_table_atomic(table: pa.Table, path: str):
+    tmp_path = f"{path}.tmp"
+    pq.write_table(table, tmp_path, compression="zstd")
+    os.replace(tmp_path, path)
+
+
+def export_source(
+    source: str,
+    entries: List[Dict[str, Any]],
+    *,
+    output_dir: str,
+    previous_hashes: Dict[str, str] | None,
+) -> Dict[str, str]:
+    """Update the tables built from a source file, rebuilding only the rows of changed notebooks.
+
+    Returns the new hashes of the source's entries. With previous_hashes
+    None, the tables are rebuilt from scratch.
+    """
+    build_rows, table_names = sources[source]
+    hashes = {e["notebook"]: hash_entry(e) for e in entries}
+    table_paths = {name: os.path.join(output_dir, f"{name}.parquet") for name in table_names}
+    if previous_hashes is not None and not all(os.path.exists(p) for p in table_paths.values()):
+        previous_hashes = None
+    if previous_hashes is not None and not all(
+        pq.read_schema(p).equals(schemas[name], check_metadata=False) for name, p in table_paths.items()
+    ):
+        # written by a version of this script with other columns
+        previous_hashes = None
+    if previous_hashes is None:
+        changed = set(hashes)
+        stale = set(hashes)
+    else:
+        changed = {nb for nb, h in hashes.items() if previous_hashes.get(nb) != h}
+        # rows to drop from the existing tables: changed notebooks and notebooks no longer in the source
+        stale = changed | (set(previous_hashes) - set(hashes))
+        if not stale:
+            print(f"{source}: no changes")
+            return hashes
+
+    new_rows: Dict[str, List[Dict[str, Any]]] = {name: [] for name in table_names}
+    for e in entries:
+        if e["notebook"] in changed:
+            for name, rows in build_rows(e).items():
+                new_rows[name].extend(rows)
+
+    for name in table_names:
+        new_table = pa.Table.from_pylist(new_rows[name], schema=schemas[name])
+        if previous_hashes is not None:
+            existing = pq.read_table(table_paths[name])
+            keep = pc.invert(pc.is_in(existing["notebook"], value_set=pa.array(sorted(stale), pa.string())))
+            new_table = pa.concat_tables([existing.filter(keep), new_table])
+        new_table = new_table.sort_by("notebook")
+        write_table_atomic(new_table, table_paths[name])
+        print(f"{source}: wrote {name}.parquet ({new_table.num_rows} rows)")
+    print(f"{source}: {len(changed)} notebooks updated, {len(stale - changed)} removed")
+    return hashes
+
+
+@click.command()
+@click.option("-o", "--output-dir", default="parquet", help="Output directory for the Parquet tables")
+@click.option("--ratings", default="ratings.json", help="Notebook ratings file")
+@click.option("--plot-ratings", default="plot_ratings.json", help="Plot ratings file")
+@click.option("--critiques", default="notebook_critiques.json", help="Notebook critiques file")
+@click.option("--full", is_flag=True, help="Rebuild all tables instead of updating them incrementally")
+def main(output_dir, ratings, plot_ratings, critiques, full):
+    """Export ratings, plot ratings and critiques to Parquet tables."""
+    os.makedirs(output_dir, exist_ok=True)
+    manifest_path = os.path.join(output_dir, "manifest.json")
+    manifest: Dict[str, Any] = {"sources": {}}
+    if os.path.exists(manifest_path) and not full:
+        with open(manifest_path, "r") as f:
+            manifest = json.load(f)
+
+    source_files = {"ratings": ratings, "plot_ratings": plot_ratings, "critiques": critiques}
+    for source, fname in source_files.items():
+        if not os.path.exists(fname):
+            print(f"{source}: {fname} not found, skipping")
+            continue
+        with open(fname, "r") as f:
+            entries = json.load(f)
+        manifest["sources"][source] = export_source(
+            source,
+            entries,
+            output_dir=output_dir,
+            previous_hashes=manifest["sources"].get(source),
+        )
+        # save after each source so that an interrupted export stays consistent with the tables
+        save_json_atomic(manifest_path, manifest)
+
+
+if __name__ == "__main__":
+    main()
@@ -7,17 +7,25 @@ from datetime import datetime
 import yaml
 import subprocess
 from pathlib import Path
+from typing import Any, Dict, Optional
 from dotenv import load_dotenv
 
 load_dotenv()
 
-def create_config(output_dir: str, model: str, prompt: str, dandiset_id: str):
-    """Create the config.yaml file in the output directory."""
+# config.yaml keys that turn on optional features of generate.py
+generation_option_keys = ['prefetch', 'tools_server', 'range_cache', 'profile_cells']
+
+def create_config(output_dir: str, model: str, prompt: str, dandiset_id: str, options: Optional[Dict[str, Any]] = None):
+    """Create the config.yaml file in the output directory, with any of the generation_option_keys in options."""
     config = {
         'model': model,
         'prompt': prompt,
         'dandiset_id': dandiset_id
     }
+    for key, value in (options or {}).items():
+        if key not in generation_option_keys:
+            raise Exception(f"Unknown generation option: {key}")
+        config[key] = value
     with open(os.path.join(output_dir, 'config.yaml'), 'w') as f:
         yaml.dump(config, f)
 
@@ -27,6 +35,9 @@ def copy_template_files(output_dir: str, prompt: str):
     files_to_copy = [
         'tools.py',
         'tools_cli.py',
+        'tools_client.py',
+        'range_cache.py',
+        'kernel_pool.py',
         'generate.py',
         f'{prompt}.txt'
     ]
@@ -36,19 +47,17 @@ def copy_template_files(output_dir: str, prompt: str):
         dst = os.path.join(output_dir, file)
         shutil.copy2(src, dst)
 
-@click.command()
-@click.argument('dandiset_id')
-@click.argument('model')
-@click.argument('prompt')
-def main(dandiset_id: str, model: str, prompt: str):
-    """Generate a new notebook directory with template files."""
+def get_output_dir(dandiset_id: str, model: str, prompt: str) -> str:
+    """Get the output directory for a (dandiset, model, prompt) run started today."""
     # Extract the model name after the last '/' if it exists
     model_name = model.split('/')[-1]
 
     # Create the output directory name with current date
     current_date = datetime.now().strftime('%Y-%m-%d')
-    output_dir = os.path.join('dandisets', dandiset_id, f'{current_date}-{model_name}-{prompt}')
+    return os.path.join('dandisets', dandiset_id, f'{current_date}-{model_name}-{prompt}')
 
+def prepare_output_dir(output_dir: str, dandiset_id: str, model: str, prompt: str, options: Optional[Dict[str, Any]] = None):
+    """Create the output directory with config.yaml and the template files."""
     if os.path.exists(output_dir):
         raise Exception(f"Output directory {output_dir} already exists. Please choose a different name or remove the existing directory.")
 
@@ -56,11 +65,29 @@ def main(dandiset_id: str, model: str, prompt: str):
     Path(output_dir).mkdir(parents=True, exist_ok=True)
 
     # Create config.yaml
-    create_config(output_dir, model, prompt, dandiset_id)
+    create_config(output_dir, model, prompt, dandiset_id, options)
 
     # Copy template files
     copy_template_files(output_dir, prompt)
 
+@click.command()
+@click.argument('dandiset_id')
+@click.argument('model')
+@click.argument('prompt')
+@click.option('--prefetch', type=click.Choice(['files', 'prompt']), default=None, help="Run the agent's first tool calls up front and save them to the working directory ('files') or add them to the prompt ('prompt')")
+@click.option('--tools-server', is_flag=True, help="Keep a tools server running so that the agent's tools_cli.py calls skip start-up imports")
+@click.option('--range-cache', is_flag=True, help='Read remote NWB files through a shared block cache')
+@click.option('--profile-cells', is_flag=True, help='Re-execute the final notebook to record the peak memory of each cell')
+def main(dandiset_id: str, model: str, prompt: str, prefetch: Optional[str], tools_server: bool, range_cache: bool, profile_cells: bool):
+    """Generate a new notebook directory with template files."""
+    options = {
+        key: value
+        for key, value in [('prefetch', prefetch), ('tools_server', tools_server), ('range_cache', range_cache), ('profile_cells', profile_cells)]
+        if value
+    }
+    output_dir = get_output_dir(dandiset_id, model, prompt)
+    prepare_output_dir(output_dir, dandiset_id, model, prompt, options)
+
     # Run generate.py in the new directory
     try:
         subprocess.run(['python', 'generate.py'], cwd=output_dir, check=True)
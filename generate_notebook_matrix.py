@@ -0,0 +1,317 @@
+#!/usr/bin/env python
+
+import click
+import os
+import fcntl
+import json
+import shutil
+import signal
+import subprocess
+import itertools
+import resource
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from typing import Any, Dict, List, Optional
+import yaml
+from dotenv import load_dotenv
+from generate_notebook import generation_option_keys, get_output_dir, prepare_output_dir
+
+load_dotenv()
+
+# Example spec file:
+#
+# dandisets: ["000673", "001174"]
+# models: ["anthropic/claude-3.7-sonnet", "google/gemini-2.0-flash-001"]
+# prompts: ["prompt-a-5", "prompt-b-5"]
+# max_workers: 4
+# timeout_seconds: 3600
+# max_cpu_seconds: 3600
+# max_memory_gb: 16
+# # optional features of generate.py, written to each run's config.yaml
+# prefetch: files
+# tools_server: true
+# range_cache: true
+# profile_cells: false
+
+default_max_workers = 4
+
+def load_spec(spec_path: str) -> Dict[str, Any]:
+    """Load a matrix spec from a YAML file."""
+    with open(spec_path, 'r') as f:
+        spec = yaml.safe_load(f) or {}
+    for key in ['dandisets', 'models', 'prompts']:
+        assert key in spec, f"{spec_path} must contain a '{key}' key"
+        assert isinstance(spec[key], list), f"'{key}' in {spec_path} must be a list"
+    # YAML reads unquoted dandiset IDs such as 000673 as integers
+    spec['dandisets'] = [
+        str(d).zfill(6) if isinstance(d, int) else str(d) for d in spec['dandisets']
+    ]
+    assert spec.get('prefetch') in [None, 'files', 'prompt'], f"'prefetch' in {spec_path} must be 'files' or 'prompt'"
+    return spec
+
+def run_key(dandiset_id: str, model: str, prompt: str) -> str:
+    return f'{dandiset_id}|{model}|{prompt}'
+
+class StatusTracker:
+    """Keeps track of the status of each run in a JSON file so that the matrix can be resumed."""
+    def __init__(self, status_fname: str):
+        self.status_fname = status_fname
+        self._lock = threading.Lock()
+        if os.path.exists(status_fname):
+            with open(status_fname, 'r') as f:
+                self.runs: Dict[str, Dict[str, Any]] = json.load(f)
+        else:
+            self.runs = {}
+
+    def get(self, key: str) -> Optional[Dict[str, Any]]:
+        with self._lock:
+            return self.runs.get(key)
+
+    def update(self, key: str, **fields):
+        with self._lock:
+            self.runs.setdefault(key, {}).update(fields)
+            # write to a temporary file first so an interrupted save never corrupts the status file
+            tmp_fname = self.status_fname + '.tmp'
+            with open(tmp_fname, 'w') as f:
+                json.dump(self.runs, f, indent=2)
+            os.replace(tmp_fname, self.status_fname)
+
+def apply_limits(pid: int, max_cpu_seconds: Optional[int], max_memory_gb: Optional[float]):
+    """Apply the resource limits to a started process.
+
+    This is done with prlimit from the parent rather than in a preexec_fn,
+    which is not safe to use while the worker threads are running. The limits
+    are inherited by each command the process spawns afterwards (e.g. jupyter
+    kernels), with each process counted separately.
+    """
+    limits = []
+    if max_cpu_seconds:
+        limits.append((resource.RLIMIT_CPU, max_cpu_seconds))
+    if max_memory_gb:
+        limits.append((resource.RLIMIT_AS, int(max_memory_gb * 1024 ** 3)))
+    for limit, value in limits:
+        try:
+            resource.prlimit(pid, limit, (value, value))
+        except ProcessLookupError:
+            # the process already exited
+            pass
+
+def lock_output_dir(output_dir: str) -> Optional[int]:
+    """Take an exclusive lock on a run's output directory without waiting.
+
+    Returns the file descriptor holding the lock, or None if another process
+    holds it. The lock is released when every copy of the descriptor is closed,
+    including when the processes holding it exit.
+    """
+    fd = os.open(os.path.join(output_dir, '.matrix.lock'), os.O_RDWR | os.O_CREAT)
+    try:
+        fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+    except BlockingIOError:
+        os.close(fd)
+        return None
+    return fd
+
+def run_generation(
+    output_dir: str,
+    *,
+    timeout_seconds: Optional[float],
+    max_cpu_seconds: Optional[int],
+    max_memory_gb: Optional[float],
+    lock_fd: Optional[int] = None
+) -> Dict[str, Any]:
+    """Run generate.py in output_dir with the given limits, logging its output to generate.log.
+
+    If given, lock_fd (from lock_output_dir) is passed on to generate.py, so that
+    the output directory stays locked while it runs even if this process exits.
+    """
+    timer = time.time()
+    with open(os.path.join(output_dir, 'generate.log'), 'w') as log_f:
+        # start a new session so that on timeout we can kill generate.py together with its children
+        proc = subprocess.Popen(
+            ['python', 'generate.py'],
+            cwd=output_dir,
+            stdout=log_f,
+            stderr=subprocess.STDOUT,
+            pass_fds=[lock_fd] if lock_fd is not None else [],
+            start_new_session=True
+        )
+        apply_limits(proc.pid, max_cpu_seconds, max_memory_gb)
+        try:
+            returncode = proc.wait(timeout=timeout_seconds)
+            status = 'done' if returncode == 0 else 'failed'
+        except subprocess.TimeoutExpired:
+            os.killpg(proc.pid, signal.SIGKILL)
+            proc.wait()
+            returncode = None
+            status = 'timeout'
+    return {
+        'status': status,
+        'returncode': returncode,
+        'elapsed_seconds': time.time() - timer
+    }
+
+def aggregate_timings(tracker: StatusTracker) -> List[Dict[str, Any]]:
+    """Collect the metadata.json timings of all completed runs, grouped by model and prompt."""
+    groups: Dict[tuple, Dict[str, Any]] = {}
+    for run in tracker.runs.values():
+        if run.get('status') != 'done':
+            continue
+        metadata_path = os.path.join(run['output_dir'], 'metadata.json')
+        if not os.path.exists(metadata_path):
+            continue
+        with open(metadata_path, 'r') as f:
+            metadata = json.load(f)
+        g = groups.setdefault((run['model'], run['prompt']), {
+            'model': run['model'],
+            'prompt': run['prompt'],
+            'num_runs': 0,
+            'total_elapsed_time_seconds': 0.0,
+            'max_elapsed_time_seconds': 0.0,
+            'total_prompt_tokens': 0,
+            'total_completion_tokens': 0
+        })
+        g['num_runs'] += 1
+        g['total_elapsed_time_seconds'] += metadata['elapsed_time_seconds']
+        g['max_elapsed_time_seconds'] = max(g['max_elapsed_time_seconds'], metadata['elapsed_time_seconds'])
+        g['total_prompt_tokens'] += metadata['total_prompt_tokens']
+        g['total_completion_tokens'] += metadata['total_completion_tokens']
+    summary = sorted(groups.values(), key=lambda x: (x['model'], x['prompt']))
+    for g in summary:
+        g['mean_elapsed_time_seconds'] = g['total_elapsed_time_seconds'] / g['num_runs']
+    return summary
+
+def print_summary(tracker: StatusTracker):
+    counts: Dict[str, int] = {}
+    for run in tracker.runs.values():
+        counts[run.get('status', 'unknown')] = counts.get(run.get('status', 'unknown'), 0) + 1
+    print(f"Run status: {counts}")
+    for g in aggregate_timings(tracker):
+        print(
+            f"{g['model']} {g['prompt']}: {g['num_runs']} runs, "
+            f"mean {g['mean_elapsed_time_seconds']:.1f} s, max {g['max_elapsed_time_seconds']:.1f} s, "
+            f"{g['total_prompt_tokens']} prompt tokens, {g['total_completion_tokens']} completion tokens"
+        )
+
+@click.command()
+@click.option('--spec', type=click.Path(exists=True), default=None, help='YAML file with dandisets, models and prompts lists and optional limits')
+@click.option('--dandiset', 'dandisets', multiple=True, help='Dandiset ID (can be repeated)')
+@click.option('--model', 'models', multiple=True, help='Model (can be repeated)')
+@click.option('--prompt', 'prompts', multiple=True, help='Prompt name, e.g. prompt-a-5 (can be repeated)')
+@click.option('--max-workers', type=int, default=None, help=f'Maximum number of concurrent runs (default: {default_max_workers})')
+@click.option('--timeout', 'timeout_seconds', type=float, default=None, help='Wall time limit per run in seconds')
+@click.option('--max-cpu-seconds', type=int, default=None, help='CPU time limit per process in seconds')
+@click.option('--max-memory-gb', type=float, default=None, help='Address space limit per process in GB')
+@click.option('--prefetch', type=click.Choice(['files', 'prompt']), default=None, help="Run the agent's first tool calls up front, saving them to files or adding them to the prompt")
+@click.option('--tools-server/--no-tools-server', default=None, help="Keep a tools server running during each run")
+@click.option('--range-cache/--no-range-cache', default=None, help='Read remote NWB files through a shared block cache')
+@click.option('--profile-cells/--no-profile-cells', default=None, help='Re-execute each final notebook to record per-cell peak memory')
+@click.option('--status-file', default='generation_status.json', help='JSON file used to track and resume runs')
+@click.option('--retry-failed/--no-retry-failed', default=True, help='Re-run runs that previously failed or timed out')
+@click.option('--summary-only', is_flag=True, help='Only print the status and timing summary')
+def main(spec, dandisets, models, prompts, max_workers, timeout_seconds, max_cpu_seconds, max_memory_gb, prefetch, tools_server, range_cache, profile_cells, status_file, retry_failed, summary_only):
+    """Generate notebooks for every combination of dandisets, models and prompts in parallel."""
+    config: Dict[str, Any] = load_spec(spec) if spec else {}
+    # command-line options take precedence over the spec file
+    if dandisets:
+        config['dandisets'] = list(dandisets)
+    if models:
+        config['models'] = list(models)
+    if prompts:
+        config['prompts'] = list(prompts)
+    for key, value in [
+        ('max_workers', max_workers),
+        ('timeout_seconds', timeout_seconds),
+        ('max_cpu_seconds', max_cpu_seconds),
+        ('max_memory_gb', max_memory_gb),
+        ('prefetch', prefetch),
+        ('tools_server', tools_server),
+        ('range_cache', range_cache),
+        ('profile_cells', profile_cells)
+    ]:
+        if value is not None:
+            config[key] = value
+
+    tracker = StatusTracker(status_file)
+    if summary_only:
+        print_summary(tracker)
+        return
+
+    for key in ['dandisets', 'models', 'prompts']:
+        if not config.get(key):
+            raise click.UsageError(f"No {key} specified. Use --spec or the corresponding options.")
+
+    runs = []
+    for dandiset_id, model, prompt in itertools.product(config['dandisets'], config['models'], config['prompts']):
+        key = run_key(dandiset_id, model, prompt)
+        existing = tracker.get(key)
+        if existing:
+            if existing['status'] == 'done':
+                print(f"Skipping {key}: already done in {existing['output_dir']}")
+                continue
+            if existing['status'] in ['failed', 'timeout'] and not retry_failed:
+                print(f"Skipping {key}: previous run {existing['status']}")
+                continue
+            # an unfinished run (including one interrupted while running) left a partial
+            # output directory behind, which we created, so remove it before starting over,
+            # unless another matrix process is still running it
+            if os.path.exists(existing['output_dir']):
+                lock_fd = lock_output_dir(existing['output_dir'])
+                if lock_fd is None:
+                    print(f"Skipping {key}: {existing['output_dir']} is still in use by another run")
+                    continue
+                print(f"Removing partial output directory {existing['output_dir']}")
+                shutil.rmtree(existing['output_dir'])
+                os.close(lock_fd)
+        output_dir = get_output_dir(dandiset_id, model, prompt)
+        if os.path.exists(output_dir):
+            print(f"Skipping {key}: {output_dir} already exists and was not created by this matrix")
+            continue
+        runs.append((key, dandiset_id, model, prompt, output_dir))
+
+    generation_options = {key: config[key] for key in generation_option_keys if config.get(key) is not None}
+
+    print(f"Starting {len(runs)} runs")
+
+    def do_run(key: str, dandiset_id: str, model: str, prompt: str, output_dir: str):
+        prepare_output_dir(output_dir, dandiset_id, model, prompt, generation_options)
+        lock_fd = lock_output_dir(output_dir)
+        if lock_fd is None:
+            raise Exception(f"{output_dir} is in use by another run")
+        tracker.update(
+            key,
+            dandiset_id=dandiset_id,
+            model=model,
+            prompt=prompt,
+            output_dir=output_dir,
+            status='running',
+            started=time.strftime('%Y-%m-%d %H:%M:%S')
+        )
+        try:
+            result = run_generation(
+                output_dir,
+                timeout_seconds=config.get('timeout_seconds'),
+                max_cpu_seconds=config.get('max_cpu_seconds'),
+                max_memory_gb=config.get('max_memory_gb'),
+                lock_fd=lock_fd
+            )
+            os.remove(os.path.join(output_dir, '.matrix.lock'))
+        finally:
+            os.close(lock_fd)
+        tracker.update(key, finished=time.strftime('%Y-%m-%d %H:%M:%S'), **result)
+        return key, result
+
+    with ThreadPoolExecutor(max_workers=config.get('max_workers', default_max_workers)) as executor:
+        futures = [executor.submit(do_run, *run) for run in runs]
+        for future in as_completed(futures):
+            try:
+                key, result = future.result()
+                print(f"{key}: {result['status']} in {result['elapsed_seconds']:.1f} s")
+            except Exception as e:
+                print(f"Error running generation: {e}")
+
+    print("")
+    print_summary(tracker)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,115 @@
+from typing import Dict, Any, List, Tuple
+import os
+import json
+import hashlib
+from helpers.run_completion import dumps
+
+
+class BatchPending(Exception):
+    """Raised in batch mode for a request whose result is not available (yet)."""
+
+
+def make_custom_id(kind: str, *parts: Any) -> str:
+    """Stable ID of a request: the same unit of work with the same request body always gets the same ID.
+
+    The parts should identify the unit (e.g. notebook, question, version, repnum)
+    and include the model and messages, so that results of a changed request are
+    never imported. IDs are at most 64 characters of [A-Za-z0-9_-], as required
+    by the provider batch endpoints.
+    """
+    key = json.dumps([kind, *parts], sort_keys=True)
+    return f"{kind}-{hashlib.sha256(key.encode()).hexdigest()[:40]}"
+
+
+class BatchWriter:
+    """Collects requests for a batch JSONL file instead of sending them.
+
+    Called like a batch result source, it records the request and raises
+    BatchPending. Lines use the OpenAI batch format (custom_id, method, url,
+    body), where body is the chat completion payload that run_completion would
+    send to OpenRouter.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self.requests: Dict[str, Dict[str, Any]] = {}
+
+    def __call__(self, custom_id: str, *, messages: List[Dict[str, Any]], model: str, **options) -> Tuple[str, int, int]:
+        self.requests[custom_id] = {
+            "custom_id": custom_id,
+            "method": "POST",
+            "url": "/v1/chat/completions",
+            "body": {"model": model, "messages": messages, **options},
+        }
+        raise BatchPending(custom_id)
+
+    def save(self):
+        tmp_path = f"{self.path}.tmp"
+        with open(tmp_path, "wb") as f:
+            for request in self.requests.values():
+                f.write(dumps(request) + b"\n")
+        os.replace(tmp_path, self.path)
+        print(f"Wrote {len(self.requests)} requests to {self.path}")
+
+
+def parse_batch_result_line(line: Dict[str, Any]) -> Tuple[str, int, int] | None:
+    """Get (content, prompt_tokens, completion_tokens) from a line of a results file, or None for a failed request.
+
+    Accepts the OpenAI batch output format, the Anthropic message batch results
+    format and a plain {"custom_id", "content", "prompt_tokens", "completion_tokens"} line.
+    """
+    if "response" in line:
+        response = line["response"] or {}
+        if line.get("error") or response.get("status_code", 200) != 200:
+            return None
+        body = response["body"]
+        usage = body.get("usage", {})
+        return body["choices"][0]["message"].get("content") or "", usage.get("prompt_tokens", 0), usage.get("completion_tokens", 0)
+    if "result" in line:
+        result = line["result"]
+        if result.get("type") != "succeeded":
+            return None
+        message = result["message"]
+        content = "".join(block["text"] for block in message["content"] if block.get("type") == "text")
+        usage = message.get("usage", {})
+        return content, usage.get("input_tokens", 0), usage.get("output_tokens", 0)
+    if "content" in line:
+        return line["content"], line.get("prompt_tokens", 0), line.get("completion_tokens", 0)
+    return None
+
+
+class BatchResults:
+    """Serves completions from a batch results JSONL file, by custom ID.
+
+    Called with a request, it returns (content, prompt_tokens, completion_tokens)
+    or raises BatchPending if the file has no successful result for it.
+    """
+
+    def __init__(self, path: str):
+        self.results: Dict[str, Tuple[str, int, int]] = {}
+        self.used: set[str] = set()
+        num_failed = 0
+        with open(path, "r") as f:
+            for line in f:
+                if not line.strip():
+                    continue
+                obj = json.loads(line)
+                result = parse_batch_result_line(obj)
+                if result is None:
+                    num_failed += 1
+                    continue
+                self.results[obj["custom_id"]] = result
+        print(f"Loaded {len(self.results)} results from {path} ({num_failed} failed requests)")
+
+    def __call__(self, custom_id: str, *, messages: List[Dict[str, Any]], model: str, **options) -> Tuple[str, int, int]:
+        if custom_id not in self.results:
+            raise BatchPending(custom_id)
+        self.used.add(custom_id)
+        return self.results[custom_id]
+
+    def report(self):
+        num_unused = len(self.results) - len(self.used)
+        print(f"Imported {len(self.used)} results")
+        if num_unused:
+            # already imported, or the request changed since the export (e.g. a new question version)
+            print(f"{num_unused} results did not match a pending request")
@@ -0,0 +1,11 @@
+from typing import Any
+import json
+import os
+
+
+def save_json_atomic(fname: str, data: Any):
+    """Save JSON to a temporary file and move it into place, so an interrupted save never corrupts the file."""
+    tmp_fname = f"{fname}.tmp"
+    with open(tmp_fname, "w") as f:
+        json.dump(data, f, indent=2)
+    os.replace(tmp_fname, fname)
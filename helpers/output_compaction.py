@@ -0,0 +1,105 @@
+from typing import Dict, Any, List
+from html.parser import HTMLParser
+from helpers.token_estimate import chars_per_token, estimate_text_tokens
+
+# Default limits, used for any key missing from a compaction config
+default_compaction_config: Dict[str, Any] = {
+    # tokens kept from a single text/HTML output
+    "max_output_tokens": 1500,
+    # tokens kept from all text/HTML outputs of a notebook
+    "max_notebook_output_tokens": 15000,
+    # images kept per notebook (later images are replaced by a note)
+    "max_images": 30,
+    # fraction of a truncated output kept from its start (the rest is kept from its end)
+    "head_fraction": 0.6,
+    # reduce HTML outputs to their text content
+    "html_to_text": True,
+}
+
+_block_tags = {"p", "div", "br", "tr", "li", "ul", "ol", "table", "thead", "tbody", "h1", "h2", "h3", "h4", "h5", "h6", "pre"}
+_cell_tags = {"td", "th"}
+
+
+class _HTMLTextExtractor(HTMLParser):
+    def __init__(self):
+        super().__init__()
+        self.parts: List[str] = []
+        self.skip_depth = 0
+
+    def handle_starttag(self, tag, attrs):
+        if tag in ("style", "script"):
+            self.skip_depth += 1
+        elif tag in _block_tags:
+            self.parts.append("\n")
+        elif tag in _cell_tags:
+            self.parts.append(" | ")
+
+    def handle_endtag(self, tag):
+        if tag in ("style", "script"):
+            self.skip_depth = max(0, self.skip_depth - 1)
+        elif tag in _block_tags:
+            self.parts.append("\n")
+
+    def handle_data(self, data):
+        if self.skip_depth == 0:
+            self.parts.append(data)
+
+
+def html_to_text(html: str) -> str:
+    """Reduce HTML to its text content, keeping table rows on separate lines with | between cells."""
+    extractor = _HTMLTextExtractor()
+    extractor.feed(html)
+    extractor.close()
+    lines = [" ".join(line.split()) for line in "".join(extractor.parts).split("\n")]
+    return "\n".join(line for line in lines if line and line != "|")
+
+
+def truncate_text(text: str, max_tokens: int, *, head_fraction: float = 0.6) -> str:
+    """Keep the start and end of a text within max_tokens, with a marker for the elided middle."""
+    max_chars = int(max_tokens * chars_per_token)
+    if len(text) <= max_chars:
+        return text
+    head_chars = int(max_chars * head_fraction)
+    tail_chars = max_chars - head_chars
+    num_elided = len(text) - head_chars - tail_chars
+    tail = text[len(text) - tail_chars:] if tail_chars > 0 else ""
+    return f"{text[:head_chars]}\n... [{num_elided} characters elided] ...\n{tail}"
+
+
+class OutputCompactor:
+    """Applies the per-output and per-notebook caps to the outputs of one notebook, in cell order.
+
+    Create one per notebook. The same notebook always compacts to the same
+    messages, so the notebook prefix stays identical across rating calls.
+    """
+
+    def __init__(self, config: Dict[str, Any] | None = None):
+        self.config = dict(default_compaction_config, **(config or {}))
+        self.remaining_tokens = self.config["max_notebook_output_tokens"]
+        self.remaining_images = self.config["max_images"]
+        self.stats = {"elided_tokens": 0, "truncated_outputs": 0, "omitted_images": 0}
+
+    def compact_text(self, text: str) -> str:
+        max_tokens = min(self.config["max_output_tokens"], self.remaining_tokens)
+        if max_tokens <= 0:
+            self.stats["elided_tokens"] += estimate_text_tokens(text)
+            self.stats["truncated_outputs"] += 1
+            return "[output omitted: the notebook's output limit was reached]"
+        compacted = truncate_text(text, max_tokens, head_fraction=self.config["head_fraction"])
+        if compacted is not text:
+            self.stats["elided_tokens"] += estimate_text_tokens(text) - max_tokens
+            self.stats["truncated_outputs"] += 1
+        self.remaining_tokens -= min(estimate_text_tokens(text), max_tokens)
+        return compacted
+
+    def compact_html(self, html: str) -> str:
+        if self.config["html_to_text"]:
+            html = html_to_text(html)
+        return self.compact_text(html)
+
+    def allow_image(self) -> bool:
+        if self.remaining_images <= 0:
+            self.stats["omitted_images"] += 1
+            return False
+        self.remaining_images -= 1
+        return True
@@ -0,0 +1,166 @@
+from typing import Any, Dict, List, Tuple
+import numpy as np
+import pandas as pd
+from helpers.run_info import get_run_info, parse_subfolder  # noqa: F401
+
+
+def load_reps(
+    ratings: List[Dict[str, Any]],
+    plot_ratings: List[Dict[str, Any]] | None = None,
+    *,
+    include_incomplete: bool = False,
+) -> pd.DataFrame:
+    """Flatten ratings (and plot ratings) into one row per repetition.
+
+    Columns: kind ("notebook" or "plot"), notebook, dandiset_id, subfolder,
+    date, model, prompt, plot_id (empty for notebook questions), question,
+    version, repnum, score.
+
+    Ratings marked incomplete (saved before every question and repetition was
+    done) are left out unless include_incomplete is set.
+    """
+    columns: Dict[str, List[Any]] = {k: [] for k in [
+        "kind", "notebook", "dandiset_id", "subfolder", "date", "model", "prompt",
+        "plot_id", "question", "version", "repnum", "score"
+    ]}
+
+    def add_reps(kind: str, rating: Dict[str, Any], run_info: Dict[str, Any], plot_id: str, score: Dict[str, Any]):
+        for rep in score["reps"]:
+            columns["kind"].append(kind)
+            columns["notebook"].append(rating["notebook"])
+            columns["dandiset_id"].append(rating["dandiset_id"])
+            columns["subfolder"].append(rating["subfolder"])
+            columns["date"].append(run_info["date"])
+            columns["model"].append(run_info["model"])
+            columns["prompt"].append(run_info["prompt"])
+            columns["plot_id"].append(plot_id)
+            columns["question"].append(score["name"])
+            columns["version"].append(score["version"])
+            columns["repnum"].append(rep["repnum"])
+            columns["score"].append(rep["score"])
+
+    for rating in ratings:
+        if rating.get("incomplete") and not include_incomplete:
+            continue
+        run_info = get_run_info(rating)
+        for score in rating["scores"]:
+            add_reps("notebook", rating, run_info, "", score)
+    for rating in plot_ratings or []:
+        run_info = get_run_info(rating)
+        for plot in rating["plots"]:
+            for score in plot["scores"]:
+                add_reps("plot", rating, run_info, plot["plot_id"], score)
+
+    df = pd.DataFrame(columns)
+    for c in ["kind", "dandiset_id", "subfolder", "date", "model", "prompt", "question"]:
+        df[c] = df[c].astype("category")
+    df["score"] = df["score"].astype(np.float64)
+    return df
+
+
+def unit_scores(reps: pd.DataFrame) -> pd.DataFrame:
+    """Average the repetitions of each rated unit (notebook question, or plot question).
+
+    Adds the number of repetitions and their variance, which measures how
+    consistent the rater is. Units rated with different versions of a
+    question are kept apart.
+    """
+    keys = ["kind", "notebook", "dandiset_id", "model", "prompt", "plot_id", "question", "version"]
+    g = reps.groupby(keys, observed=True, sort=False)["score"]
+    return g.agg(score="mean", num_reps="size", rep_variance="var").reset_index()
+
+
+def notebook_totals(units: pd.DataFrame) -> pd.DataFrame:
+    """Sum the notebook question scores of each notebook, as run_ratings.py does for overall_score.
+
+    Only notebooks rated on every question present in the data are kept, so
+    that totals are comparable. The rubric_version column lists the version
+    of each question, e.g. "load-nwb:2,plot-quality:1".
+    """
+    nb = units[units["kind"] == "notebook"]
+    questions = nb["question"].unique()
+    nb = nb.assign(question_version=nb["question"].astype(str) + ":" + nb["version"].astype(str)).sort_values("question_version")
+    g = nb.groupby(["notebook", "dandiset_id", "model", "prompt"], observed=True)
+    totals = g.agg(
+        score=("score", "sum"),
+        num_questions=("question", "nunique"),
+        rubric_version=("question_version", ",".join),
+    ).reset_index()
+    return totals[totals["num_questions"] == len(questions)].drop(columns="num_questions")
+
+
+def bootstrap_ci(
+    values: np.ndarray,
+    group_ids: np.ndarray,
+    *,
+    num_samples: int = 1000,
+    confidence: float = 0.95,
+    seed: int = 0,
+    max_draws_per_chunk: int = 1_000_000,
+) -> Tuple[np.ndarray, np.ndarray]:
+    """Percentile bootstrap confidence interval of the mean of each group.
+
+    group_ids are integer codes 0..G-1. All groups are resampled with
+    replacement at once: each bootstrap sample draws, for every row, a random
+    row of the same group, and np.add.reduceat sums the draws per group. The
+    samples are drawn in chunks of at most max_draws_per_chunk values, which
+    bounds memory and keeps the draws in cache. Returns (low, high) arrays of length G (NaN for empty groups).
+    """
+    rng = np.random.default_rng(seed)
+    num_groups = int(group_ids.max()) + 1 if len(group_ids) else 0
+    low = np.full(num_groups, np.nan)
+    high = np.full(num_groups, np.nan)
+    if num_groups == 0:
+        return low, high
+    order = np.argsort(group_ids, kind="stable")
+    sorted_values = values[order]
+    counts = np.bincount(group_ids, minlength=num_groups)
+    starts = np.concatenate([[0], np.cumsum(counts)[:-1]])
+    nonempty = counts > 0
+    # the group start and size for each row of sorted_values
+    row_starts = np.repeat(starts, counts)
+    row_counts = np.repeat(counts, counts)
+
+    chunk_size = max(1, max_draws_per_chunk // len(values))
+    means = np.empty((num_samples, int(nonempty.sum())))
+    for chunk_start in range(0, num_samples, chunk_size):
+        n = min(chunk_size, num_samples - chunk_start)
+        draws = rng.random((n, len(values)))
+        draws *= row_counts
+        draws = draws.astype(np.intp)
+        draws += row_starts
+        sums = np.add.reduceat(sorted_values.take(draws), starts[nonempty], axis=1)
+        means[chunk_start:chunk_start + n] = sums / counts[nonempty]
+    alpha = (1 - confidence) / 2
+    low[nonempty], high[nonempty] = np.quantile(means, [alpha, 1 - alpha], axis=0)
+    return low, high
+
+
+def leaderboard(
+    scores: pd.DataFrame,
+    by: List[str],
+    *,
+    num_samples: int = 1000,
+    confidence: float = 0.95,
+    seed: int = 0,
+) -> pd.DataFrame:
+    """Mean score per group with a bootstrap confidence interval over the rows (notebooks or units) in the group.
+
+    If the scores have a rep_variance column, its mean is included. Scores
+    from different question versions (the version column of unit_scores, or
+    rubric_version of notebook_totals) are always in separate groups.
+    """
+    by = by + [c for c in ["version", "rubric_version"] if c in scores.columns and c not in by]
+    g = scores.groupby(by, observed=True)
+    aggs: Dict[str, Any] = {"mean": ("score", "mean"), "std": ("score", "std"), "n": ("score", "size")}
+    if "rep_variance" in scores.columns:
+        aggs["rep_variance"] = ("rep_variance", "mean")
+    board = g.agg(**aggs)
+    group_ids = g.ngroup().to_numpy()
+    low, high = bootstrap_ci(
+        scores["score"].to_numpy(), group_ids, num_samples=num_samples, confidence=confidence, seed=seed
+    )
+    # ngroup numbers the groups in the same (sorted) order as the aggregation
+    board["ci_low"] = low
+    board["ci_high"] = high
+    return board.sort_values("mean", ascending=False).reset_index()
@@ -0,0 +1,192 @@
+from typing import Dict, Any, List
+import json
+import re
+
+# OpenRouter model prefixes whose providers honor a JSON schema response_format
+structured_output_model_prefixes = ["openai/", "google/gemini-"]
+
+_score_patterns = [
+    re.compile(r"<score>\s*(-?\d+(?:\.\d+)?)\s*</?score>"),
+    re.compile(r'"score"\s*:\s*"?(-?\d+(?:\.\d+)?)'),
+    re.compile(r"\bscore\s*[:=]\s*\**\s*(-?\d+(?:\.\d+)?)", re.IGNORECASE),
+]
+
+
+def supports_structured_output(model: str) -> bool:
+    return any(model.startswith(prefix) for prefix in structured_output_model_prefixes)
+
+
+def rating_response_format(*, max_thinking_chars: int) -> Dict[str, Any]:
+    """JSON schema response_format for a rating with length-limited reasoning followed by the score."""
+    return {
+        "type": "json_schema",
+        "json_schema": {
+            "name": "rating",
+            "strict": True,
+            "schema": {
+                "type": "object",
+                "properties": {
+                    "thinking": {
+                        "type": "string",
+                        "description": "Concise reasoning for the score",
+                        "maxLength": max_thinking_chars,
+                    },
+                    "score": {"type": "number", "description": "Numeric score, one of the choices in the rubric"},
+                },
+                "required": ["thinking", "score"],
+                "additionalProperties": False,
+            },
+        },
+    }
+
+
+def rating_json_instructions(*, max_thinking_chars: int) -> str:
+    return f"""
+Respond with a JSON object of the form
+
+{{"thinking": "Your reasoning for the score (at most {max_thinking_chars} characters)", "score": numeric_score}}
+"""
+
+
+def multi_rating_response_format(*, max_thinking_chars: int) -> Dict[str, Any]:
+    """JSON schema response_format for rating several items (e.g. plots) in one response, each identified by its id."""
+    item_schema = rating_response_format(max_thinking_chars=max_thinking_chars)["json_schema"]["schema"]
+    item_schema = dict(
+        item_schema,
+        properties={"id": {"type": "string", "description": "The id of the item"}, **item_schema["properties"]},
+        required=["id"] + item_schema["required"],
+    )
+    return {
+        "type": "json_schema",
+        "json_schema": {
+            "name": "ratings",
+            "strict": True,
+            "schema": {
+                "type": "object",
+                "properties": {"ratings": {"type": "array", "items": item_schema}},
+                "required": ["ratings"],
+                "additionalProperties": False,
+            },
+        },
+    }
+
+
+def multi_rating_json_instructions(*, max_thinking_chars: int) -> str:
+    return f"""
+Respond with a JSON object of the form
+
+{{"ratings": [{{"id": "the id of the item", "thinking": "Your reasoning for the score (at most {max_thinking_chars} characters)", "score": numeric_score}}, ...]}}
+
+with one entry per item, in the order they were given.
+"""
+
+
+def _load_json_object(text: str) -> Dict[str, Any] | None:
+    # models sometimes wrap the JSON in a markdown code block
+    start = text.find("{")
+    end = text.rfind("}")
+    if start == -1 or end <= start:
+        return None
+    try:
+        obj = json.loads(text[start:end + 1])
+    except json.JSONDecodeError:
+        return None
+    return obj if isinstance(obj, dict) else None
+
+
+def _parse_json_rating(text: str) -> Dict[str, Any] | None:
+    obj = _load_json_object(text)
+    if obj is None or "score" not in obj:
+        return None
+    try:
+        score = float(obj["score"])
+    except (TypeError, ValueError):
+        return None
+    return {"thinking": str(obj.get("thinking", "")).strip(), "score": score}
+
+
+def _parse_tagged_rating(text: str, tag: str) -> Dict[str, Any] | None:
+    open_tag = f"<{tag}>"
+    close_tag = f"</{tag}>"
+    ind1 = text.find(open_tag)
+    ind2 = text.find(close_tag)
+    if ind1 == -1 and ind2 >= 0:
+        # sometimes gemini makes a mistake and returns the closing tag for both the opening and closing tags
+        ind1 = ind2
+        ind2 = text.find(close_tag, ind1 + len(close_tag))
+    if ind1 == -1 or ind2 == -1:
+        return None
+    content = text[ind1 + len(open_tag):ind2]
+    thinking_ind1 = content.find("<thinking>")
+    thinking_ind2 = content.find("</thinking>")
+    score_ind1 = content.find("<score>")
+    score_ind2 = content.find("</score>")
+    if thinking_ind1 == -1 or thinking_ind2 == -1 or score_ind1 == -1 or score_ind2 == -1:
+        return None
+    try:
+        score = float(content[score_ind1 + len("<score>"):score_ind2].strip())
+    except ValueError:
+        return None
+    return {"thinking": content[thinking_ind1 + len("<thinking>"):thinking_ind2].strip(), "score": score}
+
+
+def _salvage_rating(text: str) -> Dict[str, Any] | None:
+    # the last score in the response is the most likely to be the final one
+    for pattern in _score_patterns:
+        matches = pattern.findall(text)
+        if matches:
+            thinking = text
+            thinking_ind1 = text.find("<thinking>")
+            if thinking_ind1 != -1:
+                thinking_ind2 = text.find("</thinking>", thinking_ind1)
+                thinking = text[thinking_ind1 + len("<thinking>"):thinking_ind2 if thinking_ind2 != -1 else len(text)]
+            return {"thinking": thinking.strip(), "score": float(matches[-1]), "salvaged": True}
+    return None
+
+
+def parse_rating_response(text: str, *, tag: str, valid_scores: List[float] | None = None) -> Dict[str, Any]:
+    """Parse a rater response into thinking and score.
+
+    Accepts the <tag><thinking/><score/></tag> format or JSON (structured
+    output). If neither parses, the score is salvaged from anything that
+    looks like one (e.g. a truncated response) and "salvaged" is set in the
+    result; a salvaged score must be one of valid_scores, if given. Raises
+    ValueError only if no score can be recovered.
+    """
+    result = _parse_tagged_rating(text, tag) or _parse_json_rating(text)
+    if result is not None:
+        return result
+    result = _salvage_rating(text)
+    if result is not None and (valid_scores is None or result["score"] in valid_scores):
+        return result
+    raise ValueError("Invalid assistant response format")
+
+
+def parse_multi_rating_response(
+    text: str, *, tag: str, ids: List[str], valid_scores: List[float] | None = None
+) -> Dict[str, Dict[str, Any]]:
+    """Parse a response that rates several items into {id: {thinking, score}}.
+
+    Accepts <tag id="..."> blocks, each in the single-rating format, or JSON
+    with a "ratings" list. Items that are missing or have no recoverable score
+    (e.g. at the end of a truncated response) are left out, so that only they
+    need to be rated again.
+    """
+    results: Dict[str, Dict[str, Any]] = {}
+    obj = _load_json_object(text)
+    if obj is not None and isinstance(obj.get("ratings"), list):
+        for r in obj["ratings"]:
+            if not isinstance(r, dict) or "id" not in r:
+                continue
+            a = _parse_json_rating(json.dumps(r))
+            if a is not None:
+                results[str(r["id"])] = a
+    else:
+        # a block ends at its closing tag, the next block or the end of a truncated response
+        pattern = re.compile(rf'<{tag}\s+id="([^"]*)"\s*>(.*?)(?=</{tag}>|<{tag}\s+id=|$)', re.DOTALL)
+        for item_id, content in pattern.findall(text):
+            try:
+                results[item_id] = parse_rating_response(f"<{tag}>{content}</{tag}>", tag=tag, valid_scores=valid_scores)
+            except ValueError:
+                continue
+    return {item_id: a for item_id, a in results.items() if item_id in ids}
@@ -1,15 +1,344 @@
-from typing import Dict, Any, List, Tuple
+from typing import Callable, Dict, Any, List, Tuple
+from collections import deque
+from concurrent.futures import Future, FIRST_COMPLETED, TimeoutError as FutureTimeoutError, wait
+import threading
 import requests
+import math
+import random
+import gzip
+import json
+import time
 import os
 from dotenv import load_dotenv
 
+try:
+    # optional, serializes the base64 images of large requests several times faster than json
+    import orjson
+except ImportError:
+    orjson = None
+
 # Load environment variables from .env file if it exists
 load_dotenv()
 
+# gzip the request bodies (Content-Encoding: gzip), for endpoints that accept compressed requests.
+# If the endpoint rejects a compressed request, it is sent again uncompressed and compression is turned off.
+compress_requests = os.getenv("OPENROUTER_COMPRESS_REQUESTS") == "1"
+# gzip level for compressed requests; base64 images gain little from higher levels
+compress_level = 1
+
+# hedged requests: when a request has not returned after the hedge_percentile latency of the recent
+# requests to its model, a duplicate is sent (to hedge_models[model] if set) and the first valid response is used.
+# Both requests are billed, so at most hedge_budget of the requests are hedged.
+hedge_requests = os.getenv("OPENROUTER_HEDGE_REQUESTS") == "1"
+hedge_percentile = 95
+hedge_budget = 0.05
+# alternate model for the duplicate of a request, by model; the callers attribute the response to the requested model
+hedge_models: Dict[str, str] = {}
+# no hedging until this many latencies of the model are known
+hedge_min_samples = 20
+latency_window = 200
+# requests sent with hedging enabled, hedges sent, hedges whose response was used, hedges not sent because of the budget
+hedge_counters = {"requests": 0, "hedges_fired": 0, "hedges_won": 0, "hedges_over_budget": 0}
+_hedge_lock = threading.Lock()
+
+# adaptive concurrency: the requests in flight to each model are limited by an AIMD controller,
+# which raises the limit while latency stays flat and lowers it on 429s and latency spikes.
+# 429s are retried. The callers' own pools (e.g. max_concurrent_requests) remain upper bounds.
+adaptive_concurrency = os.getenv("OPENROUTER_ADAPTIVE_CONCURRENCY") == "1"
+initial_concurrency = 4
+max_concurrency = 64
+# the limit is multiplied by these on a 429 and on a latency spike
+throttle_decrease = 0.5
+spike_decrease = 0.75
+# a latency above this multiple of the median of the recent latencies of the model is a spike
+latency_spike_factor = 3.0
+max_throttle_retries = 6
+
+
+def dumps(obj: Any) -> bytes:
+    """Serialize to JSON bytes, with orjson if it is installed."""
+    if orjson is not None:
+        return orjson.dumps(obj)
+    return json.dumps(obj).encode()
+
+
+class MessagePrefix:
+    """Leading messages shared by several requests (e.g. a system prompt and a notebook), serialized to JSON once.
+
+    Pass it to run_completion together with messages that start with the same
+    message objects as prefix.messages. The messages must not be modified.
+    """
+
+    def __init__(self, messages: List[Dict[str, Any]]):
+        self.messages: Tuple[Dict[str, Any], ...] = tuple(messages)
+        self._json_bytes: bytes | None = None
+
+    def json_bytes(self) -> bytes:
+        if self._json_bytes is None:
+            self._json_bytes = b",".join(dumps(m) for m in self.messages)
+        return self._json_bytes
+
+    def with_messages(self, *messages: Dict[str, Any]) -> List[Dict[str, Any]]:
+        return list(self.messages) + list(messages)
+
+    def leads(self, messages: List[Dict[str, Any]]) -> bool:
+        return len(messages) >= len(self.messages) and all(a is b for a, b in zip(self.messages, messages))
+
+
+def build_request_body(payload: Dict[str, Any], *, prefix: MessagePrefix | None = None) -> bytes:
+    """Serialize a chat completion payload to JSON bytes.
+
+    If prefix leads payload["messages"], its cached serialization is spliced in
+    instead of encoding those messages again.
+    """
+    messages = payload["messages"]
+    if prefix is None or not prefix.messages or not prefix.leads(messages):
+        return dumps(payload)
+    rest = dumps({k: v for k, v in payload.items() if k != "messages"})
+    parts = [rest[:-1], b',"messages":[', prefix.json_bytes()]
+    for m in messages[len(prefix.messages):]:
+        parts += [b",", dumps(m)]
+    parts.append(b"]}")
+    return b"".join(parts)
+
+
+def post_request(url: str, *, headers: Dict[str, str], body: bytes) -> requests.Response:
+    """POST a JSON body, gzipped if compress_requests is set."""
+    global compress_requests
+    if compress_requests:
+        response = requests.post(
+            url,
+            headers=dict(headers, **{"Content-Encoding": "gzip"}),
+            data=gzip.compress(body, compresslevel=compress_level)
+        )
+        if response.status_code not in (400, 415):
+            return response
+        print(f"Compressed request rejected ({response.status_code}), sending it uncompressed and turning compression off")
+        compress_requests = False
+    return requests.post(url, headers=headers, data=body)
+
+
+class LatencyTracker:
+    """Latencies of the recent successful requests, by model."""
+
+    def __init__(self, window: int):
+        self.window = window
+        self.latencies: Dict[str, deque] = {}
+        self.lock = threading.Lock()
+
+    def record(self, model: str, seconds: float):
+        with self.lock:
+            self.latencies.setdefault(model, deque(maxlen=self.window)).append(seconds)
+
+    def percentile(self, model: str, p: float, *, min_samples: int = 1) -> float | None:
+        with self.lock:
+            values = sorted(self.latencies.get(model, []))
+        if len(values) < min_samples or not values:
+            return None
+        return values[min(len(values) - 1, max(0, math.ceil(p / 100 * len(values)) - 1))]
+
+
+latencies = LatencyTracker(latency_window)
+
+
+class ConcurrencyController:
+    """AIMD limit on the requests in flight to one model.
+
+    The limit grows by 1 per limit successful requests (about one per round
+    trip) while they use the whole limit and their latency is flat. It is
+    multiplied by throttle_decrease on a 429 and by spike_decrease on a latency
+    spike, at most once per median latency, so that one overload lowers it once.
+    """
+
+    def __init__(self, model: str):
+        self.model = model
+        self.limit = float(initial_concurrency)
+        self.in_flight = 0
+        self.last_decrease = 0.0
+        self.counters = {"requests": 0, "throttled": 0, "spikes": 0, "increases": 0, "decreases": 0, "max_in_flight": 0}
+        self.condition = threading.Condition()
+
+    def acquire(self):
+        with self.condition:
+            while self.in_flight >= int(self.limit):
+                self.condition.wait()
+            self.in_flight += 1
+            self.counters["max_in_flight"] = max(self.counters["max_in_flight"], self.in_flight)
+
+    def release(self, *, seconds: float | None = None, throttled: bool = False):
+        """Release a slot after a request, with its latency if it succeeded, or throttled if it got a 429."""
+        # the median before this request, so that a spike does not raise its own baseline
+        median = latencies.percentile(self.model, 50, min_samples=10)
+        with self.condition:
+            was_full = self.in_flight >= int(self.limit)
+            self.in_flight -= 1
+            self.counters["requests"] += 1
+            if throttled:
+                self.counters["throttled"] += 1
+                self.decrease(throttle_decrease, "429", median)
+            elif median is not None and seconds is not None and seconds > latency_spike_factor * median:
+                self.counters["spikes"] += 1
+                self.decrease(spike_decrease, f"latency {seconds:.1f} s, median {median:.1f} s", median)
+            elif was_full and self.limit < max_concurrency:
+                old = int(self.limit)
+                self.limit = min(float(max_concurrency), self.limit + 1 / self.limit)
+                if int(self.limit) > old:
+                    self.counters["increases"] += 1
+                    print(f"Concurrency limit for {self.model}: {old} -> {int(self.limit)}")
+            self.condition.notify_all()
+
+    def decrease(self, factor: float, reason: str, median: float | None):
+        now = time.monotonic()
+        if now - self.last_decrease < (median or 1.0):
+            return
+        self.last_decrease = now
+        old = int(self.limit)
+        self.limit = max(1.0, self.limit * factor)
+        self.counters["decreases"] += 1
+        print(f"Concurrency limit for {self.model}: {old} -> {int(self.limit)} ({reason})")
+
+
+controllers: Dict[str, ConcurrencyController] = {}
+_controllers_lock = threading.Lock()
+
+
+def get_controller(model: str) -> ConcurrencyController:
+    with _controllers_lock:
+        if model not in controllers:
+            controllers[model] = ConcurrencyController(model)
+        return controllers[model]
+
+
+def get_telemetry() -> Dict[str, Any]:
+    """Current concurrency limits and counters by model, and the hedging counters."""
+    concurrency = {}
+    for model, controller in list(controllers.items()):
+        with controller.condition:
+            concurrency[model] = {"limit": int(controller.limit), "in_flight": controller.in_flight, **controller.counters}
+    with _hedge_lock:
+        hedging = dict(hedge_counters)
+    return {"concurrency": concurrency, "hedging": hedging}
+
+
+def print_telemetry():
+    """Print the concurrency limits and hedging counters, if adaptive concurrency or hedging was used."""
+    telemetry = get_telemetry()
+    for model, stats in telemetry["concurrency"].items():
+        print(f"Concurrency for {model}: " + ", ".join(f"{k} {v}" for k, v in stats.items()))
+    if telemetry["hedging"]["requests"]:
+        print("Hedging: " + ", ".join(f"{k} {v}" for k, v in telemetry["hedging"].items()))
+
+
+def get_retry_seconds(response: requests.Response, attempt: int) -> float:
+    """How long to wait before retrying a throttled request: Retry-After if given, else exponential backoff with jitter."""
+    try:
+        return float(response.headers["Retry-After"])
+    except (KeyError, ValueError):
+        return min(60.0, 2 ** attempt) * (0.5 + random.random() / 2)
+
+
+def post_completion(url: str, *, headers: Dict[str, str], body: bytes, model: str) -> Dict[str, Any]:
+    """Send a completion request and return the parsed response, recording its latency.
+
+    With adaptive_concurrency, the request waits for a slot of its model, and
+    a 429 is retried after a delay.
+    """
+    if adaptive_concurrency:
+        controller = get_controller(model)
+        for attempt in range(max_throttle_retries + 1):
+            controller.acquire()
+            timer = time.monotonic()
+            try:
+                response = post_request(url, headers=headers, body=body)
+            except BaseException:
+                controller.release()
+                raise
+            seconds = time.monotonic() - timer
+            throttled = response.status_code == 429
+            controller.release(seconds=seconds if response.status_code == 200 else None, throttled=throttled)
+            if not throttled or attempt == max_throttle_retries:
+                break
+            delay = get_retry_seconds(response, attempt)
+            print(f"Request to {model} throttled (429), retrying in {delay:.1f} s")
+            time.sleep(delay)
+    else:
+        timer = time.monotonic()
+        response = post_request(url, headers=headers, body=body)
+        seconds = time.monotonic() - timer
+    if response.status_code != 200:
+        raise RuntimeError(f"OpenRouter API request failed: {response.text}")
+    completion = response.json()
+    if not completion.get("choices"):
+        raise RuntimeError(f"OpenRouter API returned no completion: {response.text}")
+    latencies.record(model, seconds)
+    return completion
+
+
+def start_thread(fn: Callable[..., Any], *args, **kwargs) -> Future:
+    """Run fn in a daemon thread, so that a request whose response is no longer needed never delays the exit."""
+    future: Future = Future()
+
+    def target():
+        try:
+            future.set_result(fn(*args, **kwargs))
+        except BaseException as e:
+            future.set_exception(e)
+
+    threading.Thread(target=target, daemon=True).start()
+    return future
+
+
+def post_hedged_completion(
+    url: str, *, headers: Dict[str, str], payload: Dict[str, Any], prefix: MessagePrefix | None
+) -> Dict[str, Any]:
+    """Send a completion request, and a duplicate if it is slower than the hedge_percentile latency of its model.
+
+    Returns the first valid response. If both requests fail, the error of the
+    first one is raised. The other request is not cancelled: it runs to the
+    end in the background (its latency is still recorded).
+    """
+    model = payload["model"]
+    threshold = latencies.percentile(model, hedge_percentile, min_samples=hedge_min_samples)
+    with _hedge_lock:
+        hedge_counters["requests"] += 1
+    primary = start_thread(post_completion, url, headers=headers, body=build_request_body(payload, prefix=prefix), model=model)
+    if threshold is None:
+        return primary.result()
+    try:
+        return primary.result(timeout=threshold)
+    except FutureTimeoutError:
+        pass
+    with _hedge_lock:
+        allowed = hedge_counters["hedges_fired"] < hedge_budget * hedge_counters["requests"]
+        hedge_counters["hedges_fired" if allowed else "hedges_over_budget"] += 1
+    if not allowed:
+        return primary.result()
+
+    hedge_model = hedge_models.get(model, model)
+    print(f"No response from {model} after {threshold:.1f} s, sending a hedged request to {hedge_model}")
+    hedge_payload = dict(payload, model=hedge_model)
+    hedge = start_thread(post_completion, url, headers=headers, body=build_request_body(hedge_payload, prefix=prefix), model=hedge_model)
+    pending = {primary, hedge}
+    while pending:
+        done, pending = wait(pending, return_when=FIRST_COMPLETED)
+        # the primary wins a tie
+        for future in [f for f in (primary, hedge) if f in done]:
+            if future.exception() is None:
+                if future is hedge:
+                    with _hedge_lock:
+                        hedge_counters["hedges_won"] += 1
+                    print(f"Using the response of the hedged request to {hedge_model}")
+                return future.result()
+    raise primary.exception()
+
+
 def run_completion(
     messages: List[Dict[str, Any]],
     *,
-    model: str
+    model: str,
+    response_format: Dict[str, Any] | None = None,
+    max_tokens: int | None = None,
+    prefix: MessagePrefix | None = None
 ) -> Tuple[str, List[Dict[str, Any]], int, int]:
     """Execute an AI completion request using the OpenRouter API
 
@@ -18,6 +347,9 @@ def run_completion(
     Args:
         messages: List of conversation messages, each being a dictionary with role and content.
         model: Name of the OpenRouter model to use for completion.
+        response_format: Optional response format, e.g. a JSON schema for structured output.
+        max_tokens: Optional limit on the number of completion tokens.
+        prefix: Optional MessagePrefix that the messages start with, whose serialization is reused.
 
     Returns:
         tuple: Contains:
@@ -34,6 +366,9 @@ def run_completion(
 
     The OPENROUTER_API_KEY environment variable must be set with a valid API key from OpenRouter.
 
+    If hedge_requests is set (or OPENROUTER_HEDGE_REQUESTS=1), a request that is
+    slower than usual for its model is sent again, see post_hedged_completion.
+
     The messages is a list of dicts with the following structure:
     [
         {"role": "system", "content": "You are a helpful assistant... etc."},
@@ -65,16 +400,20 @@ def run_completion(
             "model": model,
             "messages": conversation_messages
         }
+        if response_format is not None:
+            payload["response_format"] = response_format
+        if max_tokens is not None:
+            payload["max_tokens"] = max_tokens
         print(f"Using model: {payload['model']}")
         print(f"Num. messages in conversation: {len(conversation_messages)}")
 
         print("Submitting completion request...")
-        response = requests.post(url, headers=headers, json=payload)
-        if response.status_code != 200:
-            raise RuntimeError(f"OpenRouter API request failed: {response.text}")
+        if hedge_requests:
+            completion = post_hedged_completion(url, headers=headers, payload=payload, prefix=prefix)
+        else:
+            completion = post_completion(url, headers=headers, body=build_request_body(payload, prefix=prefix), model=model)
 
         print("Processing response...")
-        completion = response.json()
         prompt_tokens = completion["usage"]["prompt_tokens"]
         completion_tokens = completion["usage"]["completion_tokens"]
 
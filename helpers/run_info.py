@@ -0,0 +1,24 @@
+import re
+from typing import Any, Dict, Tuple
+
+# subfolders are <date>-<model>-<prompt>, or <date>-<model> for runs from before prompts were versioned
+subfolder_pattern = re.compile(r"^(\d{4}-\d{2}-\d{2})-(.+?)(?:-(prompt-.+))?$")
+
+
+def parse_subfolder(subfolder: str) -> Tuple[str | None, str, str | None]:
+    """Split a subfolder name into (date, model, prompt)."""
+    m = subfolder_pattern.match(subfolder)
+    if m is None:
+        return None, subfolder, None
+    return m.group(1), m.group(2), m.group(3)
+
+
+def get_run_info(rating: Dict[str, Any]) -> Dict[str, Any]:
+    """Get the date, model and prompt of the run that generated a rated notebook, preferring its metadata."""
+    date, model, prompt = parse_subfolder(rating["subfolder"])
+    metadata = rating.get("metadata", {})
+    if metadata.get("model"):
+        model = metadata["model"].split("/")[-1]
+    if metadata.get("prompt"):
+        prompt = metadata["prompt"].removesuffix(".txt")
+    return {"date": date, "model": model, "prompt": prompt or "none"}
@@ -0,0 +1,101 @@
+from typing import Dict, Any, List, Tuple
+import base64
+import math
+import struct
+
+# Approximate OpenRouter prices in USD per million tokens: (prompt, completion).
+# These are only used for offline planning, so update them when prices change.
+model_prices: Dict[str, Tuple[float, float]] = {
+    "google/gemini-2.0-flash-001": (0.10, 0.40),
+    "google/gemini-2.5-pro-preview-03-25": (1.25, 10.0),
+    "anthropic/claude-3.5-sonnet": (3.0, 15.0),
+    "anthropic/claude-3.7-sonnet": (3.0, 15.0),
+    "openai/gpt-4o": (2.5, 10.0),
+    "openai/gpt-4.1": (2.0, 8.0),
+}
+
+# Approximate seconds per completion request, used to project wall time
+model_latencies: Dict[str, float] = {
+    "google/gemini-2.0-flash-001": 4.0,
+    "anthropic/claude-3.5-sonnet": 12.0,
+    "anthropic/claude-3.7-sonnet": 15.0,
+}
+default_latency_seconds = 10.0
+
+# Roughly four characters per token for English text and code
+chars_per_token = 4.0
+
+
+def estimate_text_tokens(text: str) -> int:
+    """Estimate the number of tokens in a piece of text."""
+    return math.ceil(len(text) / chars_per_token)
+
+
+def get_png_size(image_data_url: str) -> Tuple[int, int] | None:
+    """Get the (width, height) of a base64 PNG data URL without decoding the whole image."""
+    prefix = "data:image/png;base64,"
+    if not image_data_url.startswith(prefix):
+        return None
+    # the IHDR chunk with the width and height is in the first 24 bytes (32 base64 characters)
+    header = base64.b64decode(image_data_url[len(prefix):len(prefix) + 32])
+    if len(header) < 24 or header[:8] != b"\x89PNG\r\n\x1a\n":
+        return None
+    width, height = struct.unpack(">II", header[16:24])
+    return width, height
+
+
+def estimate_image_tokens(image_data_url: str, *, model: str) -> int:
+    """Estimate the number of prompt tokens for an image, following each provider's documented scheme."""
+    size = get_png_size(image_data_url)
+    if size is None:
+        # fall back to a typical matplotlib figure size
+        size = (1000, 600)
+    width, height = size
+    if model.startswith("google/"):
+        # Gemini: 258 tokens for small images, otherwise 258 per 768x768 tile
+        if width <= 384 and height <= 384:
+            return 258
+        return 258 * math.ceil(width / 768) * math.ceil(height / 768)
+    if model.startswith("openai/"):
+        # OpenAI: fit within 2048x2048, scale the shortest side to 768, then 170 per 512x512 tile plus 85
+        scale = min(1.0, 2048 / max(width, height))
+        width, height = width * scale, height * scale
+        scale = min(1.0, 768 / min(width, height))
+        width, height = width * scale, height * scale
+        return 85 + 170 * math.ceil(width / 512) * math.ceil(height / 512)
+    # Anthropic (and the default): fit within 1568 px on the long edge and ~1.15 megapixels, then w*h/750
+    scale = min(1.0, 1568 / max(width, height), math.sqrt(1_150_000 / (width * height)))
+    return math.ceil(width * scale * height * scale / 750)
+
+
+def estimate_message_tokens(messages: List[Dict[str, Any]], *, model: str) -> Dict[str, int]:
+    """Estimate the text and image prompt tokens for a list of messages."""
+    text_tokens = 0
+    image_tokens = 0
+    num_images = 0
+    for message in messages:
+        # a few tokens of per-message overhead for the role and separators
+        text_tokens += 4
+        content = message["content"]
+        if isinstance(content, str):
+            text_tokens += estimate_text_tokens(content)
+            continue
+        for part in content:
+            if part["type"] == "text":
+                text_tokens += estimate_text_tokens(part["text"])
+            elif part["type"] == "image_url":
+                image_tokens += estimate_image_tokens(part["image_url"]["url"], model=model)
+                num_images += 1
+    return {
+        "text_tokens": text_tokens,
+        "image_tokens": image_tokens,
+        "num_images": num_images,
+    }
+
+
+def estimate_cost(*, prompt_tokens: int, completion_tokens: int, model: str) -> float | None:
+    """Estimate the cost in USD, or None if the model price is unknown."""
+    if model not in model_prices:
+        return None
+    prompt_price, completion_price = model_prices[model]
+    return (prompt_tokens * prompt_price + completion_tokens * completion_price) / 1e6
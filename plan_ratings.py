@@ -0,0 +1,195 @@
+#!/usr/bin/env python3
+
+import os
+import json
+import math
+import click
+from typing import Dict, Any, List
+from run_ratings import (
+    find_notebooks,
+    load_rubric,
+    load_notebook,
+    create_messages_for_question,
+    create_notebook_prefix,
+    create_segment_messages,
+    create_reduce_messages_for_question,
+    split_cells_into_segments,
+    find_existing_score,
+    find_partial_reps,
+    default_model,
+    num_repeats,
+)
+import run_ratings
+from helpers.token_estimate import (
+    estimate_message_tokens,
+    estimate_cost,
+    model_latencies,
+    default_latency_seconds,
+)
+
+# assumed size of the notes on one segment in map-reduce mode, which are only known after the map step
+assumed_segment_notes_chars = 2000
+
+
+def plan_notebook(
+    *,
+    notebook_path: str,
+    existing_ratings: dict | None,
+    questions: Dict[str, Any],
+    models: List[str],
+) -> Dict[str, Any]:
+    """Render the pending rating messages for a notebook and estimate their tokens for each model."""
+    _, notebook = load_notebook(notebook_path)
+    cells = notebook["cells"]
+    plan: Dict[str, Any] = {
+        "notebook": notebook_path,
+        "num_calls": 0,
+        "models": {
+            m: {"text_tokens": 0, "image_tokens": 0, "num_images": 0, "num_map_calls": 0} for m in models
+        },
+    }
+    prefix = create_notebook_prefix(cells)
+    # whether run_ratings.py would use map-reduce mode for the notebook, which depends on the model's token estimate
+    full_estimates = {
+        m: estimate_message_tokens(create_messages_for_question(cells, questions["questions"][0], prefix), model=m) for m in models
+    }
+    chunked = {
+        m: e["text_tokens"] + e["image_tokens"] > run_ratings.chunked_rating_threshold_tokens for m, e in full_estimates.items()
+    }
+    for question in questions["questions"]:
+        if find_existing_score(existing_ratings, question, verbose=False):
+            continue
+        num_pending_reps = num_repeats - len(find_partial_reps(existing_ratings, question))
+        plan["num_calls"] += num_pending_reps
+        for m in models:
+            if chunked[m]:
+                if plan["models"][m]["num_map_calls"] == 0:
+                    segments = split_cells_into_segments(cells, max_tokens=run_ratings.segment_max_tokens, model=m)
+                    plan["models"][m]["num_map_calls"] = len(segments)
+                    for i, segment in enumerate(segments):
+                        estimate = estimate_message_tokens(
+                            create_segment_messages(cells, segment, len(segments), i, questions["questions"]), model=m
+                        )
+                        for k, v in estimate.items():
+                            plan["models"][m][k] += v
+                segment_notes = [{"start": 0, "end": 0, "notes": "x" * assumed_segment_notes_chars}] * plan["models"][m]["num_map_calls"]
+                messages = create_reduce_messages_for_question(segment_notes, len(cells), question)
+            else:
+                messages = create_messages_for_question(cells, question, prefix)
+            # the messages are identical for every repetition of a question
+            estimate = estimate_message_tokens(messages, model=m)
+            for k, v in estimate.items():
+                plan["models"][m][k] += v * num_pending_reps
+    return plan
+
+
+def estimate_wall_time_seconds(
+    *,
+    num_calls: int,
+    num_map_calls_per_notebook: List[int],
+    concurrency: int,
+    map_concurrency: int,
+    seconds_per_call: float,
+) -> float:
+    """Estimate the wall time of the rating calls and the map-step calls of long notebooks.
+
+    The rating calls run concurrency at a time. The map step of a notebook runs
+    its segment calls map_concurrency at a time (run_ratings.max_segment_workers).
+    It finishes before the questions of that notebook are rated, so the map
+    steps of different notebooks don't overlap.
+    """
+    rating_rounds = math.ceil(num_calls / concurrency)
+    map_rounds = sum(math.ceil(n / map_concurrency) for n in num_map_calls_per_notebook)
+    return (rating_rounds + map_rounds) * seconds_per_call
+
+
+@click.command()
+@click.option("--model", "models", multiple=True, help=f"Model to estimate for (can be repeated, default: {default_model})")
+@click.option("--concurrency", type=click.IntRange(min=1), default=1, help="Number of concurrent rating requests (run_ratings.py rates one question repetition at a time)")
+@click.option("--map-concurrency", type=click.IntRange(min=1), default=run_ratings.max_segment_workers, show_default=True, help="Number of concurrent map-step requests for the segments of a long notebook")
+@click.option("--completion-tokens", type=int, default=400, help="Assumed completion tokens per request")
+@click.option("--latency", type=float, default=None, help="Assumed seconds per request (default: per-model estimate)")
+@click.option("--per-notebook", is_flag=True, help="Print the estimate for each notebook")
+@click.option("--output", "-o", default=None, help="Output JSON file for the full plan")
+def main(models, concurrency, map_concurrency, completion_tokens, latency, per_notebook, output):
+    """Estimate the tokens, cost and wall time of the pending work in run_ratings.py without calling the API."""
+    models = list(models) or [default_model]
+    questions = load_rubric()
+    notebooks = find_notebooks("dandisets")
+
+    ratings_fname = "ratings.json"
+    if os.path.exists(ratings_fname):
+        with open(ratings_fname, "r") as f:
+            ratings = json.load(f)
+    else:
+        ratings = []
+    ratings_by_notebook = {r["notebook"]: r for r in ratings}
+
+    plans = []
+    for _, notebook_path in notebooks:
+        plan = plan_notebook(
+            notebook_path=notebook_path,
+            existing_ratings=ratings_by_notebook.get(notebook_path),
+            questions=questions,
+            models=models,
+        )
+        if plan["num_calls"] == 0:
+            continue
+        plans.append(plan)
+        if per_notebook:
+            m = models[0]
+            print(
+                f"{notebook_path}: {plan['num_calls']} calls, "
+                f"{plan['models'][m]['text_tokens']} text tokens, "
+                f"{plan['models'][m]['image_tokens']} image tokens ({m})"
+            )
+
+    num_calls = sum(p["num_calls"] for p in plans)
+    print(f"{len(plans)} of {len(notebooks)} notebooks have pending ratings ({num_calls} requests)")
+    summary = []
+    for m in models:
+        text_tokens = sum(p["models"][m]["text_tokens"] for p in plans)
+        image_tokens = sum(p["models"][m]["image_tokens"] for p in plans)
+        # notebooks rated in map-reduce mode add one call per segment
+        num_map_calls = sum(p["models"][m]["num_map_calls"] for p in plans)
+        total_completion_tokens = (num_calls + num_map_calls) * completion_tokens
+        cost = estimate_cost(
+            prompt_tokens=text_tokens + image_tokens,
+            completion_tokens=total_completion_tokens,
+            model=m,
+        )
+        seconds_per_call = latency if latency is not None else model_latencies.get(m, default_latency_seconds)
+        wall_time_seconds = estimate_wall_time_seconds(
+            num_calls=num_calls,
+            num_map_calls_per_notebook=[p["models"][m]["num_map_calls"] for p in plans],
+            concurrency=concurrency,
+            map_concurrency=map_concurrency,
+            seconds_per_call=seconds_per_call,
+        )
+        summary.append({
+            "model": m,
+            "num_calls": num_calls + num_map_calls,
+            "num_map_calls": num_map_calls,
+            "text_tokens": text_tokens,
+            "image_tokens": image_tokens,
+            "completion_tokens": total_completion_tokens,
+            "cost_usd": cost,
+            "wall_time_seconds": wall_time_seconds,
+        })
+        print("")
+        print(m)
+        if num_map_calls:
+            print(f"  Map-reduce segment calls: {num_map_calls}")
+        print(f"  Prompt tokens: {text_tokens + image_tokens} ({text_tokens} text + {image_tokens} image)")
+        print(f"  Completion tokens: {total_completion_tokens}")
+        print(f"  Cost: {'unknown price' if cost is None else f'${cost:.2f}'}")
+        print(f"  Wall time at concurrency {concurrency} ({map_concurrency} for map-step calls): {wall_time_seconds / 3600:.2f} h")
+
+    if output:
+        with open(output, "w") as f:
+            json.dump({"summary": summary, "notebooks": plans}, f, indent=2)
+        print(f"Plan saved to {output}")
+
+
+if __name__ == "__main__":
+    main()
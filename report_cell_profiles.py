@@ -0,0 +1,111 @@
+#!/usr/bin/env python3
+
+import os
+import sys
+import json
+import click
+from typing import Dict, Any, List
+from run_ratings import find_notebooks
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "templates"))
+
+from kernel_pool import get_cell_profile  # noqa: E402
+
+
+def get_cell_source(cell: Dict[str, Any]) -> str:
+    source = cell.get("source", "")
+    return "".join(source) if isinstance(source, list) else source
+
+
+def load_cell_profiles(notebook_path: str) -> List[Dict[str, Any]]:
+    """Load the per-cell profile of a generated notebook.
+
+    Uses cell_profile.json next to the notebook if present, otherwise the
+    execution timing that jupyter records in the notebook itself (no memory).
+    """
+    with open(notebook_path, "r") as f:
+        notebook = json.load(f)
+    cells = None
+    profile_path = os.path.join(os.path.dirname(notebook_path), "cell_profile.json")
+    if os.path.exists(profile_path):
+        with open(profile_path, "r") as f:
+            cells = json.load(f).get("cells") or None
+    if cells is None:
+        cells = get_cell_profile(notebook_path)
+    for c in cells:
+        c["source"] = get_cell_source(notebook["cells"][c["cell_index"]])
+    return cells
+
+
+def print_table(title: str, rows: List[Dict[str, Any]], columns: List[str]):
+    print(f"\n{title}")
+    widths = [max([len(col)] + [len(str(r[col])) for r in rows]) for col in columns]
+    print("  ".join(col.ljust(w) for col, w in zip(columns, widths)))
+    for r in rows:
+        print("  ".join(str(r[col]).ljust(w) for col, w in zip(columns, widths)))
+
+
+def format_number(x: float | None, fmt: str = ".1f") -> str:
+    return "-" if x is None else format(x, fmt)
+
+
+@click.command()
+@click.option("--top", type=int, default=20, help="Number of slowest cells and datasets to show")
+@click.option("-o", "--output", default=None, help="Also write all cell profiles to this JSON file")
+def main(top, output):
+    """Rank the slowest notebook cells and datasets across all generated notebooks in dandisets/."""
+    all_cells = []
+    for dandiset_id, notebook_path in find_notebooks("dandisets"):
+        for c in load_cell_profiles(notebook_path):
+            if c["elapsed_seconds"] is None:
+                continue
+            all_cells.append(dict(c, dandiset_id=dandiset_id, notebook=notebook_path))
+    print(f"Found {len(all_cells)} profiled cells")
+
+    slowest = sorted(all_cells, key=lambda c: -c["elapsed_seconds"])[:top]
+    print_table("Slowest cells", [
+        {
+            "seconds": format_number(c["elapsed_seconds"]),
+            "peak MB": format_number(c["peak_memory_mb"], ".0f"),
+            "cell": c["cell_index"],
+            "notebook": c["notebook"],
+            "source": (c["source"].strip().splitlines() or [""])[0][:60],
+        }
+        for c in slowest
+    ], ["seconds", "peak MB", "cell", "notebook", "source"])
+
+    # attribute the time of each cell to the dandiset, and to the remote files it refers to
+    by_dandiset: Dict[str, Dict[str, Any]] = {}
+    by_url: Dict[str, Dict[str, Any]] = {}
+    for c in all_cells:
+        keys = [(by_dandiset, c["dandiset_id"])] + [(by_url, url) for url in set(c["urls"])]
+        for table, key in keys:
+            entry = table.setdefault(key, {"seconds": 0.0, "num_cells": 0, "notebooks": set(), "peak_memory_mb": None})
+            entry["seconds"] += c["elapsed_seconds"]
+            entry["num_cells"] += 1
+            entry["notebooks"].add(c["notebook"])
+            if c["peak_memory_mb"] is not None:
+                entry["peak_memory_mb"] = max(entry["peak_memory_mb"] or 0, c["peak_memory_mb"])
+
+    for title, table, key_name in [("Slowest dandisets", by_dandiset, "dandiset"), ("Slowest datasets (URLs)", by_url, "url")]:
+        rows = sorted(table.items(), key=lambda kv: -kv[1]["seconds"])[:top]
+        print_table(title, [
+            {
+                "total seconds": format_number(v["seconds"]),
+                "seconds/notebook": format_number(v["seconds"] / len(v["notebooks"])),
+                "cells": v["num_cells"],
+                "notebooks": len(v["notebooks"]),
+                "max peak MB": format_number(v["peak_memory_mb"], ".0f"),
+                key_name: k,
+            }
+            for k, v in rows
+        ], ["total seconds", "seconds/notebook", "cells", "notebooks", "max peak MB", key_name])
+
+    if output:
+        with open(output, "w") as f:
+            json.dump(all_cells, f, indent=2)
+        print(f"\nWrote {output}")
+
+
+if __name__ == "__main__":
+    main()
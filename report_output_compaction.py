@@ -0,0 +1,98 @@
+#!/usr/bin/env python3
+
+import json
+import statistics
+import click
+from typing import Dict, Any, List
+import run_ratings
+from run_ratings import find_notebooks, load_rubric, load_notebook, create_messages_for_question, rate_unit, default_model
+from helpers.output_compaction import OutputCompactor, default_compaction_config
+from helpers.token_estimate import estimate_message_tokens
+
+
+def measure_notebook(cells: List[Dict[str, Any]], question: Dict[str, Any], config: Dict[str, Any], *, model: str) -> Dict[str, Any]:
+    """Estimate the prompt tokens of one rating call with and without compaction."""
+    result: Dict[str, Any] = {}
+    for label, compaction in [("original", None), ("compacted", config)]:
+        estimate = estimate_message_tokens(create_messages_for_question(cells, question, compaction=compaction), model=model)
+        result[label] = estimate["text_tokens"] + estimate["image_tokens"]
+    # run the compactor on its own to get what it removed
+    compactor = OutputCompactor(config)
+    for cell in cells:
+        if cell["cell_type"] == "code":
+            run_ratings.create_user_message_content_for_cell(cell, compactor)
+    result.update(compactor.stats)
+    return result
+
+
+def rate_question(cells: List[Dict[str, Any]], question: Dict[str, Any], compaction: Dict[str, Any] | None, *, model: str, num_repeats: int) -> float:
+    messages = create_messages_for_question(cells, question, compaction=compaction)
+    scores = [rate_unit(messages=messages, model=model)[0]["score"] for _ in range(num_repeats)]
+    return sum(scores) / len(scores)
+
+
+@click.command()
+@click.option("--max-output-tokens", type=int, default=default_compaction_config["max_output_tokens"], help="Tokens kept per text/HTML output")
+@click.option("--max-notebook-output-tokens", type=int, default=default_compaction_config["max_notebook_output_tokens"], help="Tokens kept from all outputs of a notebook")
+@click.option("--max-images", type=int, default=default_compaction_config["max_images"], help="Images kept per notebook")
+@click.option("--model", default=default_model, help="Model for the token estimates and the ratings")
+@click.option("--rate", "num_rate", type=int, default=0, help="Re-rate this many of the most compacted notebooks with and without compaction (calls the API)")
+@click.option("--question", "question_name", default=None, help="Question to re-rate (default: the first in rubric.yml)")
+@click.option("--num-repeats", type=int, default=3, help="Repetitions per rating when re-rating")
+@click.option("--output", "-o", default=None, help="Also write the per-notebook results to this JSON file")
+def main(max_output_tokens, max_notebook_output_tokens, max_images, model, num_rate, question_name, num_repeats, output):
+    """Report how output compaction changes the rating prompt size (and optionally the scores) on the notebooks in dandisets/."""
+    config = {
+        "max_output_tokens": max_output_tokens,
+        "max_notebook_output_tokens": max_notebook_output_tokens,
+        "max_images": max_images,
+    }
+    questions = load_rubric()["questions"]
+    question = next((q for q in questions if q["name"] == question_name), None) if question_name else questions[0]
+    if question is None:
+        raise click.BadParameter(f"Question {question_name} not found in rubric.yml", param_hint="--question")
+
+    results = []
+    for _, notebook_path in find_notebooks("dandisets"):
+        _, notebook = load_notebook(notebook_path)
+        r = measure_notebook(notebook["cells"], question, config, model=model)
+        r["notebook"] = notebook_path
+        results.append(r)
+    if not results:
+        print("No notebooks found in dandisets/")
+        return
+
+    original = sum(r["original"] for r in results)
+    compacted = sum(r["compacted"] for r in results)
+    reductions = [1 - r["compacted"] / r["original"] for r in results if r["original"]]
+    print(f"Prompt tokens per rating call ({model}), {len(results)} notebooks, {len(questions)} questions each")
+    print(f"  Total: {original} -> {compacted} ({100 * (1 - compacted / original):.1f}% smaller)")
+    print(f"  Median reduction per notebook: {100 * statistics.median(reductions):.1f}%, max: {100 * max(reductions):.1f}%")
+    print(f"  Largest prompt: {max(r['original'] for r in results)} -> {max(r['compacted'] for r in results)}")
+    print(f"  Notebooks changed: {sum(1 for r in results if r['compacted'] != r['original'])}")
+    print(f"  Outputs truncated: {sum(r['truncated_outputs'] for r in results)}, images omitted: {sum(r['omitted_images'] for r in results)}")
+
+    print("\nMost compacted notebooks")
+    most_compacted = sorted(results, key=lambda r: r["compacted"] - r["original"])
+    for r in most_compacted[:10]:
+        print(f"  {r['original']:>8} -> {r['compacted']:>8}  {r['notebook']}")
+
+    if num_rate > 0:
+        print(f"\nRe-rating {question['name']} with {model} ({num_repeats} repetitions each)")
+        deltas = []
+        for r in most_compacted[:num_rate]:
+            _, notebook = load_notebook(r["notebook"])
+            r["score_original"] = rate_question(notebook["cells"], question, None, model=model, num_repeats=num_repeats)
+            r["score_compacted"] = rate_question(notebook["cells"], question, config, model=model, num_repeats=num_repeats)
+            deltas.append(r["score_compacted"] - r["score_original"])
+            print(f"  {r['score_original']:.2f} -> {r['score_compacted']:.2f}  {r['notebook']}")
+        print(f"  Mean score change: {statistics.mean(deltas):+.2f}, mean absolute change: {statistics.mean(abs(d) for d in deltas):.2f}")
+
+    if output:
+        with open(output, "w") as f:
+            json.dump(results, f, indent=2)
+        print(f"\nWrote {output}")
+
+
+if __name__ == "__main__":
+    main()
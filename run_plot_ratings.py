@@ -1,15 +1,45 @@
 #!/usr/bin/env python3
 
 import os
+import copy
 import json
 import time
 import base64
+import threading
+import click
 import yaml
 from pathlib import Path
-from typing import Dict, Any, List, Tuple
-from helpers.run_completion import run_completion
+from typing import Callable, Dict, Any, List, Tuple
+from concurrent.futures import Executor, ThreadPoolExecutor, as_completed
+from helpers.run_completion import run_completion, print_telemetry
+from helpers.json_io import save_json_atomic
+from helpers.rating_response import (
+    parse_rating_response,
+    supports_structured_output,
+    rating_response_format,
+    rating_json_instructions,
+    multi_rating_response_format,
+    multi_rating_json_instructions,
+    parse_multi_rating_response,
+)
+from helpers.batch_requests import BatchPending, BatchWriter, BatchResults, make_custom_id
 
 model = None
+num_repeats = 3
+# number of attempts for a single (plot, question, rep) before giving up on it for this run
+max_unit_attempts = 3
+# ask for a JSON rating instead of <plot_rater> tags, enforced with a JSON schema for models that support it
+structured_output = False
+# limit on the length of the reasoning in structured output
+max_thinking_chars = 1000
+# limit on the completion tokens of each rating request, or None for the provider's default
+max_completion_tokens: int | None = None
+# default number of plots of a notebook rated together in one request (1 rates each plot in its own request)
+default_plot_batch_size = 1
+# default maximum number of rating requests in flight at once, across plots, repetitions and notebooks (1 rates serially)
+default_max_concurrent_requests = 4
+# number of notebooks rated at once when more than one request can be in flight
+max_concurrent_notebooks = 4
 
 def find_notebooks(base_dir: str) -> List[Tuple[str, str]]:
     """Find notebooks matching the pattern dandisets/<DANDISET_ID>/subfolder/<DANDISET_ID>.ipynb."""
@@ -39,84 +69,314 @@ def read_plot_rate_system_prompt() -> str:
         content = f.read()
     return content
 
-def parse_assistant_response(assistant_response: str) -> Dict[str, Any]:
+def read_plot_rate_batch_system_prompt() -> str:
+    """Read the system prompt template for rating several plots in one request."""
+    template_path = Path(__file__).parent / "templates" / "plot_rate_batch_system_prompt.txt"
+    with open(template_path, "r") as f:
+        content = f.read()
+    return content
+
+def parse_assistant_response(assistant_response: str, valid_scores: List[float] | None = None) -> Dict[str, Any]:
     """Parse the assistant's response into thinking and score."""
-    ind1 = assistant_response.find("<plot_rater>")
-    ind2 = assistant_response.find("</plot_rater>")
-    if ind1 == -1 and ind2 >= 0:
-        # sometimes gemini makes a mistake and returns </plot_rater> for both the opening and closing tags
-        ind1 = ind2
-        ind2 = ind1 + len("</plot_rater>") + assistant_response[ind1 + len("</plot_rater>"):].find("</plot_rater>")
-    if ind1 == -1 or ind2 == -1:
-        print(assistant_response)
-        raise ValueError("Invalid assistant response format")
-    ind1 += len("<plot_rater>")
-    content = assistant_response[ind1:ind2]
-
-    thinking_ind1 = content.find("<thinking>")
-    thinking_ind2 = content.find("</thinking>")
-    if thinking_ind1 == -1 or thinking_ind2 == -1:
-        print(content)
-        raise ValueError("Invalid assistant response format for parsing thinking")
-    thinking_ind1 += len("<thinking>")
-    thinking = content[thinking_ind1:thinking_ind2].strip()
-
-    score_ind1 = content.find("<score>")
-    score_ind2 = content.find("</score>")
-    if score_ind1 == -1 or score_ind2 == -1:
-        print(content)
-        raise ValueError("Invalid assistant response format for parsing score")
-    score_ind1 += len("<score>")
-    score = content[score_ind1:score_ind2].strip()
-    try:
-        score = float(score)
-    except ValueError:
-        raise ValueError("Invalid score format")
-    return {"thinking": thinking, "score": score}
+    return parse_rating_response(assistant_response, tag="plot_rater", valid_scores=valid_scores)
+
+def get_completion_options(model: str) -> Dict[str, Any]:
+    """Get the response_format and max_tokens arguments of run_completion for a rating request."""
+    options: Dict[str, Any] = {}
+    if structured_output and supports_structured_output(model):
+        options["response_format"] = rating_response_format(max_thinking_chars=max_thinking_chars)
+    if max_completion_tokens is not None:
+        options["max_tokens"] = max_completion_tokens
+    return options
+
+def create_question_user_message(question: Dict[str, Any]) -> str:
+    user_message = f"Please rate the plot based on the following question: {question['question']}\n\n"
+    user_message += f"Rubric:\n"
+    for rub in question["rubric"]:
+        user_message += f"- {rub['score']}: {rub['description']}\n"
+    if structured_output:
+        user_message += rating_json_instructions(max_thinking_chars=max_thinking_chars)
+    else:
+        user_message += """
+Remember that your output should be in the following format:
 
-def rate_plot(
+<plot_rater>
+    <thinking>Your reasoning for the score</thinking>
+    <score>numeric_score</score>
+</plot_rater>
+"""
+    return user_message
+
+def create_plot_messages(image_data_url: str, question: Dict[str, Any]) -> List[Dict[str, Any]]:
+    """Create the messages for rating a single plot on a question."""
+    return [
+        {"role": "system", "content": read_plot_rate_system_prompt()},
+        {"role": "system", "content": [{"type": "image_url", "image_url": {"url": image_data_url}}]},
+        {"role": "user", "content": create_question_user_message(question)}
+    ]
+
+def create_plot_batch_messages(plots: List[Tuple[str, str]], question: Dict[str, Any]) -> List[Dict[str, Any]]:
+    """Create the messages for rating several (plot_id, image_data_url) plots on a question in one request."""
+    messages: List[Dict[str, Any]] = [{"role": "system", "content": read_plot_rate_batch_system_prompt()}]
+    for plot_id, image_data_url in plots:
+        messages.append({"role": "system", "content": [
+            {"type": "text", "text": f"PLOT {plot_id}:"},
+            {"type": "image_url", "image_url": {"url": image_data_url}}
+        ]})
+
+    user_message = f"Please rate each of the {len(plots)} plots based on the following question: {question['question']}\n\n"
+    user_message += f"Rubric:\n"
+    for rub in question["rubric"]:
+        user_message += f"- {rub['score']}: {rub['description']}\n"
+    if structured_output:
+        user_message += multi_rating_json_instructions(max_thinking_chars=max_thinking_chars)
+    else:
+        user_message += """
+Remember that your output should be in the following format, with one plot_rater block per plot:
+
+<plot_ratings>
+<plot_rater id="plot_id">
+    <thinking>Your reasoning for the score</thinking>
+    <score>numeric_score</score>
+</plot_rater>
+...
+</plot_ratings>
+"""
+    user_message += f"\nThe plot IDs are: {', '.join(plot_id for plot_id, _ in plots)}\n"
+    messages.append({"role": "user", "content": user_message})
+    return messages
+
+def rate_plot_rep(
     *,
     image_data_url: str,
     question: Dict[str, Any],
     model: str | None = None,
-    num_repeats: int = 3
+    repnum: int,
+    batch: Callable[..., Tuple[str, int, int]] | None = None,
+    batch_key: str = ""
 ) -> Dict[str, Any]:
-    """Rate a single plot using the provided question and rubric."""
+    """Get one repetition of a plot rating, retrying only this repetition if no score can be recovered from the response.
+
+    In batch mode the completion comes from batch, BatchPending propagates and
+    there is no retry.
+    """
     if not model:
         model = "google/gemini-2.0-flash-001"
 
-    system_prompt = read_plot_rate_system_prompt()
-    reps = []
+    messages = create_plot_messages(image_data_url, question)
+    valid_scores = [float(rub["score"]) for rub in question["rubric"]]
+    if batch is not None:
+        custom_id = make_custom_id("plot_rating", batch_key, question["name"], question["version"], repnum, model, messages)
+        assistant_response, _, _ = batch(custom_id, messages=messages, model=model, **get_completion_options(model))
+        a = parse_assistant_response(assistant_response, valid_scores)
+    attempt = 1
+    while batch is None:
+        assistant_response, _, _, _ = run_completion(messages=messages, model=model, **get_completion_options(model))
+        try:
+            a = parse_assistant_response(assistant_response, valid_scores)
+            break
+        except ValueError as e:
+            print(assistant_response)
+            if attempt >= max_unit_attempts:
+                raise
+            attempt += 1
+            print(f"Error parsing response ({e}), retrying attempt {attempt}/{max_unit_attempts}")
+
+    rep = {
+        "score": a["score"],
+        "thinking": a["thinking"],
+        "repnum": repnum
+    }
+    if a.get("salvaged"):
+        # recovered from a malformed response rather than paying for a new one
+        rep["salvaged"] = True
+    return rep
+
+def rate_plot(
+    *,
+    image_data_url: str,
+    question: Dict[str, Any],
+    model: str | None = None,
+    num_repeats: int = 3,
+    existing_reps: List[Dict[str, Any]] | None = None,
+    on_rep: Callable[[Dict[str, Any]], None] | None = None,
+    batch: Callable[..., Tuple[str, int, int]] | None = None,
+    batch_key: str = ""
+) -> Dict[str, Any]:
+    """Rate a single plot using the provided question and rubric.
+
+    Repetitions in existing_reps are kept and only the missing ones are rated.
+    If on_rep is provided, it is called with the partial score after every completed repetition.
+    If batch is provided (see helpers/batch_requests.py), the completions come from it
+    instead of the API, with custom IDs derived from batch_key, which must identify the
+    plot. Repetitions without a result are left out, and BatchPending is raised if none
+    of them are done.
+    """
+    reps = list(existing_reps or [])
+    done_repnums = set(rep["repnum"] for rep in reps)
 
     for repnum in range(num_repeats):
-        messages = [
-            {"role": "system", "content": system_prompt},
-            {"role": "system", "content": [{"type": "image_url", "image_url": {"url": image_data_url}}]}
-        ]
+        if repnum in done_repnums:
+            continue
+        try:
+            rep = rate_plot_rep(
+                image_data_url=image_data_url,
+                question=question,
+                model=model,
+                repnum=repnum,
+                batch=batch,
+                batch_key=batch_key
+            )
+        except BatchPending:
+            continue
+        except ValueError as e:
+            if batch is None:
+                raise
+            # a stored result would be the same on every attempt, so there is no retry
+            print(f"Error parsing response ({e}), leaving repetition {repnum + 1} for the next run")
+            continue
+        reps.append(rep)
+        reps.sort(key=lambda x: x["repnum"])
+        if on_rep is not None:
+            on_rep(make_score_entry(question, reps))
 
-        user_message = f"Please rate the plot based on the following question: {question['question']}\n\n"
-        user_message += f"Rubric:\n"
-        for rub in question["rubric"]:
-            user_message += f"- {rub['score']}: {rub['description']}\n"
-        user_message += """
-Remember that your output should be in the following format:
+    if not reps:
+        raise BatchPending(f"{batch_key} {question['name']}")
+    return make_score_entry(question, reps)
 
-<plot_rater>
-    <thinking>Your reasoning for the score</thinking>
-    <score>numeric_score</score>
-</plot_rater>
-"""
-        messages.append({"role": "user", "content": user_message})
+def rate_plot_batch(
+    *,
+    plots: List[Tuple[str, str]],
+    question: Dict[str, Any],
+    model: str,
+    repnum: int,
+    batch: Callable[..., Tuple[str, int, int]] | None = None,
+    batch_key: str = ""
+) -> Dict[str, Dict[str, Any]]:
+    """Rate several (plot_id, image_data_url) plots on a question in one request.
+
+    Returns the ratings by plot_id. Plots missing from the response are left out,
+    and the request is only retried if no plot could be parsed.
+    """
+    messages = create_plot_batch_messages(plots, question)
+    plot_ids = [plot_id for plot_id, _ in plots]
+    valid_scores = [float(rub["score"]) for rub in question["rubric"]]
+    options = get_completion_options(model)
+    if "response_format" in options:
+        options["response_format"] = multi_rating_response_format(max_thinking_chars=max_thinking_chars)
+    if batch is not None:
+        custom_id = make_custom_id("plot_rating_batch", batch_key, plot_ids, question["name"], question["version"], repnum, model, messages)
+        assistant_response, _, _ = batch(custom_id, messages=messages, model=model, **options)
+        return parse_multi_rating_response(assistant_response, tag="plot_rater", ids=plot_ids, valid_scores=valid_scores)
+    attempt = 1
+    while True:
+        assistant_response, _, _, _ = run_completion(messages=messages, model=model, **options)
+        ratings = parse_multi_rating_response(assistant_response, tag="plot_rater", ids=plot_ids, valid_scores=valid_scores)
+        if ratings:
+            if len(ratings) < len(plot_ids):
+                print(f"Response had ratings for {len(ratings)} of {len(plot_ids)} plots, leaving the rest for the next run")
+            return ratings
+        print(assistant_response)
+        if attempt >= max_unit_attempts:
+            raise ValueError("Invalid assistant response format")
+        attempt += 1
+        print(f"Error parsing response, retrying attempt {attempt}/{max_unit_attempts}")
 
-        assistant_response, _, _, _ = run_completion(messages=messages, model=model)
+def rate_plots_in_batches(
+    *,
+    plots: List[Tuple[Dict[str, Any], str]],
+    question: Dict[str, Any],
+    model: str | None = None,
+    num_repeats: int = 3,
+    on_update: Callable[[], None] | None = None,
+    batch: Callable[..., Tuple[str, int, int]] | None = None,
+    batch_key: str = "",
+    executor: Executor | None = None,
+    question_names: List[str] | None = None,
+    plot_batch_size: int = default_plot_batch_size
+):
+    """Rate the (plot_entry, image_data_url) plots of a notebook on a question, plot_batch_size plots per request.
+
+    Each repetition gets its own requests, and the scores are stored in the
+    plot entries, keeping any existing repetitions. If on_update is provided,
+    it is called after every request. If executor is provided, the requests run
+    on it concurrently.
+    """
+    if not model:
+        model = "google/gemini-2.0-flash-001"
 
-        a = parse_assistant_response(assistant_response)
-        reps.append({
-            "score": a["score"],
-            "thinking": a["thinking"],
-            "repnum": repnum
-        })
+    units = []
+    for repnum in range(num_repeats):
+        todo = [(entry, url) for entry, url in plots if repnum not in set(rep["repnum"] for rep in get_reps(entry, question))]
+        for i in range(0, len(todo), plot_batch_size):
+            units.append((repnum, todo[i:i + plot_batch_size]))
+
+    def rate(unit) -> Dict[str, Dict[str, Any]]:
+        repnum, chunk = unit
+        print(f"Rating {len(chunk)} plots on {question['name']}, repetition {repnum + 1}/{num_repeats}")
+        return rate_plot_batch(
+            plots=[(entry["plot_id"], url) for entry, url in chunk],
+            question=question,
+            model=model,
+            repnum=repnum,
+            batch=batch,
+            batch_key=batch_key
+        )
+
+    def apply(unit, ratings: Dict[str, Dict[str, Any]]):
+        repnum, chunk = unit
+        for entry, _ in chunk:
+            a = ratings.get(entry["plot_id"])
+            if a is None:
+                continue
+            rep = {"score": a["score"], "thinking": a["thinking"], "repnum": repnum}
+            if a.get("salvaged"):
+                rep["salvaged"] = True
+            add_rep(entry, question, rep, question_names=question_names)
+        if on_update is not None:
+            on_update()
+
+    run_units(units, rate, apply, executor=executor)
+
+def get_reps(plot_entry: Dict[str, Any], question: Dict[str, Any]) -> List[Dict[str, Any]]:
+    score = next((s for s in plot_entry["scores"] if s["name"] == question["name"]), None)
+    return list(score["reps"]) if score else []
+
+def add_rep(plot_entry: Dict[str, Any], question: Dict[str, Any], rep: Dict[str, Any], *, question_names: List[str] | None = None):
+    """Add a repetition to the plot's score for the question, keeping the reps sorted by repnum and the scores in rubric order."""
+    reps = sorted(get_reps(plot_entry, question) + [rep], key=lambda x: x["repnum"])
+    score_entry = make_score_entry(question, reps)
+    scores = plot_entry["scores"]
+    ind = next((i for i, s in enumerate(scores) if s["name"] == question["name"]), None)
+    if ind is None:
+        scores.append(score_entry)
+    else:
+        scores[ind] = score_entry
+    if question_names is not None:
+        # units complete in any order when run concurrently
+        scores.sort(key=lambda s: question_names.index(s["name"]) if s["name"] in question_names else len(question_names))
+
+def run_units(units: List[Any], rate: Callable[[Any], Any], apply: Callable[[Any, Any], None], *, executor: Executor | None = None):
+    """Call rate(unit) for each unit, serially or on the executor, and apply(unit, result) in the calling thread.
+
+    A unit that fails is reported and skipped, to be rated on the next run.
+    """
+    if executor is None:
+        results = ((unit, lambda unit=unit: rate(unit)) for unit in units)
+    else:
+        futures = {executor.submit(rate, unit): unit for unit in units}
+        results = ((futures[future], future.result) for future in as_completed(futures))
+    for unit, get_result in results:
+        try:
+            result = get_result()
+        except BatchPending:
+            continue
+        except Exception as e:
+            print(f"Error rating plots: {e}")
+            continue
+        apply(unit, result)
 
+def make_score_entry(question: Dict[str, Any], reps: List[Dict[str, Any]]) -> Dict[str, Any]:
     average_score = sum([rep["score"] for rep in reps]) / len(reps)
     return {
         "name": question["name"],
@@ -130,8 +390,22 @@ def rate_notebook_plots(
     notebook_path: str,
     model: str | None = None,
     existing_ratings: Dict[str, Any] | None = None,
+    checkpoint: Callable[[Dict[str, Any]], None] | None = None,
+    batch: Callable[..., Tuple[str, int, int]] | None = None,
+    executor: Executor | None = None,
+    plot_batch_size: int = default_plot_batch_size,
 ) -> Dict[str, Any]:
-    """Rate all plots in a notebook."""
+    """Rate all plots in a notebook.
+
+    If checkpoint is provided, it is called with the partial result after every
+    completed (plot, question, rep).
+    If batch is provided, the completions come from a BatchWriter (exports the
+    pending units) or BatchResults (imports them) instead of the API.
+    If executor is provided, all the (plot, question, rep) requests of the
+    notebook run on it concurrently. The plots and scores in the result are in
+    the same order as when rating serially.
+    With plot_batch_size > 1, that many plots are rated together in one request.
+    """
     # load plot rating questions
     with open("plot_rubric.yml", "r") as f:
         questions = yaml.safe_load(f)
@@ -170,6 +444,10 @@ def rate_notebook_plots(
             result["metadata"] = json.load(f)
 
     plot_count = 0
+    # question name -> (plot entry, image data URL) of the plots left to rate in batched mode
+    pending_plots: Dict[str, List[Tuple[Dict[str, Any], str]]] = {}
+    # (plot entry, image data URL, question, repnum) left to rate concurrently
+    pending_reps: List[Tuple[Dict[str, Any], str, Dict[str, Any], int]] = []
     for cell_idx, cell in enumerate(notebook["cells"]):
         if cell["cell_type"] != "code":
             continue
@@ -215,6 +493,7 @@ def rate_notebook_plots(
                 "output_index": output_idx,
                 "scores": []
             }
+            result["plots"].append(plot_entry)
 
             # Get the image data URL for rating
             image_data_url = f"data:image/png;base64,{png_base64}"
@@ -222,25 +501,93 @@ def rate_notebook_plots(
             # Rate the plot for each question
             for question in questions["questions"]:
                 print(f"Rating question: {question['name']} version {question['version']}")
+                existing_score = None
                 if existing_plot_ratings:
                     existing_score = next((s for s in existing_plot_ratings["scores"] if s["name"] == question["name"]), None)
-                    if existing_score:
+                    if existing_score and len(existing_score["reps"]) >= num_repeats:
                         print(f"Existing score: {existing_score['score']:.2f}")
                         plot_entry["scores"].append(existing_score)
                         continue
+                if existing_score:
+                    # keep the checkpointed repetitions in the result until the rest are done
+                    plot_entry["scores"].append(existing_score)
+                if plot_batch_size > 1:
+                    # rated below, once all the plots of the notebook are known
+                    pending_plots.setdefault(question["name"], []).append((plot_entry, image_data_url))
+                    continue
+                if executor is not None:
+                    # rated below, together with the other plots of the notebook
+                    done_repnums = set(rep["repnum"] for rep in existing_score["reps"]) if existing_score else set()
+                    pending_reps.extend((plot_entry, image_data_url, question, repnum) for repnum in range(num_repeats) if repnum not in done_repnums)
+                    continue
+
+                def on_rep(partial_score: Dict[str, Any]):
+                    scores = plot_entry["scores"]
+                    ind = next((i for i, s in enumerate(scores) if s["name"] == partial_score["name"]), None)
+                    if ind is None:
+                        scores.append(partial_score)
+                    else:
+                        scores[ind] = partial_score
+                    if checkpoint is not None:
+                        checkpoint(result)
+
                 try:
                     score_result = rate_plot(
                         image_data_url=image_data_url,
                         question=question,
-                        model=model
+                        model=model,
+                        num_repeats=num_repeats,
+                        existing_reps=existing_score["reps"] if existing_score else None,
+                        on_rep=on_rep,
+                        batch=batch,
+                        batch_key=f"{notebook_path}:{plot_id}"
                     )
-                    plot_entry["scores"].append(score_result)
                     print(f"Score: {score_result['score']:.2f}")
+                except BatchPending:
+                    pass
                 except Exception as e:
                     print(f"Error rating plot: {e}")
                     time.sleep(3)  # so user can see the error
 
-            result["plots"].append(plot_entry)
+    question_names = [question["name"] for question in questions["questions"]]
+    on_update = (lambda: checkpoint(result)) if checkpoint is not None else None
+
+    def rate(unit) -> Dict[str, Any]:
+        plot_entry, image_data_url, question, repnum = unit
+        return rate_plot_rep(
+            image_data_url=image_data_url,
+            question=question,
+            model=model,
+            repnum=repnum,
+            batch=batch,
+            batch_key=f"{notebook_path}:{plot_entry['plot_id']}"
+        )
+
+    def apply(unit, rep: Dict[str, Any]):
+        plot_entry, _, question, _ = unit
+        add_rep(plot_entry, question, rep, question_names=question_names)
+        if on_update is not None:
+            on_update()
+
+    if pending_reps:
+        print(f"\nRating {len(pending_reps)} plot repetitions concurrently")
+        run_units(pending_reps, rate, apply, executor=executor)
+
+    for question in questions["questions"]:
+        if question["name"] not in pending_plots:
+            continue
+        rate_plots_in_batches(
+            plots=pending_plots[question["name"]],
+            question=question,
+            model=model,
+            num_repeats=num_repeats,
+            on_update=on_update,
+            batch=batch,
+            batch_key=notebook_path,
+            executor=executor,
+            question_names=question_names,
+            plot_batch_size=plot_batch_size
+        )
 
     # Print summary
     print(f"\nProcessed {plot_count} plots in {notebook_path}")
@@ -251,7 +598,27 @@ def rate_notebook_plots(
 
     return result
 
-def main():
+def update_rating(all_ratings: List[Dict[str, Any]], new_rating: Dict[str, Any]):
+    """Replace the rating for the notebook (if any) with the new rating, keeping the list sorted."""
+    all_ratings[:] = [r for r in all_ratings if r["notebook"] != new_rating["notebook"]]
+    all_ratings.append(new_rating)
+    all_ratings.sort(key=lambda x: x["notebook"])
+
+@click.command()
+@click.option("--export-batch", default=None, help="Write the pending requests to this JSONL file instead of calling the API")
+@click.option("--import-batch", default=None, help="Fill in the plot ratings from this batch results JSONL file instead of calling the API")
+@click.option("--plot-batch-size", type=click.IntRange(min=1), default=default_plot_batch_size, show_default=True, help="Number of plots of a notebook rated together in one request")
+@click.option("--max-concurrent-requests", type=click.IntRange(min=1), default=default_max_concurrent_requests, show_default=True, help="Maximum number of rating requests in flight at once, across plots and notebooks (1 rates serially)")
+def main(export_batch, import_batch, plot_batch_size, max_concurrent_requests):
+    """Rate the plots of the notebooks in dandisets/ and save the results to plot_ratings.json."""
+    if export_batch and import_batch:
+        raise click.UsageError("--export-batch and --import-batch are mutually exclusive")
+    batch = None
+    if export_batch:
+        batch = BatchWriter(export_batch)
+    elif import_batch:
+        batch = BatchResults(import_batch)
+
     notebooks = find_notebooks("dandisets")
     print(f"Found {len(notebooks)} notebooks to process")
 
@@ -262,33 +629,47 @@ def main():
     else:
         all_ratings = []
 
-    for i, (dandiset_id, notebook_path) in enumerate(notebooks, 1):
+    # notebooks run in parallel threads when rating concurrently
+    ratings_lock = threading.Lock()
+
+    def checkpoint(partial_rating: Dict[str, Any]):
+        with ratings_lock:
+            # a copy, so that saving never sees a result that another thread is updating
+            update_rating(all_ratings, copy.deepcopy(partial_rating))
+            save_json_atomic(ratings_fname, all_ratings)
+
+    def process_notebook(i: int, dandiset_id: str, notebook_path: str, executor: Executor | None):
         print(f"\nProcessing notebook {i}/{len(notebooks)}")
         print(f"Dandiset: {dandiset_id}")
         print(f"Path: {notebook_path}")
 
         existing_notebook_rating = None
-        for rating in all_ratings:
-            if rating["notebook"] == notebook_path:
-                existing_notebook_rating = rating
-                break
+        with ratings_lock:
+            for rating in all_ratings:
+                if rating["notebook"] == notebook_path:
+                    existing_notebook_rating = rating
+                    break
 
         try:
             new_rating = rate_notebook_plots(
                 notebook_path=notebook_path,
                 model=model,
-                existing_ratings=existing_notebook_rating
+                existing_ratings=existing_notebook_rating,
+                checkpoint=checkpoint if not export_batch else None,
+                batch=batch,
+                executor=executor,
+                plot_batch_size=plot_batch_size
             )
+            if export_batch:
+                return
+            if import_batch and not any(plot["scores"] for plot in new_rating["plots"]):
+                # nothing rated for this notebook yet
+                return
 
-            # Replace or append the new rating
-            if existing_notebook_rating:
-                all_ratings.remove(existing_notebook_rating)
-            all_ratings.append(new_rating)
-
-            # Sort and save ratings
-            all_ratings.sort(key=lambda x: x["notebook"])
-            with open(ratings_fname, "w") as f:
-                json.dump(all_ratings, f, indent=2)
+            # Replace or append the new rating, then save
+            with ratings_lock:
+                update_rating(all_ratings, new_rating)
+                save_json_atomic(ratings_fname, all_ratings)
 
             print(f"Ratings saved for {notebook_path}")
 
@@ -299,5 +680,23 @@ def main():
 
         print("\n")
 
+    if max_concurrent_requests > 1:
+        # the requests of all notebooks share one pool, so the cap holds across notebooks
+        with ThreadPoolExecutor(max_workers=max_concurrent_requests) as executor:
+            with ThreadPoolExecutor(max_workers=max_concurrent_notebooks) as notebook_executor:
+                list(notebook_executor.map(
+                    lambda args: process_notebook(args[0], *args[1], executor),
+                    enumerate(notebooks, 1)
+                ))
+    else:
+        for i, (dandiset_id, notebook_path) in enumerate(notebooks, 1):
+            process_notebook(i, dandiset_id, notebook_path, None)
+
+    if isinstance(batch, BatchWriter):
+        batch.save()
+    elif isinstance(batch, BatchResults):
+        batch.report()
+    print_telemetry()
+
 if __name__ == "__main__":
     main()
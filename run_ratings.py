@@ -2,16 +2,47 @@
 
 import os
 import json
+import functools
+import click
 import requests
 import yaml
 from pathlib import Path
 from typing import Dict, Any
-from typing import List, Tuple
-from helpers.run_completion import run_completion
+from typing import Callable, List, Tuple
+from helpers.run_completion import run_completion, MessagePrefix, print_telemetry
+from helpers.json_io import save_json_atomic
+from helpers.output_compaction import OutputCompactor
+from helpers.rating_response import (
+    parse_rating_response,
+    supports_structured_output,
+    rating_response_format,
+    rating_json_instructions,
+)
+from helpers.token_estimate import estimate_message_tokens
+from helpers.batch_requests import BatchPending, BatchWriter, BatchResults, make_custom_id
+from concurrent.futures import ThreadPoolExecutor
 
 model = None
 # model = "anthropic/claude-3.5-sonnet"
 
+default_model = "google/gemini-2.0-flash-001"
+num_repeats = 3
+# number of attempts for a single (question, rep) before leaving it for the next run
+max_unit_attempts = 3
+# limits on the notebook outputs sent to the rater (see helpers/output_compaction.py), or None to send them verbatim
+output_compaction: Dict[str, Any] | None = None
+# notebooks whose rating prompt is estimated above this many tokens are rated in map-reduce mode:
+# segments of at most segment_max_tokens are summarized concurrently, then each question is rated from the summaries
+chunked_rating_threshold_tokens = 150000
+segment_max_tokens = 60000
+max_segment_workers = 4
+# ask for a JSON rating instead of <notebook_rater> tags, enforced with a JSON schema for models that support it
+structured_output = False
+# limit on the length of the reasoning in structured output
+max_thinking_chars = 1000
+# limit on the completion tokens of each rating request, or None for the provider's default
+max_completion_tokens: int | None = None
+
 
 def find_notebooks(base_dir: str) -> List[Tuple[str, str]]:
     """Find notebooks matching the pattern dandisets/<DANDISET_ID>/subfolder/<DANDISET_ID>.ipynb."""
@@ -40,14 +71,35 @@ def find_notebooks(base_dir: str) -> List[Tuple[str, str]]:
 
 def read_rate_system_prompt() -> str:
     """Read and process the system prompt template."""
-    template_path = Path(__file__).parent / "templates" / "rate_system_prompt.txt"
+    return read_template("rate_system_prompt.txt")
+
+
+def read_segment_system_prompt() -> str:
+    """Read the system prompt for taking notes on a notebook segment."""
+    return read_template("rate_segment_system_prompt.txt")
+
+
+def read_template(name: str) -> str:
+    """Read a file of templates/, cached until the file changes (e.g. while watch_notebooks.py runs)."""
+    template_path = Path(__file__).parent / "templates" / name
+    return _read_template(str(template_path), os.stat(template_path).st_mtime_ns)
+
+
+@functools.lru_cache(maxsize=8)
+def _read_template(template_path: str, mtime_ns: int) -> str:
     with open(template_path, "r") as f:
         content = f.read()
     return content
 
 
-def create_user_message_content_for_cell(cell: Dict[str, Any]) -> List[Dict[str, Any]]:
-    """Create user message content for a given cell."""
+def create_user_message_content_for_cell(
+    cell: Dict[str, Any], compactor: OutputCompactor | None = None
+) -> List[Dict[str, Any]]:
+    """Create user message content for a given cell.
+
+    If a compactor is provided, text and HTML outputs are truncated and images
+    are dropped according to its limits.
+    """
     content: List[Dict[str, Any]] = []
     if cell["cell_type"] == "markdown":
         markdown_source = cell["source"]
@@ -60,28 +112,41 @@ def create_user_message_content_for_cell(cell: Dict[str, Any]) -> List[Dict[str,
         for x in cell["outputs"]:
             output_type = x["output_type"]
             if output_type == "stream":
+                text = "\n".join(x["text"])
+                if compactor is not None:
+                    text = compactor.compact_text(text)
                 content.append(
-                    {"type": "text", "text": "OUTPUT-TEXT: " + "\n".join(x["text"])}
+                    {"type": "text", "text": "OUTPUT-TEXT: " + text}
                 )
             elif output_type == "display_data" or output_type == "execute_result":
-                if "image/png" in x["data"]:
+                if "image/png" in x["data"] and compactor is not None and not compactor.allow_image():
+                    content.append(
+                        {"type": "text", "text": "OUTPUT-IMAGE: [image omitted: the notebook's image limit was reached]"}
+                    )
+                elif "image/png" in x["data"]:
                     png_base64 = x["data"]["image/png"]
                     image_data_url = f"data:image/png;base64,{png_base64}"
                     content.append(
                         {"type": "image_url", "image_url": {"url": image_data_url}}
                     )
                 elif "text/plain" in x["data"]:
+                    text = "".join(x["data"]["text/plain"])
+                    if compactor is not None:
+                        text = compactor.compact_text(text)
                     content.append(
                         {
                             "type": "text",
-                            "text": "OUTPUT-TEXT: " + "".join(x["data"]["text/plain"]),
+                            "text": "OUTPUT-TEXT: " + text,
                         }
                     )
                 elif "text/html" in x["data"]:
+                    html = "".join(x["data"]["text/html"])
+                    if compactor is not None:
+                        html = compactor.compact_html(html)
                     content.append(
                         {
                             "type": "text",
-                            "text": "OUTPUT-HTML: " + "".join(x["data"]["text/html"]),
+                            "text": "OUTPUT-HTML: " + html,
                         }
                     )
                 else:
@@ -96,42 +161,33 @@ def create_user_message_content_for_cell(cell: Dict[str, Any]) -> List[Dict[str,
     return content
 
 
-def parse_assistant_response(assistant_response: str) -> Dict[str, Any]:
-    ind1 = assistant_response.find("<notebook_rater>")
-    ind2 = assistant_response.find("</notebook_rater>")
-    if ind1 == -1 or ind2 == -1:
-        raise ValueError("Invalid assistant response format")
-    ind1 += len("<notebook_rater>")
-    content = assistant_response[ind1:ind2]
-    thinking_ind1 = content.find("<thinking>")
-    thinking_ind2 = content.find("</thinking>")
-    if thinking_ind1 == -1 or thinking_ind2 == -1:
-        raise ValueError("Invalid assistant response format")
-    thinking_ind1 += len("<thinking>")
-    thinking = content[thinking_ind1:thinking_ind2].strip()
-    score_ind1 = content.find("<score>")
-    score_ind2 = content.find("</score>")
-    if score_ind1 == -1 or score_ind2 == -1:
-        raise ValueError("Invalid assistant response format")
-    score_ind1 += len("<score>")
-    score = content[score_ind1:score_ind2].strip()
-    try:
-        score = float(score)
-    except ValueError:
-        raise ValueError("Invalid score format")
-    return {"thinking": thinking, "score": score}
+def parse_assistant_response(
+    assistant_response: str, valid_scores: List[float] | None = None
+) -> Dict[str, Any]:
+    return parse_rating_response(assistant_response, tag="notebook_rater", valid_scores=valid_scores)
 
 
-def rate_notebook(
-    *,
-    notebook_path_or_url: str,
-    model: str | None = None,
-    existing_ratings: dict | None = None,
-):
-    num_repeats = 3
+def get_completion_options(model: str) -> Dict[str, Any]:
+    """Get the response_format and max_tokens arguments of run_completion for a rating request."""
+    options: Dict[str, Any] = {}
+    if structured_output and supports_structured_output(model):
+        options["response_format"] = rating_response_format(max_thinking_chars=max_thinking_chars)
+    if max_completion_tokens is not None:
+        options["max_tokens"] = max_completion_tokens
+    return options
+
+
+def load_rubric(rubric_path: str = "rubric.yml") -> Dict[str, Any]:
+    """Load and validate the rating questions.
+
+    The result is cached until the file changes and shared between callers, so it must not be modified.
+    """
+    return _load_rubric(rubric_path, os.stat(rubric_path).st_mtime_ns)
 
-    # load questions
-    with open("rubric.yml", "r") as f:
+
+@functools.lru_cache(maxsize=8)
+def _load_rubric(rubric_path: str, mtime_ns: int) -> Dict[str, Any]:
+    with open(rubric_path, "r") as f:
         questions = yaml.safe_load(f)
 
     assert "questions" in questions, "questions.yaml must contain a 'questions' key"
@@ -143,10 +199,11 @@ def rate_notebook(
         for rub in question["rubric"]:
             assert "score" in rub, "Each rubric must have a 'score' key"
             assert "description" in rub, "Each rubric must have a 'description' key"
+    return questions
 
-    if not model:
-        model = "google/gemini-2.0-flash-001"
 
+def load_notebook(notebook_path_or_url: str) -> Tuple[str, Dict[str, Any]]:
+    """Load a notebook from a local path or URL, returning the resolved path/URL and the notebook."""
     # If it's a notebook in a GitHub repo then translate the notebook URL to raw URL
     if notebook_path_or_url.startswith("https://github.com/"):
         notebook_path_or_url = notebook_path_or_url.replace(
@@ -171,6 +228,298 @@ def rate_notebook(
     if not "cells" in notebook:
         raise Exception(f"Invalid notebook format. No cells found in the notebook.")
 
+    return notebook_path_or_url, notebook
+
+
+# default of the compaction parameters below: use output_compaction
+_default_compaction: Any = object()
+
+
+def make_compactor(compaction: Dict[str, Any] | None = _default_compaction) -> OutputCompactor | None:
+    """Create the compactor for one notebook, from a compaction config (None for verbatim outputs) or output_compaction by default."""
+    if compaction is _default_compaction:
+        compaction = output_compaction
+    return OutputCompactor(compaction) if compaction is not None else None
+
+
+def create_notebook_prefix(
+    cells: List[Dict[str, Any]], *, compaction: Dict[str, Any] | None = _default_compaction
+) -> MessagePrefix:
+    """Create the messages shared by the rating requests of all questions: the system prompt and the notebook cells.
+
+    Building them once per notebook means the image data URLs are created once,
+    and run_completion serializes them once for all the requests.
+    The outputs are compacted with the compaction config (None to send them
+    verbatim), which defaults to output_compaction.
+    """
+    messages: List[Dict[str, Any]] = [
+        {"role": "system", "content": read_rate_system_prompt()}
+    ]
+    compactor = make_compactor(compaction)
+    for cell in cells:
+        content = create_user_message_content_for_cell(cell, compactor)
+        messages.append({"role": "system", "content": content})
+    return MessagePrefix(messages)
+
+
+def create_messages_for_question(
+    cells: List[Dict[str, Any]],
+    question: Dict[str, Any],
+    prefix: MessagePrefix | None = None,
+    *,
+    compaction: Dict[str, Any] | None = _default_compaction,
+) -> List[Dict[str, Any]]:
+    """Create the messages for rating the notebook cells on a single question.
+
+    Pass the notebook's prefix from create_notebook_prefix to share it between
+    questions. Without a prefix, the outputs are compacted as in create_notebook_prefix.
+    """
+    if prefix is None:
+        prefix = create_notebook_prefix(cells, compaction=compaction)
+    return prefix.with_messages({"role": "user", "content": create_question_user_message(question)})
+
+
+def create_question_user_message(question: Dict[str, Any]) -> str:
+    user_message = f"Please rate the notebook based on the following question: {question['question']}\n\n"
+    user_message += f"Rubric:\n"
+    for rub in question["rubric"]:
+        user_message += f"- {rub['score']}: {rub['description']}\n"
+    if structured_output:
+        return user_message + rating_json_instructions(max_thinking_chars=max_thinking_chars)
+    user_message += """
+    Remember that your output should be in the following format:
+
+    <notebook_rater>
+        <thinking>Your reasoning for the score</thinking>
+        <score>numeric_score</score>
+    </notebook_rater>
+    """
+    return user_message
+
+
+def split_cells_into_segments(
+    cells: List[Dict[str, Any]], *, max_tokens: int, model: str
+) -> List[Tuple[int, int]]:
+    """Split the cells into consecutive (start, end) index ranges of at most max_tokens each.
+
+    A single cell larger than max_tokens gets a segment of its own.
+    """
+    compactor = make_compactor()
+    segments = []
+    start = 0
+    segment_tokens = 0
+    for i, cell in enumerate(cells):
+        estimate = estimate_message_tokens(
+            [{"role": "system", "content": create_user_message_content_for_cell(cell, compactor)}], model=model
+        )
+        cell_tokens = estimate["text_tokens"] + estimate["image_tokens"]
+        if i > start and segment_tokens + cell_tokens > max_tokens:
+            segments.append((start, i))
+            start = i
+            segment_tokens = 0
+        segment_tokens += cell_tokens
+    if start < len(cells):
+        segments.append((start, len(cells)))
+    return segments
+
+
+def create_segment_messages(
+    cells: List[Dict[str, Any]], segment: Tuple[int, int], num_segments: int, segment_index: int, questions: List[Dict[str, Any]]
+) -> List[Dict[str, Any]]:
+    """Create the messages for taking notes on one segment of a notebook (the map step)."""
+    start, end = segment
+    messages: List[Dict[str, Any]] = [
+        {"role": "system", "content": read_segment_system_prompt()},
+        {"role": "system", "content": f"SEGMENT {segment_index + 1} OF {num_segments}: cells {start + 1} to {end} of {len(cells)}"},
+    ]
+    # the compactor has to see the cells before the segment, so that the notebook-wide limits apply as in a single request
+    compactor = make_compactor()
+    for i, cell in enumerate(cells[:end]):
+        content = create_user_message_content_for_cell(cell, compactor)
+        if i >= start:
+            messages.append({"role": "system", "content": content})
+    user_message = "Please write notes on this segment for the following questions:\n\n"
+    for question in questions:
+        user_message += f"- {question['name']}: {question['question']}\n"
+    messages.append({"role": "user", "content": user_message})
+    return messages
+
+
+def parse_segment_notes(assistant_response: str) -> str:
+    ind1 = assistant_response.find("<segment_notes>")
+    ind2 = assistant_response.find("</segment_notes>")
+    if ind1 == -1 or ind2 == -1:
+        # the notes are only read by the reduce step, so a response without the tags is still usable
+        return assistant_response.strip()
+    return assistant_response[ind1 + len("<segment_notes>"):ind2].strip()
+
+
+def take_segment_notes(
+    cells: List[Dict[str, Any]], questions: List[Dict[str, Any]], *, model: str
+) -> Tuple[List[Dict[str, Any]], int, int]:
+    """Split a long notebook into segments and take notes on them concurrently (the map step).
+
+    Returns the notes for each segment (with its cell range) and the token counts.
+    """
+    segments = split_cells_into_segments(cells, max_tokens=segment_max_tokens, model=model)
+    print(f"Notebook is too long to rate at once, taking notes on {len(segments)} segments")
+
+    def take_notes(segment_index: int) -> Tuple[str, int, int]:
+        messages = create_segment_messages(cells, segments[segment_index], len(segments), segment_index, questions)
+        assistant_response, _, prompt_tokens, completion_tokens = run_completion(messages=messages, model=model)
+        return parse_segment_notes(assistant_response), prompt_tokens, completion_tokens
+
+    with ThreadPoolExecutor(max_workers=max_segment_workers) as executor:
+        results = list(executor.map(take_notes, range(len(segments))))
+    segment_notes = [
+        {"start": start, "end": end, "notes": notes}
+        for (start, end), (notes, _, _) in zip(segments, results)
+    ]
+    return segment_notes, sum(r[1] for r in results), sum(r[2] for r in results)
+
+
+def create_reduce_messages_for_question(
+    segment_notes: List[Dict[str, Any]], num_cells: int, question: Dict[str, Any]
+) -> List[Dict[str, Any]]:
+    """Create the messages for rating a long notebook on a single question from its segment notes (the reduce step)."""
+    messages: List[Dict[str, Any]] = [
+        {"role": "system", "content": read_rate_system_prompt()},
+        {
+            "role": "system",
+            "content": (
+                f"The notebook has {num_cells} cells, which is too long to be shown at once. "
+                f"It was split into {len(segment_notes)} consecutive segments and each segment was reviewed separately. "
+                "Below are the notes on each segment, in order. Base your rating on these notes."
+            ),
+        },
+    ]
+    for i, s in enumerate(segment_notes):
+        messages.append({
+            "role": "system",
+            "content": f"NOTES ON SEGMENT {i + 1} OF {len(segment_notes)} (cells {s['start'] + 1} to {s['end']}):\n{s['notes']}",
+        })
+    messages.append({"role": "user", "content": create_question_user_message(question)})
+    return messages
+
+
+def find_existing_score(
+    existing_ratings: dict | None, question: Dict[str, Any], *, verbose: bool = True
+) -> Dict[str, Any] | None:
+    """Find a complete existing score for the question, if any."""
+    if existing_ratings is None:
+        return None
+    for existing_score0 in existing_ratings["scores"]:
+        if (
+            existing_score0["name"] == question["name"]
+            and existing_score0["version"] == question["version"]
+        ):
+            if len(existing_score0["reps"]) == num_repeats:
+                if verbose:
+                    print(
+                        f"Found existing score for question {question['name']} version {question['version']}: {existing_score0['score']}"
+                    )
+                return existing_score0
+            elif verbose:
+                print(
+                    f"Found existing score for question {question['name']} version {question['version']}, but it has {len(existing_score0['reps'])} repetitions. Rating the remaining repetitions."
+                )
+    return None
+
+
+def find_partial_reps(
+    existing_ratings: dict | None, question: Dict[str, Any]
+) -> List[Dict[str, Any]]:
+    """Find the repetitions already completed for a question that has not been fully rated."""
+    if existing_ratings is None:
+        return []
+    for existing_score0 in existing_ratings["scores"]:
+        if (
+            existing_score0["name"] == question["name"]
+            and existing_score0["version"] == question["version"]
+        ):
+            return list(existing_score0["reps"])
+    return []
+
+
+def fill_overall_score(result: Dict[str, Any], questions: Dict[str, Any]):
+    """Set the overall score of a result, marking it incomplete unless every (question, rep) of the rubric is done.
+
+    The overall score of an incomplete result is the sum over the questions
+    rated so far, so consumers should skip or flag such results.
+    """
+    result["overall_score"] = sum([q["score"] for q in result["scores"]])
+    if all(find_existing_score(result, question, verbose=False) for question in questions["questions"]):
+        result.pop("incomplete", None)
+    else:
+        result["incomplete"] = True
+
+
+def rate_unit(
+    *,
+    messages: List[Dict[str, Any]],
+    model: str,
+    valid_scores: List[float] | None = None,
+    batch: Callable[..., Tuple[str, int, int]] | None = None,
+    custom_id: str | None = None,
+    prefix: MessagePrefix | None = None,
+) -> Tuple[Dict[str, Any], int, int]:
+    """Get a single (question, rep) rating, retrying only this unit if no score can be recovered from the response.
+
+    If batch is provided (see helpers/batch_requests.py), the completion comes
+    from it by custom_id instead of the API, and BatchPending propagates.
+    If prefix is provided, the messages start with it (see create_notebook_prefix).
+    """
+    if batch is not None:
+        # a stored result would be the same on every attempt, so there is no retry
+        assistant_response, prompt_tokens, completion_tokens = batch(
+            custom_id, messages=messages, model=model, **get_completion_options(model)
+        )
+        print(assistant_response)
+        return parse_assistant_response(assistant_response, valid_scores), prompt_tokens, completion_tokens
+    prompt_tokens = 0
+    completion_tokens = 0
+    attempt = 1
+    while True:
+        assistant_response, _, prompt_tokens0, completion_tokens0 = run_completion(
+            messages=messages, model=model, prefix=prefix, **get_completion_options(model)
+        )
+        prompt_tokens += prompt_tokens0
+        completion_tokens += completion_tokens0
+        print(assistant_response)
+        try:
+            return parse_assistant_response(assistant_response, valid_scores), prompt_tokens, completion_tokens
+        except ValueError as e:
+            if attempt >= max_unit_attempts:
+                raise
+            attempt += 1
+            print(f"Error parsing response ({e}), retrying attempt {attempt}/{max_unit_attempts}")
+
+
+def rate_notebook(
+    *,
+    notebook_path_or_url: str,
+    model: str | None = None,
+    existing_ratings: dict | None = None,
+    checkpoint: Callable[[Dict[str, Any]], None] | None = None,
+    batch: Callable[..., Tuple[str, int, int]] | None = None,
+):
+    """Rate a notebook on all questions of the rubric.
+
+    If checkpoint is provided, it is called with the partial result after every
+    completed (question, rep) so that paid completions are never lost. A unit
+    that keeps failing is skipped and left incomplete, to be resumed on the next run.
+
+    If batch is provided, the completions come from a BatchWriter (exports the
+    pending units) or BatchResults (imports them), and units without a result
+    are left incomplete.
+    """
+    questions = load_rubric()
+
+    if not model:
+        model = default_model
+
+    notebook_path_or_url, notebook = load_notebook(notebook_path_or_url)
+
     total_prompt_tokens = 0
     total_completion_tokens = 0
     cells = notebook["cells"]
@@ -194,24 +543,21 @@ def rate_notebook(
     if metadata:
         new_result["metadata"] = metadata
 
+    # the notebook part of the prompt is the same for every question
+    prefix = create_notebook_prefix(cells)
+    estimate = estimate_message_tokens(create_messages_for_question(cells, questions["questions"][0], prefix), model=model)
+    chunked = estimate["text_tokens"] + estimate["image_tokens"] > chunked_rating_threshold_tokens
+    if chunked:
+        new_result["rating_mode"] = "map_reduce"
+        if batch is not None:
+            # the reduce requests depend on the responses of the map requests
+            print("Notebook is rated in map-reduce mode, which batch mode does not support. Skipping it.")
+    # notes on the notebook segments, taken once the first question needs them
+    segment_notes = None
+    segment_notes_failed = False
+
     for question in questions["questions"]:
-        existing_score = None
-        if existing_ratings is not None:
-            for existing_score0 in existing_ratings["scores"]:
-                if (
-                    existing_score0["name"] == question["name"]
-                    and existing_score0["version"] == question["version"]
-                ):
-                    if len(existing_score0["reps"]) == num_repeats:
-                        existing_score = existing_score0
-                        print(
-                            f"Found existing score for question {question['name']} version {question['version']}: {existing_score0['score']}"
-                        )
-                        break
-                    else:
-                        print(
-                            f"Found existing score for question {question['name']} version {question['version']}, but it has {len(existing_score0['reps'])} repetitions. Repeating the question."
-                        )
+        existing_score = find_existing_score(existing_ratings, question)
         if existing_score:
             new_result["scores"].append(existing_score)
             print(
@@ -219,58 +565,83 @@ def rate_notebook(
             )
             continue
 
-        reps = []
+        # resume from any repetitions that were checkpointed previously
+        reps = find_partial_reps(existing_ratings, question)
+        score_entry = {
+            "name": question["name"],
+            "version": question["version"],
+            "score": 0,
+            "reps": reps,
+        }
+        if reps:
+            score_entry["score"] = sum([rep["score"] for rep in reps]) / len(reps)
+            new_result["scores"].append(score_entry)
+        score_entry_added = bool(reps)
+        done_repnums = set(rep["repnum"] for rep in reps)
         for repnum in range(num_repeats):
-            system_prompt = read_rate_system_prompt()
-            messages: List[Dict[str, Any]] = [
-                {"role": "system", "content": system_prompt}
-            ]
-            for cell in cells:
-                content = create_user_message_content_for_cell(cell)
-                messages.append({"role": "system", "content": content})
-
-            user_message = f"Please rate the notebook based on the following question: {question['question']}\n\n"
-            user_message += f"Rubric:\n"
-            for rub in question["rubric"]:
-                user_message += f"- {rub['score']}: {rub['description']}\n"
-            user_message += """
-    Remember that your output should be in the following format:
-
-    <notebook_rater>
-        <thinking>Your reasoning for the score</thinking>
-        <score>numeric_score</score>
-    </notebook_rater>
-    """
-            messages.append({"role": "user", "content": user_message})
+            if repnum in done_repnums:
+                continue
+            if chunked and (batch is not None or segment_notes_failed):
+                continue
+            if chunked:
+                if segment_notes is None:
+                    try:
+                        segment_notes, prompt_tokens, completion_tokens = take_segment_notes(
+                            cells, questions["questions"], model=model
+                        )
+                    except Exception as e:
+                        print(f"Error taking notes on the notebook segments: {e}. Leaving the questions for the next run.")
+                        segment_notes_failed = True
+                        continue
+                    total_prompt_tokens += prompt_tokens
+                    total_completion_tokens += completion_tokens
+                    new_result["num_segments"] = len(segment_notes)
+                messages = create_reduce_messages_for_question(segment_notes, len(cells), question)
+            else:
+                messages = create_messages_for_question(cells, question, prefix)
             print(
                 f"Rating question {question['name']} version {question['version']} Repetition {repnum + 1}/{num_repeats}"
             )
             print(question["question"])
-            assistant_response, _, prompt_tokens, completion_tokens = run_completion(
-                messages=messages, model=model
-            )
+            try:
+                a, prompt_tokens, completion_tokens = rate_unit(
+                    messages=messages,
+                    model=model,
+                    valid_scores=[float(rub["score"]) for rub in question["rubric"]],
+                    batch=batch,
+                    custom_id=make_custom_id(
+                        "rating", notebook_path_or_url, question["name"], question["version"], repnum, model, messages
+                    ) if batch is not None else None,
+                    prefix=prefix if not chunked else None,
+                )
+            except BatchPending:
+                continue
+            except Exception as e:
+                print(
+                    f"Error rating question {question['name']} repetition {repnum + 1}: {e}. Leaving it for the next run."
+                )
+                continue
             total_prompt_tokens += prompt_tokens
             total_completion_tokens += completion_tokens
-
-            print(assistant_response)
             print(
                 f"Prompt tokens: {total_prompt_tokens}, Completion tokens: {total_completion_tokens}"
             )
 
-            a = parse_assistant_response(assistant_response)
-            reps.append(
-                {"score": a["score"], "thinking": a["thinking"], "repnum": repnum}
-            )
-        average_score = sum([rep["score"] for rep in reps]) / len(reps)
-        print(f"Score: {average_score} : {[rep['score'] for rep in reps]}")
-        new_result["scores"].append(
-            {
-                "name": question["name"],
-                "version": question["version"],
-                "score": average_score,
-                "reps": reps,
-            }
-        )
+            rep = {"score": a["score"], "thinking": a["thinking"], "repnum": repnum}
+            if a.get("salvaged"):
+                # recovered from a malformed response rather than paying for a new one
+                rep["salvaged"] = True
+            reps.append(rep)
+            reps.sort(key=lambda x: x["repnum"])
+            score_entry["score"] = sum([rep["score"] for rep in reps]) / len(reps)
+            if not score_entry_added:
+                new_result["scores"].append(score_entry)
+                score_entry_added = True
+            if checkpoint is not None:
+                fill_overall_score(new_result, questions)
+                checkpoint(new_result)
+        if reps:
+            print(f"Score: {score_entry['score']} : {[rep['score'] for rep in reps]}")
 
     print("")
     # Print a summary of all the scores
@@ -279,10 +650,7 @@ def rate_notebook(
         print(f"{question['score']:.2f} {[rep['score'] for rep in question['reps']]}")
         print("")
 
-    # Fill in the overall score
-    new_result["overall_score"] = sum(
-        [question["score"] for question in new_result["scores"]]
-    )
+    fill_overall_score(new_result, questions)
 
     # Report number of tokens used
     print(f"Total prompt tokens: {total_prompt_tokens}")
@@ -291,7 +659,32 @@ def rate_notebook(
     return new_result, total_prompt_tokens, total_completion_tokens
 
 
-def main():
+def update_rating(ratings: List[Dict[str, Any]], new_rating: Dict[str, Any]):
+    """Replace the rating for the notebook (if any) with the new rating, keeping the list sorted."""
+    ratings[:] = [r for r in ratings if r["notebook"] != new_rating["notebook"]]
+    ratings.append(new_rating)
+    ratings.sort(key=lambda x: x["notebook"])
+
+
+@click.command()
+@click.option("--export-batch", default=None, help="Write the pending requests to this JSONL file instead of calling the API")
+@click.option("--import-batch", default=None, help="Fill in the ratings from this batch results JSONL file instead of calling the API")
+def main(export_batch, import_batch):
+    """Rate the notebooks in dandisets/ and save the results to ratings.json.
+
+    With --export-batch, every pending (question, rep) is written as a request
+    with a stable custom_id, for a provider batch endpoint or another executor.
+    With --import-batch, the results of such a batch are stored in ratings.json
+    (running the export again then gives only the requests that are still missing).
+    """
+    if export_batch and import_batch:
+        raise click.UsageError("--export-batch and --import-batch are mutually exclusive")
+    batch = None
+    if export_batch:
+        batch = BatchWriter(export_batch)
+    elif import_batch:
+        batch = BatchResults(import_batch)
+
     # Find all matching notebooks
     notebooks = find_notebooks("dandisets")
     print(f"Found {len(notebooks)} notebooks to process")
@@ -306,6 +699,10 @@ def main():
     total_prompt_tokens = 0
     total_completion_tokens = 0
 
+    def checkpoint(partial_rating: Dict[str, Any]):
+        update_rating(ratings, partial_rating)
+        save_json_atomic(ratings_fname, ratings)
+
     # Process each notebook
     for i, (dandiset_id, notebook_path) in enumerate(notebooks, 1):
         print(f"\nProcessing notebook {i}/{len(notebooks)}")
@@ -323,18 +720,19 @@ def main():
                 notebook_path_or_url=notebook_path,
                 model=model,
                 existing_ratings=existing_notebook_rating,
+                checkpoint=checkpoint if not export_batch else None,
+                batch=batch,
             )
+            if export_batch:
+                continue
+            if import_batch and not new_rating["scores"]:
+                # nothing rated for this notebook yet
+                continue
             total_prompt_tokens += prompt_tokens
             total_completion_tokens += completion_tokens
-            # replace rating in ratings
-            if existing_notebook_rating is not None:
-                ratings.remove(existing_notebook_rating)
-            ratings.append(new_rating)
-            # sort ratingss
-            ratings.sort(key=lambda x: x["notebook"])
-            # save ratings
-            with open(ratings_fname, "w") as f:
-                json.dump(ratings, f, indent=2)
+            # replace rating in ratings and save
+            update_rating(ratings, new_rating)
+            save_json_atomic(ratings_fname, ratings)
             print(f"Rating saved for {notebook_path}")
             print(f"Total prompt tokens: {total_prompt_tokens}")
             print(f"Total completion tokens: {total_completion_tokens}")
@@ -350,6 +748,12 @@ def main():
         print("")
         print("")
 
+    if isinstance(batch, BatchWriter):
+        batch.save()
+    elif isinstance(batch, BatchResults):
+        batch.report()
+    print_telemetry()
+
 
 if __name__ == "__main__":
     main()
@@ -0,0 +1,239 @@
+#!/usr/bin/env python3
+
+"""Serve ratings, plot ratings and critiques through a local read-only HTTP API.
+
+    python serve_results.py [--port 8765]
+
+Endpoints:
+
+- GET /: the collections, with their number of entries
+- GET /ratings, /plot_ratings, /critiques: the entries of a collection, as
+  {"total", "offset", "limit", "items"}
+
+Query parameters (each filter takes a comma-separated list of values):
+
+- dandiset_id, subfolder, model, prompt, notebook: keep the matching entries
+- question: keep the entries with a score for the question, and only those
+  scores (ratings and plot_ratings)
+- fields: comma-separated top-level fields to return (e.g. notebook,overall_score)
+- reps=0: leave out the repetitions (and the rater's reasoning) of each score
+- incomplete=0: leave out the ratings marked incomplete (interrupted before
+  every question was done, so their overall_score is partial)
+- offset, limit: pagination (limit at most 1000, default 100)
+
+The files are held in memory with an index by each filter field, and
+reloaded when they change. Responses have an ETag (answering If-None-Match
+with 304) and are gzipped for clients that accept it.
+"""
+
+import os
+import gzip
+import json
+import hashlib
+import threading
+import click
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from urllib.parse import urlsplit, parse_qs
+from typing import Any, Dict, List, Tuple
+from helpers.run_info import get_run_info
+
+filter_fields = ["dandiset_id", "subfolder", "model", "prompt", "notebook", "question"]
+default_limit = 100
+max_limit = 1000
+# smaller responses are not worth compressing
+min_gzip_bytes = 1024
+
+
+class QueryError(Exception):
+    pass
+
+
+def get_questions(name: str, entry: Dict[str, Any]) -> List[str]:
+    if name == "ratings":
+        return [s["name"] for s in entry.get("scores", [])]
+    if name == "plot_ratings":
+        return sorted(set(s["name"] for plot in entry.get("plots", []) for s in plot["scores"]))
+    return []
+
+
+class Collection:
+    """The entries of one results file in memory, indexed by each filter field and reloaded when the file changes."""
+
+    def __init__(self, name: str, path: str):
+        self.name = name
+        self.path = path
+        # (version, entries, index), replaced as a whole so that readers always see a consistent snapshot
+        self.snapshot: Tuple[str, List[Dict[str, Any]], Dict[str, Dict[str, List[int]]]] = ("", [], {})
+        self.lock = threading.Lock()
+
+    def get_snapshot(self):
+        try:
+            st = os.stat(self.path)
+            version = f"{st.st_mtime_ns:x}-{st.st_size:x}"
+        except FileNotFoundError:
+            version = "missing"
+        if version != self.snapshot[0]:
+            with self.lock:
+                if version != self.snapshot[0]:
+                    self.snapshot = self.load(version)
+        return self.snapshot
+
+    def load(self, version: str):
+        entries = []
+        if version != "missing":
+            with open(self.path, "r") as f:
+                entries = json.load(f)
+        index: Dict[str, Dict[str, List[int]]] = {field: {} for field in filter_fields}
+        for i, entry in enumerate(entries):
+            run_info = get_run_info(entry)
+            values = {
+                "dandiset_id": [entry["dandiset_id"]],
+                "subfolder": [entry["subfolder"]],
+                "model": [run_info["model"]],
+                "prompt": [run_info["prompt"]],
+                "notebook": [entry["notebook"]],
+                "question": get_questions(self.name, entry),
+            }
+            for field, vals in values.items():
+                for v in vals:
+                    index[field].setdefault(v, []).append(i)
+        print(f"Loaded {len(entries)} entries from {self.path}")
+        return version, entries, index
+
+
+def shape_entry(entry: Dict[str, Any], *, questions: List[str] | None, reps: bool, fields: List[str] | None) -> Dict[str, Any]:
+    """Apply the question filter and the projection to an entry, without modifying it."""
+
+    def shape_scores(scores: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+        scores = [s for s in scores if questions is None or s["name"] in questions]
+        if not reps:
+            scores = [{k: v for k, v in s.items() if k != "reps"} for s in scores]
+        return scores
+
+    if fields is not None:
+        entry = {k: v for k, v in entry.items() if k in fields}
+    else:
+        entry = dict(entry)
+    if "scores" in entry:
+        entry["scores"] = shape_scores(entry["scores"])
+    if "plots" in entry:
+        entry["plots"] = [dict(plot, scores=shape_scores(plot["scores"])) for plot in entry["plots"]]
+        if questions is not None:
+            entry["plots"] = [plot for plot in entry["plots"] if plot["scores"]]
+    return entry
+
+
+def query_collection(collection: Collection, params: Dict[str, List[str]]) -> Tuple[str, Dict[str, Any]]:
+    """Get the version of the collection and the requested page of its entries."""
+    version, entries, index = collection.get_snapshot()
+
+    def get_list(name: str) -> List[str] | None:
+        if name not in params:
+            return None
+        return [v for value in params[name] for v in value.split(",") if v]
+
+    def get_int(name: str, default: int) -> int:
+        try:
+            return int(params[name][-1]) if name in params else default
+        except ValueError:
+            raise QueryError(f"{name} must be an integer")
+
+    if "question" in params and collection.name == "critiques":
+        raise QueryError("critiques have no questions")
+    positions = None
+    for field in filter_fields:
+        values = get_list(field)
+        if values is None:
+            continue
+        matched = set(i for v in values for i in index[field].get(v, []))
+        positions = matched if positions is None else positions & matched
+    ordered = sorted(positions) if positions is not None else range(len(entries))
+    if get_list("incomplete") == ["0"]:
+        ordered = [i for i in ordered if not entries[i].get("incomplete")]
+
+    offset = max(0, get_int("offset", 0))
+    limit = min(max(0, get_int("limit", default_limit)), max_limit)
+    questions = get_list("question")
+    reps = get_list("reps") != ["0"]
+    fields = get_list("fields")
+    items = [shape_entry(entries[i], questions=questions, reps=reps, fields=fields) for i in ordered[offset:offset + limit]]
+    return version, {"total": len(ordered), "offset": offset, "limit": limit, "items": items}
+
+
+def make_handler(collections: Dict[str, Collection]):
+    class Handler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            url = urlsplit(self.path)
+            name = url.path.strip("/")
+            params = parse_qs(url.query)
+            try:
+                if name == "":
+                    body_obj = {"collections": {
+                        n: {"count": len(c.get_snapshot()[1]), "file": c.path} for n, c in collections.items()
+                    }}
+                    self.send_json(200, body_obj)
+                    return
+                if name not in collections:
+                    self.send_json(404, {"error": f"Unknown collection {name}"})
+                    return
+                # the version of the file changes whenever its content does, so the ETag can be checked before the query runs
+                version = collections[name].get_snapshot()[0]
+                etag = f'W/"{version}-{hashlib.sha1(url.query.encode()).hexdigest()[:16]}"'
+                if etag in [t.strip() for t in self.headers.get("If-None-Match", "").split(",")]:
+                    self.send_response(304)
+                    self.send_header("ETag", etag)
+                    self.end_headers()
+                    return
+                version2, body_obj = query_collection(collections[name], params)
+                if version2 != version:
+                    # the file changed in between
+                    etag = f'W/"{version2}-{hashlib.sha1(url.query.encode()).hexdigest()[:16]}"'
+                self.send_json(200, body_obj, etag=etag)
+            except QueryError as e:
+                self.send_json(400, {"error": str(e)})
+
+        def send_json(self, status: int, body_obj: Any, *, etag: str | None = None):
+            body = json.dumps(body_obj).encode()
+            self.send_response(status)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Vary", "Accept-Encoding")
+            if etag is not None:
+                self.send_header("ETag", etag)
+            if len(body) >= min_gzip_bytes and "gzip" in self.headers.get("Accept-Encoding", ""):
+                body = gzip.compress(body, compresslevel=5)
+                self.send_header("Content-Encoding", "gzip")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+    return Handler
+
+
+@click.command()
+@click.option("--host", default="127.0.0.1", help="Address to listen on")
+@click.option("--port", type=int, default=8765, help="Port to listen on")
+@click.option("--ratings", default="ratings.json", help="Notebook ratings file")
+@click.option("--plot-ratings", default="plot_ratings.json", help="Plot ratings file")
+@click.option("--critiques", default="notebook_critiques.json", help="Notebook critiques file")
+def main(host, port, ratings, plot_ratings, critiques):
+    """Serve ratings, plot ratings and critiques through a local read-only HTTP API."""
+    collections = {
+        "ratings": Collection("ratings", ratings),
+        "plot_ratings": Collection("plot_ratings", plot_ratings),
+        "critiques": Collection("critiques", critiques),
+    }
+    # build the indexes up front, so that the first requests are as fast as the rest
+    for collection in collections.values():
+        collection.get_snapshot()
+    server = ThreadingHTTPServer((host, port), make_handler(collections))
+    print(f"Serving on http://{host}:{port}/")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+
+
+if __name__ == "__main__":
+    main()
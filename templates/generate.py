@@ -1,10 +1,164 @@
 import os
+import sys
 import shutil
 import time
 import yaml
 import json
 import platform
+import subprocess
+from concurrent.futures import ThreadPoolExecutor
 from minicline import perform_task
+from tools_client import get_socket_path_for_dir, stop_server
+from kernel_pool import get_cell_profile, profile_notebook
+
+def start_tools_server(working_dir: str) -> subprocess.Popen:
+    """Start a tools server for the working directory and point tools_cli.py calls at it."""
+    socket_path = get_socket_path_for_dir(working_dir)
+    os.environ['DANDI_TOOLS_SOCKET'] = socket_path
+    if os.path.exists(socket_path):
+        os.remove(socket_path)
+    proc = subprocess.Popen(['python', 'tools_cli.py', 'serve', '--socket', socket_path], cwd=working_dir)
+    timer = time.time()
+    while not os.path.exists(socket_path):
+        if proc.poll() is not None or time.time() - timer > 30:
+            raise Exception("Failed to start the tools server")
+        time.sleep(0.1)
+    return proc
+
+# patches remfile when it is first imported, so processes that don't read remote files don't load it
+range_cache_sitecustomize = """import os
+if os.environ.get("DANDI_RANGE_CACHE") == "1":
+    import range_cache
+    range_cache.install_on_import()
+"""
+
+def enable_range_cache(working_dir: str):
+    """Make every Python process started by the agent read remfile URLs through range_cache."""
+    site_dir = os.path.abspath(os.path.join(working_dir, '.range_cache'))
+    os.makedirs(site_dir, exist_ok=True)
+    shutil.copy('range_cache.py', os.path.join(site_dir, 'range_cache.py'))
+    with open(os.path.join(site_dir, 'sitecustomize.py'), 'w') as f:
+        f.write(range_cache_sitecustomize)
+    os.environ['DANDI_RANGE_CACHE'] = '1'
+    os.environ['PYTHONPATH'] = os.pathsep.join([site_dir] + [p for p in [os.environ.get('PYTHONPATH')] if p])
+
+class TimestampedOutput:
+    """Pass output through to a stream and also record each line, with the time it was written, as JSON lines."""
+    def __init__(self, stream, fname: str):
+        self.stream = stream
+        self.f = open(fname, 'w')
+        self.partial_line = ''
+
+    def write(self, text: str):
+        self.stream.write(text)
+        lines = (self.partial_line + text).split('\n')
+        self.partial_line = lines.pop()
+        t = time.time()
+        for line in lines:
+            self.f.write(json.dumps({'t': t, 'line': line}) + '\n')
+        self.f.flush()
+
+    def flush(self):
+        self.stream.flush()
+
+    def close(self):
+        if self.partial_line:
+            self.f.write(json.dumps({'t': time.time(), 'line': self.partial_line}) + '\n')
+        self.f.close()
+
+    def __getattr__(self, name):
+        return getattr(self.stream, name)
+
+def prefetch_tool_results(dandiset_id: str) -> list:
+    """Run the tools that the agent starts with (dandiset-info, dandiset-assets, nwb-file-info on the first NWB file).
+
+    Returns a list of (command, file name, output) with the output formatted
+    as tools_cli.py prints it. A tool that fails is left out, so the agent
+    runs it itself.
+    """
+    # imported here so that the NWB dependencies are only loaded when prefetching
+    from tools import dandiset_info, dandiset_assets, nwb_file_info
+
+    def run(command: str, fname: str, func, **kwargs):
+        try:
+            result = func(**kwargs)
+        except Exception as e:
+            print(f'Failed to prefetch {command}: {e}')
+            return None
+        return (command, fname, result if isinstance(result, str) else json.dumps(result, indent=2))
+
+    with ThreadPoolExecutor(max_workers=2) as executor:
+        info_future = executor.submit(
+            run, f'python tools_cli.py dandiset-info {dandiset_id}', 'dandiset_info.json',
+            dandiset_info, dandiset_id=dandiset_id
+        )
+        assets = run(
+            f'python tools_cli.py dandiset-assets {dandiset_id}', 'dandiset_assets.json',
+            dandiset_assets, dandiset_id=dandiset_id
+        )
+        # the NWB file info depends on the asset listing, but can overlap with the dandiset info
+        nwb_info = None
+        nwb_assets = [a for a in json.loads(assets[2])['results'] if a['path'].endswith('.nwb')] if assets else []
+        if nwb_assets:
+            nwb_file_url = f"https://api.dandiarchive.org/api/assets/{nwb_assets[0]['asset_id']}/download/"
+            nwb_info = run(
+                f'python tools_cli.py nwb-file-info {dandiset_id} {nwb_file_url}', 'nwb_file_info.txt',
+                nwb_file_info, dandiset_id=dandiset_id, nwb_file_url=nwb_file_url
+            )
+        info = info_future.result()
+    return [r for r in [info, assets, nwb_info] if r is not None]
+
+def format_prefetched_context(results: list, *, mode: str) -> str:
+    """Describe the prefetched tool results for the prompt, either inline ('prompt') or as files in the working directory ('files')."""
+    if not results:
+        return ''
+    if mode == 'files':
+        lines = [
+            '## Pre-fetched tool results',
+            '',
+            'The output of the following commands has already been saved in the working directory. Read these files instead of running the commands again.',
+            '',
+        ]
+        for command, fname, _ in results:
+            lines.append(f'- `{fname}`: output of `{command}`')
+        return '\n'.join(lines) + '\n'
+    lines = [
+        '## Pre-fetched tool results',
+        '',
+        'The following commands have already been run for you, so you do not need to run them again.',
+    ]
+    for command, _, output in results:
+        lines += ['', f'### `{command}`', '', '```', output, '```']
+    return '\n'.join(lines) + '\n'
+
+def get_notebook_cell_profile(notebook_path: str, *, reexecute: bool) -> dict:
+    """Per-cell timing of the final notebook, optionally re-executing it to also measure peak memory."""
+    if not os.path.exists(notebook_path):
+        return {'cells': []}
+    try:
+        if reexecute:
+            return profile_notebook(notebook_path)
+        return {'cells': get_cell_profile(notebook_path)}
+    except Exception as e:
+        # profiling is diagnostic only and must never fail the generation
+        print(f'Failed to profile notebook cells: {e}')
+        return {'cells': [], 'error': str(e)}
+
+def summarize_cell_profile(cell_profile: dict) -> dict:
+    """The totals of a cell profile, for metadata.json (the cells are in cell_profile.json)."""
+    cells = cell_profile.get('cells', [])
+    elapsed = [c['elapsed_seconds'] for c in cells if c.get('elapsed_seconds') is not None]
+    peaks = [c['peak_memory_mb'] for c in cells if c.get('peak_memory_mb') is not None]
+    summary = {
+        'num_cells': len(cells),
+        'total_cell_seconds': sum(elapsed) if elapsed else None,
+        'max_cell_seconds': max(elapsed) if elapsed else None,
+        'max_peak_memory_mb': max(peaks) if peaks else None,
+    }
+    for key in ['notebook_execution_seconds', 'error']:
+        if key in cell_profile:
+            summary[key] = cell_profile[key]
+    return summary
 
 def generate():
     working_dir = 'working'
@@ -17,6 +171,8 @@ def generate():
     os.makedirs(working_dir, exist_ok=True)
     shutil.copy('tools.py', working_dir + '/tools.py')
     shutil.copy('tools_cli.py', working_dir + '/tools_cli.py')
+    shutil.copy('tools_client.py', working_dir + '/tools_client.py')
+    shutil.copy('kernel_pool.py', working_dir + '/kernel_pool.py')
 
     # Read config.yaml
     with open('config.yaml', 'r') as f:
@@ -31,18 +187,77 @@ def generate():
         prompt = f.read()
     prompt = prompt.replace('{{ DANDISET_ID }}', dandiset_id)
 
+    # optionally read remote NWB files through the shared block cache, in the tools and in the executed notebooks
+    if config.get('range_cache', False):
+        enable_range_cache(working_dir)
+
+    # optionally run the agent's first tool calls up front, saving them to the working directory or adding them to the prompt
+    prefetch_mode = config.get('prefetch', None)
+    prefetch_metadata = None
+    if prefetch_mode:
+        if prefetch_mode not in ['files', 'prompt']:
+            raise Exception(f"Invalid prefetch mode: {prefetch_mode}. Must be 'files' or 'prompt'.")
+        prefetch_timer = time.time()
+        prefetched = prefetch_tool_results(dandiset_id)
+        if prefetch_mode == 'files':
+            for _, fname, output in prefetched:
+                with open(os.path.join(working_dir, fname), 'w') as f:
+                    f.write(output)
+        context = format_prefetched_context(prefetched, mode=prefetch_mode)
+        if '{{ PREFETCHED_CONTEXT }}' in prompt:
+            prompt = prompt.replace('{{ PREFETCHED_CONTEXT }}', context)
+        else:
+            prompt = prompt + '\n\n' + context
+        prefetch_metadata = {
+            'mode': prefetch_mode,
+            'commands': [command for command, _, _ in prefetched],
+            'elapsed_time_seconds': time.time() - prefetch_timer,
+        }
+    elif '{{ PREFETCHED_CONTEXT }}' in prompt:
+        prompt = prompt.replace('{{ PREFETCHED_CONTEXT }}', '')
+
+    # optionally keep a tools server running so that the agent's tools_cli.py calls skip start-up imports
+    tools_server = start_tools_server(working_dir) if config.get('tools_server', False) else None
+
+    # minicline.log has no timestamps, so record when each line of it is printed for trace_generation.py
+    # (outside of the working directory, which the agent sees)
+    timestamped_output = TimestampedOutput(sys.stdout, 'minicline.timestamps.jsonl')
+    sys.stdout = timestamped_output
+
     timer = time.time()
-    r = perform_task(
-        instructions=prompt,
-        cwd=working_dir,
-        model=model,
-        vision_model=None,
-        log_file=working_dir + '/minicline.log',
-        auto=True,
-        approve_all_commands=True
-    )
+    try:
+        r = perform_task(
+            instructions=prompt,
+            cwd=working_dir,
+            model=model,
+            vision_model=None,
+            log_file=working_dir + '/minicline.log',
+            auto=True,
+            approve_all_commands=True
+        )
+    finally:
+        sys.stdout = timestamped_output.stream
+        timestamped_output.close()
+        # stop the tools server, which is also the one tools_cli.py execute starts in the background
+        # if it was not started here, so that it shuts down its kernels
+        stop_server(get_socket_path_for_dir(working_dir))
+        if tools_server is not None:
+            try:
+                tools_server.wait(timeout=30)
+            except subprocess.TimeoutExpired:
+                tools_server.terminate()
+                tools_server.wait()
     elapsed_sec = time.time() - timer
 
+    # timing of each cell from the agent's last execution, or a profiling run with peak memory if configured.
+    # It goes to its own file, since metadata.json is copied into every rating of the notebook.
+    cell_profile = get_notebook_cell_profile(
+        os.path.join(working_dir, 'notebook.ipynb'),
+        reexecute=config.get('profile_cells', False)
+    )
+    with open('cell_profile.json', 'w') as f:
+        json.dump(cell_profile, f, indent=2)
+
     metadata = {
         'dandiset_id': dandiset_id,
         'model': model,
@@ -52,6 +267,8 @@ def generate():
         'total_vision_prompt_tokens': r.total_vision_prompt_tokens,
         'total_vision_completion_tokens': r.total_vision_completion_tokens,
         'elapsed_time_seconds': elapsed_sec,
+        'cell_profile_summary': summarize_cell_profile(cell_profile),
+        'prefetch': prefetch_metadata,
         'timestamp': time.strftime('%Y-%m-%d %H:%M:%S'),
         "system_info": {
             "platform": platform.platform(),
@@ -0,0 +1,378 @@
+"""Pre-warmed Jupyter kernel pool for the notebook execute/fix loop.
+
+Kernels are started ahead of time with the heavy modules (pynwb, matplotlib,
+...) already imported, so executing a notebook doesn't pay for a cold kernel
+start. When the same notebook is executed again, the kernel that ran it is
+reused: leading cells whose source is unchanged keep their previous outputs
+and only the cells from the first changed one onwards are executed.
+
+Used by `python tools_cli.py execute`. The pool lives as long as the process,
+so execute runs on a tools server (python tools_cli.py serve), starting one in
+the background if none is running, which keeps kernels warm between calls.
+"""
+
+import atexit
+import datetime
+import hashlib
+import os
+import re
+import threading
+import time
+from collections import deque
+from dataclasses import dataclass, field
+from typing import Any, Deque, Dict, List, Optional, Tuple
+
+# Modules imported into fresh kernels. They are imported inside a function so
+# that the notebook's namespace stays clean and a missing import in the
+# notebook still fails as it would in a cold kernel.
+WARMUP_MODULES = ["numpy", "matplotlib.pyplot", "pandas", "h5py", "remfile", "pynwb"]
+WARMUP_CODE = f"""
+def __warmup():
+    import importlib
+    for m in {WARMUP_MODULES!r}:
+        try:
+            importlib.import_module(m)
+        except Exception:
+            pass
+__warmup()
+del __warmup
+"""
+
+
+# Reset the kernel's peak resident memory (Linux only) without adding names to the notebook's namespace
+RESET_PEAK_MEMORY_CODE = """exec("try:\\n    with open('/proc/self/clear_refs', 'w') as f:\\n        f.write('5')\\nexcept OSError:\\n    pass", {})"""
+# Peak resident memory of the kernel in kB: VmHWM since the last reset on Linux, otherwise the peak since start
+PEAK_MEMORY_EXPRESSION = (
+    "[int(line.split()[1]) for line in open('/proc/self/status') if line.startswith('VmHWM:')][0]"
+    " if __import__('os').path.exists('/proc/self/status')"
+    " else __import__('resource').getrusage(__import__('resource').RUSAGE_SELF).ru_maxrss"
+    " // (1024 if __import__('sys').platform == 'darwin' else 1)"
+)
+URL_PATTERN = re.compile(r"https?://[^\s'\"]+")
+
+
+def _now() -> str:
+    return datetime.datetime.now(datetime.timezone.utc).isoformat().replace("+00:00", "Z")
+
+
+@dataclass
+class ExecutedCell:
+    prefix_hash: str
+    outputs: List[Any]
+    execution_count: Optional[int]
+    metadata: Dict[str, Any]
+    errored: bool
+
+
+@dataclass
+class NotebookSession:
+    """A kernel together with the code cells it has executed for a notebook."""
+    km: Any
+    kc: Any
+    executed: List[ExecutedCell] = field(default_factory=list)
+
+
+class KernelPool:
+    def __init__(self, size: int = 1, kernel_name: str = "python3"):
+        self.size = size
+        self.kernel_name = kernel_name
+        self._ready: Deque[Tuple[Any, Any]] = deque()
+        self._lock = threading.Lock()
+        self._sessions: Dict[str, NotebookSession] = {}
+        self._fill()
+        atexit.register(self.shutdown)
+
+    def _start_kernel(self) -> Tuple[Any, Any]:
+        from jupyter_client.manager import KernelManager
+
+        km = KernelManager(kernel_name=self.kernel_name)
+        km.start_kernel()
+        kc = km.client()
+        kc.start_channels()
+        kc.wait_for_ready(timeout=60)
+        kc.execute_interactive(WARMUP_CODE, silent=True, store_history=False, timeout=300)
+        return km, kc
+
+    def _fill(self):
+        def fill():
+            while True:
+                with self._lock:
+                    if len(self._ready) >= self.size:
+                        return
+                kernel = self._start_kernel()
+                with self._lock:
+                    self._ready.append(kernel)
+
+        threading.Thread(target=fill, daemon=True).start()
+
+    def _acquire(self) -> Tuple[Any, Any]:
+        with self._lock:
+            kernel = self._ready.popleft() if self._ready else None
+        if kernel is None:
+            kernel = self._start_kernel()
+        self._fill()
+        return kernel
+
+    @staticmethod
+    def _shutdown_kernel(km, kc):
+        kc.stop_channels()
+        km.shutdown_kernel(now=True)
+
+    def session_for(self, notebook_path: str, prefix_hashes: List[str], *, reuse: bool) -> Tuple[NotebookSession, int]:
+        """Get a kernel session for the notebook and the number of leading code cells that can be reused."""
+        key = os.path.abspath(notebook_path)
+        session = self._sessions.get(key)
+        if session is not None:
+            num_matching = 0
+            for executed, h in zip(session.executed, prefix_hashes):
+                # a cell that failed is never reused, so that it runs again (and reports its error) even if unchanged
+                if executed.prefix_hash != h or executed.errored:
+                    break
+                num_matching += 1
+            num_executed = len(session.executed)
+            # The kernel state is only valid if every cell it executed is unchanged, except
+            # that the last cell may be the one that failed, which runs again.
+            if reuse and (
+                num_matching == num_executed
+                or (num_matching == num_executed - 1 and session.executed[-1].errored)
+            ):
+                del session.executed[num_matching:]
+                return session, num_matching
+            self._shutdown_kernel(session.km, session.kc)
+        km, kc = self._acquire()
+        session = NotebookSession(km=km, kc=kc)
+        self._sessions[key] = session
+        # run in the notebook's directory, without adding names to the notebook's namespace
+        kc.execute_interactive(
+            f"__import__('os').chdir({os.path.dirname(key)!r})", silent=True, store_history=False
+        )
+        return session, 0
+
+    def shutdown(self):
+        with self._lock:
+            kernels = list(self._ready)
+            self._ready.clear()
+        kernels += [(s.km, s.kc) for s in self._sessions.values()]
+        self._sessions.clear()
+        for km, kc in kernels:
+            try:
+                self._shutdown_kernel(km, kc)
+            except Exception:
+                pass
+
+
+_pool: Optional[KernelPool] = None
+
+
+def get_pool() -> KernelPool:
+    global _pool
+    if _pool is None:
+        _pool = KernelPool(size=int(os.environ.get("DANDI_KERNEL_POOL_SIZE", 1)))
+    return _pool
+
+
+def _get_peak_memory_mb(kc) -> Optional[float]:
+    import ast
+
+    reply = kc.execute_interactive(
+        "", silent=True, store_history=False, user_expressions={"peak": PEAK_MEMORY_EXPRESSION}, timeout=30
+    )
+    result = reply["content"].get("user_expressions", {}).get("peak", {})
+    if result.get("status") != "ok":
+        return None
+    return ast.literal_eval(result["data"]["text/plain"]) / 1024
+
+
+def _execute_cell(
+    kc, km, source: str, timeout: float, *, profile: bool = False
+) -> Tuple[List[Any], Optional[int], Dict[str, Any], bool]:
+    """Execute a cell and return (outputs, execution_count, cell metadata, errored).
+
+    The metadata has nbclient-style execution timestamps and, with profile,
+    the elapsed time and the kernel's peak memory during the cell.
+    """
+    import queue
+    import nbformat
+
+    if profile:
+        kc.execute_interactive(RESET_PEAK_MEMORY_CODE, silent=True, store_history=False, timeout=30)
+    timing = {"iopub.execute_input": _now()}
+    timer = time.monotonic()
+    deadline = time.monotonic() + timeout
+    msg_id = kc.execute(source, store_history=True)
+    outputs: List[Any] = []
+    execution_count = None
+    errored = False
+    while True:
+        try:
+            msg = kc.get_iopub_msg(timeout=max(0, deadline - time.monotonic()))
+        except queue.Empty:
+            km.interrupt_kernel()
+            outputs.append(nbformat.v4.new_output(
+                "error", ename="TimeoutError", evalue=f"Cell execution timed out after {timeout} seconds", traceback=[]
+            ))
+            errored = True
+            break
+        if msg["parent_header"].get("msg_id") != msg_id:
+            continue
+        msg_type = msg["msg_type"]
+        content = msg["content"]
+        if msg_type == "status" and content["execution_state"] == "idle":
+            break
+        if msg_type == "execute_input":
+            execution_count = content.get("execution_count")
+        elif msg_type == "clear_output":
+            outputs = []
+        elif msg_type in ["stream", "display_data", "execute_result", "error"]:
+            output = nbformat.v4.output_from_msg(msg)
+            if (
+                msg_type == "stream"
+                and outputs
+                and outputs[-1]["output_type"] == "stream"
+                and outputs[-1]["name"] == output["name"]
+            ):
+                # merge consecutive stream outputs the way nbclient does
+                outputs[-1]["text"] += output["text"]
+            else:
+                outputs.append(output)
+            if msg_type == "error":
+                errored = True
+    timing["shell.execute_reply"] = _now()
+    metadata: Dict[str, Any] = {"execution": timing}
+    if profile:
+        metadata["profile"] = {
+            "elapsed_seconds": time.monotonic() - timer,
+            "peak_memory_mb": _get_peak_memory_mb(kc),
+        }
+    return outputs, execution_count, metadata, errored
+
+
+def execute_notebook(
+    notebook_path: str,
+    *,
+    timeout: float = 600,
+    reuse: bool = True,
+    pool: Optional[KernelPool] = None,
+    profile: bool = False,
+) -> Dict[str, Any]:
+    """Execute a notebook in place using a warm kernel, stopping at the first error.
+
+    Returns a summary with the number of executed and reused cells and, if a
+    cell failed, its index and error. With profile, each executed cell's
+    metadata also gets its elapsed time and peak memory.
+    """
+    import nbformat
+
+    nb = nbformat.read(notebook_path, as_version=4)
+    code_cells = [(i, c) for i, c in enumerate(nb.cells) if c.cell_type == "code"]
+    prefix_hashes = []
+    h = hashlib.sha256()
+    for _, cell in code_cells:
+        h.update(cell.source.encode())
+        h.update(b"\0")
+        prefix_hashes.append(h.copy().hexdigest())
+
+    if pool is None:
+        pool = get_pool()
+    session, num_reused = pool.session_for(notebook_path, prefix_hashes, reuse=reuse)
+
+    summary: Dict[str, Any] = {"num_cells": len(code_cells), "num_reused": num_reused, "num_executed": 0}
+    for i, (cell_index, cell) in enumerate(code_cells):
+        if i < num_reused:
+            executed = session.executed[i]
+            cell.outputs = executed.outputs
+            cell.execution_count = executed.execution_count
+            cell.metadata.update(executed.metadata)
+            continue
+        if "error" in summary:
+            # like jupyter execute, cells after a failure are left unexecuted
+            cell.outputs = []
+            cell.execution_count = None
+            continue
+        outputs, execution_count, metadata, errored = _execute_cell(
+            session.kc, session.km, cell.source, timeout, profile=profile
+        )
+        cell.outputs = outputs
+        cell.execution_count = execution_count
+        cell.metadata.update(metadata)
+        session.executed.append(ExecutedCell(
+            prefix_hash=prefix_hashes[i],
+            outputs=outputs,
+            execution_count=execution_count,
+            metadata=metadata,
+            errored=errored,
+        ))
+        summary["num_executed"] += 1
+        if errored:
+            error = next((o for o in outputs if o["output_type"] == "error"), None)
+            summary["error"] = {
+                "cell_index": cell_index,
+                "ename": error["ename"] if error else "Error",
+                "evalue": error["evalue"] if error else "",
+                "traceback": error.get("traceback", []) if error else [],
+            }
+
+    nbformat.write(nb, notebook_path)
+    return summary
+
+
+def _parse_timestamp(timestamp: str) -> datetime.datetime:
+    return datetime.datetime.fromisoformat(timestamp.replace("Z", "+00:00"))
+
+
+def get_cell_profile(notebook_path: str) -> List[Dict[str, Any]]:
+    """Get the per-cell timing (and peak memory, if profiled) recorded in an executed notebook.
+
+    Works with notebooks executed by jupyter execute (timing only) and by
+    execute_notebook. Also lists the remote URLs (e.g. NWB files) each cell
+    refers to, so that time can be attributed to datasets.
+    """
+    import nbformat
+
+    nb = nbformat.read(notebook_path, as_version=4)
+    cells = []
+    for cell_index, cell in enumerate(nb.cells):
+        if cell.cell_type != "code":
+            continue
+        entry: Dict[str, Any] = {
+            "cell_index": cell_index,
+            "elapsed_seconds": None,
+            "peak_memory_mb": None,
+            "urls": URL_PATTERN.findall(cell.source),
+        }
+        execution = cell.metadata.get("execution", {})
+        if "iopub.execute_input" in execution and "shell.execute_reply" in execution:
+            entry["elapsed_seconds"] = (
+                _parse_timestamp(execution["shell.execute_reply"])
+                - _parse_timestamp(execution["iopub.execute_input"])
+            ).total_seconds()
+        if "profile" in cell.metadata:
+            entry.update(cell.metadata["profile"])
+        cells.append(entry)
+    return cells
+
+
+def profile_notebook(notebook_path: str, *, timeout: float = 600) -> Dict[str, Any]:
+    """Execute a copy of the notebook in a fresh kernel, recording each cell's elapsed time and peak memory."""
+    import shutil
+
+    profile_path = notebook_path[:-len(".ipynb")] + ".profile.ipynb"
+    shutil.copy(notebook_path, profile_path)
+    pool = KernelPool(size=0)
+    try:
+        timer = time.monotonic()
+        summary = execute_notebook(profile_path, timeout=timeout, reuse=False, pool=pool, profile=True)
+        elapsed = time.monotonic() - timer
+        cells = get_cell_profile(profile_path)
+    finally:
+        pool.shutdown()
+        # the copy is only needed for the profile, and must not be left next to the real outputs
+        if os.path.exists(profile_path):
+            os.remove(profile_path)
+    result: Dict[str, Any] = {
+        "notebook_execution_seconds": elapsed,
+        "cells": cells,
+    }
+    if "error" in summary:
+        result["error"] = {k: summary["error"][k] for k in ["cell_index", "ename", "evalue"]}
+    return result
@@ -0,0 +1,342 @@
+"""Local block cache for HTTP byte-range reads of remote files.
+
+Remote NWB files are read in fixed-size blocks that are stored on disk and
+shared by all processes (tools, executed notebooks, parallel generation runs),
+so repeated opens of the same asset become local reads.
+
+    from range_cache import open_url
+    h5_file = h5py.File(open_url(url), "r")
+
+install() makes remfile.File(url) return a cached file, which is how the
+nwb-file-info usage scripts and the generated notebooks open remote files.
+install_on_import() does the same once remfile is first imported, so that it
+can be called at the start-up of every process (see generate.py) without
+loading remfile or requests in processes that don't read remote files.
+The cache directory, block size and size bound are set with
+DANDI_RANGE_CACHE_DIR, DANDI_RANGE_CACHE_BLOCK_SIZE and
+DANDI_RANGE_CACHE_MAX_GB. Least recently used blocks are evicted once the
+cache grows beyond its size bound.
+"""
+
+import fcntl
+import hashlib
+import importlib.abc
+import importlib.util
+import io
+import json
+import os
+import sys
+import tempfile
+import threading
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+DEFAULT_CACHE_DIR = os.environ.get(
+    "DANDI_RANGE_CACHE_DIR",
+    os.path.join(os.path.expanduser("~"), ".cache", "dandi-ai-notebooks", "range_cache"),
+)
+DEFAULT_BLOCK_SIZE = int(os.environ.get("DANDI_RANGE_CACHE_BLOCK_SIZE", 1024 * 1024))
+DEFAULT_MAX_BYTES = int(float(os.environ.get("DANDI_RANGE_CACHE_MAX_GB", 10)) * 1024 ** 3)
+
+
+def _write_atomic(path: str, data: bytes):
+    # write to a temporary file and rename, so concurrent readers never see a partial block
+    fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path), suffix=".tmp")
+    try:
+        with os.fdopen(fd, "wb") as f:
+            f.write(data)
+        os.replace(tmp_path, path)
+    except BaseException:
+        os.unlink(tmp_path)
+        raise
+
+
+class BlockCache:
+    """Size-bounded on-disk cache of file blocks, keyed by URL and block index."""
+
+    def __init__(
+        self,
+        cache_dir: Optional[str] = None,
+        *,
+        block_size: int = DEFAULT_BLOCK_SIZE,
+        max_bytes: int = DEFAULT_MAX_BYTES,
+    ):
+        self.cache_dir = cache_dir or DEFAULT_CACHE_DIR
+        self.block_size = block_size
+        self.max_bytes = max_bytes
+        os.makedirs(self.cache_dir, exist_ok=True)
+        self._lock = threading.Lock()
+        # bytes written by this process since the last eviction check
+        self._bytes_since_check = 0
+
+    def _file_dir(self, url: str) -> str:
+        h = hashlib.sha256(url.encode()).hexdigest()
+        return os.path.join(self.cache_dir, h[:2], h)
+
+    def _block_path(self, url: str, block_index: int) -> str:
+        return os.path.join(self._file_dir(url), f"{self.block_size}_{block_index}")
+
+    def get_meta(self, url: str) -> Optional[Dict[str, Any]]:
+        try:
+            with open(os.path.join(self._file_dir(url), "meta.json"), "r") as f:
+                return json.load(f)
+        except (FileNotFoundError, json.JSONDecodeError):
+            return None
+
+    def set_meta(self, url: str, meta: Dict[str, Any]):
+        os.makedirs(self._file_dir(url), exist_ok=True)
+        _write_atomic(os.path.join(self._file_dir(url), "meta.json"), json.dumps(meta).encode())
+
+    def get_block(self, url: str, block_index: int) -> Optional[bytes]:
+        path = self._block_path(url, block_index)
+        try:
+            with open(path, "rb") as f:
+                data = f.read()
+        except FileNotFoundError:
+            return None
+        try:
+            # the modification time records the last use for LRU eviction
+            os.utime(path)
+        except FileNotFoundError:
+            # evicted by another process after we read it
+            pass
+        return data
+
+    def put_block(self, url: str, block_index: int, data: bytes):
+        os.makedirs(self._file_dir(url), exist_ok=True)
+        _write_atomic(self._block_path(url, block_index), data)
+        with self._lock:
+            self._bytes_since_check += len(data)
+            # scanning the cache is relatively expensive, so only check occasionally
+            check = self._bytes_since_check > self.max_bytes / 20
+            if check:
+                self._bytes_since_check = 0
+        if check:
+            self.evict()
+
+    def evict(self):
+        """Delete the least recently used blocks until the cache is below 90% of its size bound."""
+        with open(os.path.join(self.cache_dir, ".evict.lock"), "w") as lock_f:
+            fcntl.flock(lock_f, fcntl.LOCK_EX)
+            blocks: List[Tuple[float, int, str]] = []
+            total = 0
+            for dirpath, _, filenames in os.walk(self.cache_dir):
+                for fname in filenames:
+                    if fname == "meta.json" or fname.startswith(".") or fname.endswith(".tmp"):
+                        continue
+                    path = os.path.join(dirpath, fname)
+                    try:
+                        st = os.stat(path)
+                    except FileNotFoundError:
+                        continue
+                    blocks.append((st.st_mtime, st.st_size, path))
+                    total += st.st_size
+            if total <= self.max_bytes:
+                return
+            blocks.sort()
+            target = self.max_bytes * 0.9
+            for _, size, path in blocks:
+                if total <= target:
+                    break
+                try:
+                    # processes that already opened the block can still read it
+                    os.remove(path)
+                except FileNotFoundError:
+                    pass
+                total -= size
+
+
+_default_cache: Optional[BlockCache] = None
+
+
+def get_default_cache() -> BlockCache:
+    global _default_cache
+    if _default_cache is None:
+        _default_cache = BlockCache()
+    return _default_cache
+
+
+class CachedHTTPFile(io.RawIOBase):
+    """Read-only, seekable file object for a remote URL, backed by a BlockCache."""
+
+    def __init__(self, url: str, *, cache: Optional[BlockCache] = None):
+        # imported here so that installing the import hook doesn't load requests
+        import requests
+
+        super().__init__()
+        self.url = url
+        self.cache = cache or get_default_cache()
+        self._session = requests.Session()
+        self._pos = 0
+        meta = self.cache.get_meta(url)
+        if meta is None:
+            meta = {"size": self._fetch_size()}
+            self.cache.set_meta(url, meta)
+        self.size: int = meta["size"]
+
+    def _fetch_size(self) -> int:
+        response = self._session.head(self.url, allow_redirects=True)
+        if response.status_code != 200 or "Content-Length" not in response.headers:
+            raise RuntimeError(f"Failed to get the size of {self.url}: {response.status_code}")
+        return int(response.headers["Content-Length"])
+
+    def _fetch_block(self, block_index: int) -> bytes:
+        start = block_index * self.cache.block_size
+        end = min(start + self.cache.block_size, self.size) - 1
+        response = self._session.get(self.url, headers={"Range": f"bytes={start}-{end}"})
+        if response.status_code == 206:
+            data = response.content
+        elif response.status_code == 200:
+            # the server ignored the range header and sent the whole file
+            data = response.content[start:end + 1]
+        else:
+            raise RuntimeError(f"Failed to read bytes {start}-{end} of {self.url}: {response.status_code}")
+        if len(data) != end - start + 1:
+            raise RuntimeError(f"Expected {end - start + 1} bytes from {self.url} but got {len(data)}")
+        return data
+
+    def _get_block(self, block_index: int) -> bytes:
+        data = self.cache.get_block(self.url, block_index)
+        if data is None:
+            data = self._fetch_block(block_index)
+            self.cache.put_block(self.url, block_index, data)
+        return data
+
+    def readable(self) -> bool:
+        return True
+
+    def seekable(self) -> bool:
+        return True
+
+    def tell(self) -> int:
+        return self._pos
+
+    def seek(self, offset: int, whence: int = io.SEEK_SET) -> int:
+        if whence == io.SEEK_SET:
+            self._pos = offset
+        elif whence == io.SEEK_CUR:
+            self._pos += offset
+        elif whence == io.SEEK_END:
+            self._pos = self.size + offset
+        else:
+            raise ValueError(f"Invalid whence: {whence}")
+        return self._pos
+
+    def readinto(self, b) -> int:
+        view = memoryview(b).cast("B")
+        n = max(0, min(len(view), self.size - self._pos))
+        block_size = self.cache.block_size
+        written = 0
+        while written < n:
+            pos = self._pos + written
+            block = self._get_block(pos // block_size)
+            offset = pos % block_size
+            chunk = block[offset:offset + n - written]
+            view[written:written + len(chunk)] = chunk
+            written += len(chunk)
+        self._pos += n
+        return n
+
+    def close(self):
+        self._session.close()
+        super().close()
+
+
+def open_url(url: str, *, cache: Optional[BlockCache] = None) -> io.BufferedReader:
+    """Open a remote file for reading through the block cache."""
+    # buffer at the block size so that small sequential reads don't go through the cache one by one
+    block_size = (cache or get_default_cache()).block_size
+    return io.BufferedReader(CachedHTTPFile(url, cache=cache), buffer_size=block_size)
+
+
+def _make_cached_remfile_class(base: type) -> type:
+    class File(base):
+        """A remfile.File that reads through the block cache."""
+
+        _range_cache_installed = True
+
+        def __init__(self, url, *args, **kwargs):
+            # remfile.File also accepts a function that returns the URL
+            self.url = url() if callable(url) else url
+            self._file = open_url(self.url)
+            self.length = self._file.raw.size
+
+        def read(self, size: Optional[int] = None) -> bytes:
+            return self._file.read(-1 if size is None else size)
+
+        def readinto(self, b) -> int:
+            return self._file.readinto(b)
+
+        def seek(self, offset: int, whence: int = io.SEEK_SET) -> int:
+            return self._file.seek(offset, whence)
+
+        def tell(self) -> int:
+            return self._file.tell()
+
+        def close(self):
+            self._file.close()
+
+        def __enter__(self):
+            return self
+
+        def __exit__(self, *args):
+            self.close()
+
+    File.__module__ = base.__module__
+    return File
+
+
+def _patch_remfile(remfile):
+    # a subclass, so that isinstance checks against remfile.File and subclasses of it keep working
+    if not getattr(remfile.File, "_range_cache_installed", False):
+        remfile.File = _make_cached_remfile_class(remfile.File)
+
+
+def install():
+    """Make remfile.File(url) read through the block cache in this process."""
+    import remfile
+
+    _patch_remfile(remfile)
+
+
+class _PatchingLoader(importlib.abc.Loader):
+    """Loader that calls a function on the module after the original loader executed it."""
+
+    def __init__(self, loader, patch: Callable[[Any], None]):
+        self._loader = loader
+        self._patch = patch
+
+    def create_module(self, spec):
+        return self._loader.create_module(spec)
+
+    def exec_module(self, module):
+        self._loader.exec_module(module)
+        self._patch(module)
+
+    def __getattr__(self, name):
+        return getattr(self._loader, name)
+
+
+class _PatchOnImportFinder(importlib.abc.MetaPathFinder):
+    """Meta path finder that patches a module the first time it is imported."""
+
+    def __init__(self, name: str, patch: Callable[[Any], None]):
+        self.name = name
+        self.patch = patch
+
+    def find_spec(self, fullname, path, target=None):
+        if fullname != self.name:
+            return None
+        # only the first import needs patching, and removing the finder lets the other finders locate the module
+        sys.meta_path.remove(self)
+        spec = importlib.util.find_spec(fullname)
+        if spec is not None and spec.loader is not None:
+            spec.loader = _PatchingLoader(spec.loader, self.patch)
+        return spec
+
+
+def install_on_import():
+    """Like install(), but wait until remfile is imported instead of importing it now."""
+    if "remfile" in sys.modules:
+        _patch_remfile(sys.modules["remfile"])
+    elif not any(isinstance(f, _PatchOnImportFinder) and f.name == "remfile" for f in sys.meta_path):
+        sys.meta_path.insert(0, _PatchOnImportFinder("remfile", _patch_remfile))
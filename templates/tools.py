@@ -1,8 +1,190 @@
-from typing import Dict, Any, Optional
-import requests
+from typing import Dict, Any, Optional, Callable
+import fcntl
+import fnmatch
+import functools
+import hashlib
+import inspect
+import json
+import math
+import os
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
 
-# needs to be installed from source: https://github.com/rly/get-nwbfile-info
-from get_nwbfile_info import get_nwbfile_usage_script
+# requests and get_nwbfile_info (which pulls in pynwb, h5py and lindi) are
+# imported inside the tools that use them, so that commands which don't need
+# them start quickly and a long-lived tools server imports them only once
+
+# Results of the tools are cached on disk so that repeated calls and parallel
+# generation runs reuse them. The cache is shared between processes and can be
+# moved with DANDI_TOOLS_CACHE_DIR or disabled with DANDI_TOOLS_CACHE=0.
+CACHE_DIR = os.environ.get(
+    "DANDI_TOOLS_CACHE_DIR",
+    os.path.join(os.path.expanduser("~"), ".cache", "dandi-ai-notebooks", "tools"),
+)
+# Draft dandisets can change, so their results expire; published versions are immutable
+DRAFT_TTL_SECONDS = float(os.environ.get("DANDI_TOOLS_CACHE_TTL", 24 * 3600))
+NWB_FILE_INFO_TTL_SECONDS = 30 * 24 * 3600
+# Bump this when the format of cached results changes
+CACHE_FORMAT_VERSION = 1
+
+# Page size and concurrency for fetching the complete asset listing of a dandiset
+LISTING_PAGE_SIZE = 100
+LISTING_MAX_WORKERS = 8
+
+
+def _get_nwbfile_info_version() -> str:
+    from importlib.metadata import version, PackageNotFoundError
+
+    for name in ["get_nwbfile_info", "get-nwbfile-info"]:
+        try:
+            return version(name)
+        except PackageNotFoundError:
+            pass
+    return "unknown"
+
+
+def _read_cache_entry(path: str, max_age_seconds: Optional[float]) -> Optional[Dict[str, Any]]:
+    try:
+        with open(path, "r") as f:
+            entry = json.load(f)
+    except (FileNotFoundError, json.JSONDecodeError):
+        return None
+    if max_age_seconds is not None and time.time() - entry["created"] > max_age_seconds:
+        return None
+    return entry
+
+
+def _write_cache_entry(path: str, entry: Dict[str, Any]):
+    # write to a temporary file and rename, so readers never see a partial entry
+    fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path), suffix=".tmp")
+    try:
+        with os.fdopen(fd, "w") as f:
+            json.dump(entry, f)
+        os.replace(tmp_path, path)
+    except BaseException:
+        os.unlink(tmp_path)
+        raise
+
+
+def _disk_cached(
+    namespace: str,
+    *,
+    ttl: Callable[..., Optional[float]],
+    version: Callable[[], str] = lambda: "",
+):
+    """Cache the JSON-serializable results of a tool on disk.
+
+    ttl is called with the tool arguments and returns the maximum age of a
+    cached result in seconds, or None if it never expires. version returns a
+    string that is part of the cache key, so that results are recomputed when
+    the underlying implementation changes. While a result is being computed an
+    exclusive lock is held, so concurrent processes compute it only once.
+    """
+    def decorator(func):
+        signature = inspect.signature(func)
+
+        def _cache_path(args, kwargs):
+            bound = signature.bind(*args, **kwargs)
+            bound.apply_defaults()
+            params = dict(bound.arguments)
+            key_json = json.dumps(
+                [CACHE_FORMAT_VERSION, namespace, version(), params], sort_keys=True
+            )
+            key = hashlib.sha256(key_json.encode()).hexdigest()
+            return os.path.join(CACHE_DIR, namespace, key + ".json"), ttl(**params)
+
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            if os.environ.get("DANDI_TOOLS_CACHE", "1") == "0":
+                return func(*args, **kwargs)
+            path, max_age_seconds = _cache_path(args, kwargs)
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+
+            entry = _read_cache_entry(path, max_age_seconds)
+            if entry is not None:
+                return entry["result"]
+            with open(path + ".lock", "w") as lock_f:
+                fcntl.flock(lock_f, fcntl.LOCK_EX)
+                # another process may have computed it while we were waiting for the lock
+                entry = _read_cache_entry(path, max_age_seconds)
+                if entry is not None:
+                    return entry["result"]
+                result = func(*args, **kwargs)
+                _write_cache_entry(path, {"created": time.time(), "result": result})
+            return result
+
+        def is_cached(*args, **kwargs) -> bool:
+            """Whether a valid cached result exists for these arguments."""
+            if os.environ.get("DANDI_TOOLS_CACHE", "1") == "0":
+                return False
+            path, max_age_seconds = _cache_path(args, kwargs)
+            return _read_cache_entry(path, max_age_seconds) is not None
+
+        wrapper.is_cached = is_cached
+        return wrapper
+
+    return decorator
+
+
+def _version_ttl(version: str = "draft", **kwargs) -> Optional[float]:
+    return DRAFT_TTL_SECONDS if version == "draft" else None
+
+
+def _request_dandiset_assets(payload: Dict[str, Any]) -> Dict[str, Any]:
+    import requests
+
+    url = "https://neurosift-chat-agent-tools.vercel.app/api/dandiset_assets"
+    response = requests.post(url, json=payload)
+    if response.status_code != 200:
+        raise RuntimeError(f"Failed to fetch dandiset assets: {response.text}")
+    return response.json()
+
+@_disk_cached("dandiset_assets", ttl=_version_ttl)
+def _dandiset_assets_page(
+    dandiset_id: str,
+    version: str = "draft",
+    page: int = 1,
+    page_size: int = 20,
+    glob: Optional[str] = None,
+) -> Dict[str, Any]:
+    payload = {
+        "dandiset_id": dandiset_id,
+        "version": version,
+        "page": page,
+        "page_size": page_size,
+    }
+    if glob:
+        payload["glob"] = glob
+    return _request_dandiset_assets(payload)
+
+@_disk_cached("dandiset_assets_listing", ttl=_version_ttl)
+def _dandiset_assets_listing(dandiset_id: str, version: str = "draft") -> Dict[str, Any]:
+    """Get the complete list of assets, fetching the remaining pages concurrently once the first reveals the count."""
+    first = _request_dandiset_assets({
+        "dandiset_id": dandiset_id,
+        "version": version,
+        "page": 1,
+        "page_size": LISTING_PAGE_SIZE,
+    })
+    results = list(first["results"])
+    # the server may return fewer results per page than requested
+    page_size = len(results)
+    if page_size > 0 and first["count"] > page_size:
+        num_pages = math.ceil(first["count"] / page_size)
+        with ThreadPoolExecutor(max_workers=LISTING_MAX_WORKERS) as executor:
+            pages = executor.map(
+                lambda page: _request_dandiset_assets({
+                    "dandiset_id": dandiset_id,
+                    "version": version,
+                    "page": page,
+                    "page_size": page_size,
+                }),
+                range(2, num_pages + 1),
+            )
+            for p in pages:
+                results.extend(p["results"])
+    return {"count": len(results), "results": results}
 
 def dandiset_assets(
     dandiset_id: str,
@@ -10,6 +192,7 @@ def dandiset_assets(
     page: int = 1,
     page_size: int = 20,
     glob: Optional[str] = None,
+    all_pages: bool = False,
 ) -> Dict[str, Any]:
     """Get a list of assets/files in a dandiset version.
 
@@ -17,6 +200,10 @@ def dandiset_assets(
     - count: total number of assets
     - results: array of assets with asset_id, path, and size
 
+    With all_pages, the complete listing is fetched (remaining pages
+    concurrently) and cached, and all matching assets are returned. Once the
+    complete listing is cached, glob filtering and paging are done locally.
+
     Parameters
     ----------
     dandiset_id : str
@@ -29,27 +216,31 @@ def dandiset_assets(
         Number of results per page, by default 20
     glob : str, optional
         Optional glob pattern to filter files (e.g., '*.nwb' for NWB files)
+    all_pages : bool, optional
+        Return all matching assets instead of a single page, by default False
 
     Returns
     -------
     Dict[str, Any]
         Dictionary containing count and results
     """
-    url = "https://neurosift-chat-agent-tools.vercel.app/api/dandiset_assets"
-    payload = {
-        "dandiset_id": dandiset_id,
-        "version": version,
-        "page": page,
-        "page_size": page_size,
-    }
-    if glob:
-        payload["glob"] = glob
+    if not all_pages and not _dandiset_assets_listing.is_cached(dandiset_id, version):
+        return _dandiset_assets_page(dandiset_id, version, page, page_size, glob)
 
-    response = requests.post(url, json=payload)
-    if response.status_code != 200:
-        raise RuntimeError(f"Failed to fetch dandiset assets: {response.text}")
-    return response.json()
+    listing = _dandiset_assets_listing(dandiset_id, version)
+    results = listing["results"]
+    if glob:
+        results = [r for r in results if fnmatch.fnmatch(r["path"], glob)]
+    count = len(results)
+    if not all_pages:
+        results = results[(page - 1) * page_size:page * page_size]
+    return {"count": count, "results": results}
 
+@_disk_cached(
+    "nwb_file_info",
+    ttl=lambda **kwargs: NWB_FILE_INFO_TTL_SECONDS,
+    version=_get_nwbfile_info_version,
+)
 def nwb_file_info(dandiset_id: str, nwb_file_url: str) -> str:
     """Get information about an NWB file.
 
@@ -77,9 +268,13 @@ def nwb_file_info(dandiset_id: str, nwb_file_url: str) -> str:
     # return response.json()
 
     # new method:
+    # needs to be installed from source: https://github.com/rly/get-nwbfile-info
+    from get_nwbfile_info import get_nwbfile_usage_script
+
     script = get_nwbfile_usage_script(nwb_file_url)
     return script
 
+@_disk_cached("dandiset_info", ttl=_version_ttl)
 def dandiset_info(dandiset_id: str, version: str = "draft") -> Dict[str, Any]:
     """Get information about a specific version of a DANDI dataset.
 
@@ -102,6 +297,8 @@ def dandiset_info(dandiset_id: str, version: str = "draft") -> Dict[str, Any]:
     Dict[str, Any]
         Dictionary containing detailed dataset information
     """
+    import requests
+
     url = "https://neurosift-chat-agent-tools.vercel.app/api/dandiset_info"
     payload = {"dandiset_id": dandiset_id, "version": version}
     response = requests.post(url, json=payload)
@@ -166,6 +363,10 @@ where XXXXXX is the dandiset ID and XXXXX is the version.""",
                     "type": "string",
                     "description": "File pattern filter (optional)",
                 },
+                "all_pages": {
+                    "type": "boolean",
+                    "description": "Return all matching assets instead of a single page (optional)",
+                },
             },
             "required": ["dandiset_id"],
         },
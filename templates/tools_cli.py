@@ -1,6 +1,28 @@
+import sys
+
+if __name__ == "__main__":
+    # If a tools server is running, let it execute the command so that we
+    # don't pay for interpreter start-up imports on every invocation
+    from tools_client import forward_to_server
+
+    forward_to_server(sys.argv[1:])
+
+import contextlib
+import io
 import json
+import os
+import socketserver
+import sys
+import traceback
 import click
 from tools import dandiset_assets, nwb_file_info, dandiset_info
+from tools_client import get_socket_path, get_socket_path_for_dir, send_command, start_server, stop_server
+
+# whether this process is running the tools server
+serving = False
+
+# how long a kernel server started by the execute command stays up without requests
+kernel_server_idle_timeout = 1800
 
 @click.group(name="dandi-notebook-gen-tools")
 def cli():
@@ -13,8 +35,9 @@ def cli():
 @click.option("--page", type=int, default=1, help="Page number")
 @click.option("--page-size", type=int, default=20, help="Number of results per page")
 @click.option("--glob", default=None, help="Optional glob pattern to filter files (e.g., '*.nwb')")
+@click.option("--all-pages", is_flag=True, help="Return all matching assets instead of a single page")
 @click.option("--output", "-o", default=None, help="Output file path for the results (default: print to stdout)")
-def assets(dandiset_id, version, page, page_size, glob, output):
+def assets(dandiset_id, version, page, page_size, glob, all_pages, output):
     """
     Get a list of assets/files in a dandiset version.
 
@@ -26,7 +49,8 @@ def assets(dandiset_id, version, page, page_size, glob, output):
             version=version,
             page=page,
             page_size=page_size,
-            glob=glob
+            glob=glob,
+            all_pages=all_pages
         )
 
         if output:
@@ -98,6 +122,158 @@ def dataset_info(dandiset_id, version, output):
         click.echo(f"Error retrieving dandiset info: {str(e)}", err=True)
         raise click.Abort()
 
+def import_jupytext():
+    """Import jupytext without the notebook.py in the working directory shadowing the notebook package it may import."""
+    shadowing_dirs = {os.path.dirname(os.path.abspath(__file__)), os.getcwd()}
+    saved_path = sys.path[:]
+    sys.path[:] = [p for p in sys.path if os.path.abspath(p or ".") not in shadowing_dirs]
+    try:
+        import jupytext
+    finally:
+        sys.path[:] = saved_path
+    return jupytext
+
+@cli.command(name="execute")
+@click.argument("notebook_path", type=str)
+@click.option("--timeout", type=float, default=600, help="Timeout per cell in seconds")
+@click.option("--no-reuse", is_flag=True, help="Execute all cells in a fresh kernel instead of reusing unchanged leading cells")
+@click.option("--no-server", is_flag=True, help="Execute in this process with a cold kernel instead of in a background kernel server")
+def execute(notebook_path, timeout, no_reuse, no_server):
+    """
+    Execute a notebook in place using a pre-warmed kernel.
+
+    NOTEBOOK_PATH: A jupytext .py notebook (converted to .ipynb next to it first) or an .ipynb notebook.
+
+    The notebook is executed by a tools server, which keeps its kernels warm
+    between calls. If none is running, one is started in the background for
+    the current directory. When the same notebook is executed again, unchanged
+    leading cells keep their outputs and are not re-executed.
+    """
+    if not serving and not no_server:
+        # kernels only stay warm in a long-lived process, so run this on a server for this directory
+        argv = ["execute", notebook_path, "--timeout", str(timeout)] + (["--no-reuse"] if no_reuse else [])
+        socket_path = get_socket_path_for_dir(os.getcwd())
+        response = send_command(argv, socket_path)
+        if response is None and start_server(socket_path, idle_timeout=kernel_server_idle_timeout):
+            response = send_command(argv, socket_path)
+        if response is not None:
+            click.echo(response["stdout"], nl=False)
+            click.echo(response["stderr"], nl=False, err=True)
+            if response["exit_code"] != 0:
+                raise click.exceptions.Exit(response["exit_code"])
+            return
+        click.echo("Could not start a kernel server, executing with a cold kernel", err=True)
+
+    from kernel_pool import KernelPool, execute_notebook, get_pool
+
+    if notebook_path.endswith(".py"):
+        jupytext = import_jupytext()
+        ipynb_path = notebook_path[:-len(".py")] + ".ipynb"
+        jupytext.write(jupytext.read(notebook_path), ipynb_path, fmt="ipynb")
+        click.echo(f"Converted {notebook_path} to {ipynb_path}")
+        notebook_path = ipynb_path
+
+    # only the tools server lives long enough to benefit from keeping spare kernels warm
+    pool = get_pool() if serving else KernelPool(size=0)
+    summary = execute_notebook(notebook_path, timeout=timeout, reuse=not no_reuse, pool=pool)
+    click.echo(
+        f"Executed {summary['num_executed']} of {summary['num_cells']} code cells "
+        f"({summary['num_reused']} unchanged cells reused)"
+    )
+    if "error" in summary:
+        error = summary["error"]
+        click.echo(f"Error in cell {error['cell_index']}: {error['ename']}: {error['evalue']}", err=True)
+        click.echo(click.unstyle("\n".join(error["traceback"])), err=True)
+        raise click.Abort()
+    click.echo(f"Notebook saved to {notebook_path}")
+
+@cli.command(name="stop")
+def stop():
+    """
+    Stop the running tools server.
+    """
+    # only reached when no server is listening on the default socket, since otherwise the
+    # command is forwarded to it, so stop the kernel server for this directory if there is one
+    if stop_server(get_socket_path_for_dir(os.getcwd())):
+        click.echo("Tools server stopping", err=True)
+    else:
+        click.echo("No tools server is running", err=True)
+
+def run_cli_command(argv):
+    """Run a CLI command in this process, capturing its output. Returns (stdout, stderr, exit_code)."""
+    stdout = io.StringIO()
+    stderr = io.StringIO()
+    with contextlib.redirect_stdout(stdout), contextlib.redirect_stderr(stderr):
+        try:
+            rv = cli.main(args=argv, prog_name="tools_cli.py", standalone_mode=False)
+            exit_code = rv if isinstance(rv, int) else 0
+        except click.exceptions.Abort:
+            click.echo("Aborted!", err=True)
+            exit_code = 1
+        except click.ClickException as e:
+            e.show()
+            exit_code = e.exit_code
+        except SystemExit as e:
+            exit_code = e.code if isinstance(e.code, int) else 1
+        except Exception:
+            traceback.print_exc()
+            exit_code = 1
+    return stdout.getvalue(), stderr.getvalue(), exit_code
+
+class ToolsRequestHandler(socketserver.StreamRequestHandler):
+    def handle(self):
+        request = json.loads(self.rfile.read())
+        argv = request["argv"]
+        if argv and argv[0] == "serve":
+            stdout, stderr, exit_code = "", "Cannot run serve through the tools server\n", 1
+        elif argv and argv[0] == "stop":
+            self.server.stop_requested = True
+            stdout, stderr, exit_code = "", "Tools server stopping\n", 0
+        else:
+            # commands are executed one at a time, so it is safe to switch to the client's directory
+            os.chdir(request["cwd"])
+            stdout, stderr, exit_code = run_cli_command(argv)
+        response = {"stdout": stdout, "stderr": stderr, "exit_code": exit_code}
+        self.wfile.write(json.dumps(response).encode())
+
+@cli.command(name="serve")
+@click.option("--socket", "socket_path", default=None, help="Unix socket path (default: $DANDI_TOOLS_SOCKET or a per-user path in the temp directory)")
+@click.option("--idle-timeout", type=float, default=None, help="Exit after this many seconds without requests")
+@click.option("--preload", is_flag=True, help="Import the NWB dependencies at start-up instead of on first use")
+def serve(socket_path, idle_timeout, preload):
+    """
+    Run a long-lived server that executes tool commands.
+
+    Commands are sent with tools_client.py (or tools_cli.py, which forwards to a
+    running server) using the same syntax as this CLI. The server exits after
+    --idle-timeout seconds without requests, or when sent the stop command.
+    """
+    global serving
+    serving = True
+    # the server changes to each client's directory, so keep an absolute path
+    socket_path = os.path.abspath(socket_path or get_socket_path())
+    if preload:
+        import get_nwbfile_info  # noqa: F401
+    if os.path.exists(socket_path):
+        os.remove(socket_path)
+    class Server(socketserver.UnixStreamServer):
+        stop_requested = False
+
+        def handle_timeout(self):
+            self.stop_requested = True
+
+    with Server(socket_path, ToolsRequestHandler) as server:
+        server.timeout = idle_timeout
+        click.echo(f"Tools server listening on {socket_path}", err=True)
+        try:
+            while not server.stop_requested:
+                server.handle_request()
+        except KeyboardInterrupt:
+            pass
+        finally:
+            os.remove(socket_path)
+    click.echo("Tools server stopped", err=True)
+
 def main():
     """Entry point for the dandi-notebook-gen-tools CLI."""
     cli()
@@ -0,0 +1,122 @@
+"""Thin client for a running tools server (python tools_cli.py serve).
+
+Usage is the same as tools_cli.py, e.g.
+
+    python tools_client.py dandiset-info 000673
+
+The command is sent over a local Unix socket to the server, which has the
+tools and their dependencies already imported, so only the standard library
+is loaded here. If no server is running, the command runs in this process.
+"""
+
+import hashlib
+import json
+import os
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+from typing import Any, Dict, List, Optional
+
+
+def get_socket_path() -> str:
+    """Get the socket path from DANDI_TOOLS_SOCKET, defaulting to one per user."""
+    socket_path = os.environ.get("DANDI_TOOLS_SOCKET")
+    if socket_path:
+        return socket_path
+    return os.path.join(tempfile.gettempdir(), f"dandi-tools-{os.getuid()}.sock")
+
+
+def get_socket_path_for_dir(directory: str) -> str:
+    """Get a socket path for a server dedicated to a directory (Unix socket paths are limited to ~100 characters)."""
+    h = hashlib.sha1(os.path.abspath(directory).encode()).hexdigest()[:12]
+    return os.path.join(tempfile.gettempdir(), f"dandi-tools-{h}.sock")
+
+
+def send_command(argv: List[str], socket_path: Optional[str] = None) -> Optional[Dict[str, Any]]:
+    """Send a command to the tools server.
+
+    Returns the response with stdout, stderr and exit_code, or None if no
+    server is listening on the socket.
+    """
+    if socket_path is None:
+        socket_path = get_socket_path()
+    if not os.path.exists(socket_path):
+        return None
+    sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        try:
+            sock.connect(socket_path)
+        except (ConnectionRefusedError, FileNotFoundError):
+            # stale socket file from a server that is no longer running
+            return None
+        request = {"argv": argv, "cwd": os.getcwd()}
+        sock.sendall(json.dumps(request).encode())
+        sock.shutdown(socket.SHUT_WR)
+        chunks = []
+        while True:
+            chunk = sock.recv(65536)
+            if not chunk:
+                break
+            chunks.append(chunk)
+    finally:
+        sock.close()
+    return json.loads(b"".join(chunks))
+
+
+def start_server(socket_path: str, *, idle_timeout: float, wait_seconds: float = 30) -> bool:
+    """Start a tools server in the background on socket_path and wait until it listens.
+
+    The server is detached from this process and exits after idle_timeout
+    seconds without requests (or when sent the stop command). Returns False
+    if it did not start.
+    """
+    tools_cli_path = os.path.join(os.path.dirname(os.path.abspath(__file__)), "tools_cli.py")
+    if os.path.exists(socket_path):
+        # stale socket file from a server that is no longer running
+        os.remove(socket_path)
+    proc = subprocess.Popen(
+        [sys.executable, tools_cli_path, "serve", "--socket", socket_path, "--idle-timeout", str(idle_timeout)],
+        stdin=subprocess.DEVNULL,
+        stdout=subprocess.DEVNULL,
+        stderr=subprocess.DEVNULL,
+        start_new_session=True,
+    )
+    timer = time.time()
+    while not os.path.exists(socket_path):
+        if proc.poll() is not None or time.time() - timer > wait_seconds:
+            return False
+        time.sleep(0.05)
+    return True
+
+
+def stop_server(socket_path: Optional[str] = None) -> bool:
+    """Ask the tools server on the socket to exit. Returns False if no server is listening."""
+    return send_command(["stop"], socket_path) is not None
+
+
+def forward_to_server(argv: List[str]):
+    """Run the command on the tools server and exit with its exit code, or return if no server is running."""
+    if argv and argv[0] == "serve":
+        return
+    response = send_command(argv)
+    if response is None:
+        return
+    sys.stdout.write(response["stdout"])
+    sys.stderr.write(response["stderr"])
+    sys.stdout.flush()
+    sys.stderr.flush()
+    sys.exit(response["exit_code"])
+
+
+def main():
+    forward_to_server(sys.argv[1:])
+    # no server is running, so run the command in this process
+    from tools_cli import main as tools_cli_main
+
+    tools_cli_main()
+
+
+if __name__ == "__main__":
+    main()
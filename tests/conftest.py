@@ -0,0 +1,7 @@
+import os
+import sys
+
+# the scripts are run from the repository root, and generate.py from a directory with the templates
+repo_dir = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+sys.path.insert(0, os.path.join(repo_dir, "templates"))
+sys.path.insert(0, repo_dir)
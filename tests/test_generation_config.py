@@ -0,0 +1,139 @@
+import importlib
+import os
+import subprocess
+import sys
+import types
+
+import yaml
+from click.testing import CliRunner
+
+import generate_notebook
+import generate_notebook_matrix
+
+repo_dir = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+
+
+def read_config(output_dir):
+    with open(os.path.join(output_dir, "config.yaml")) as f:
+        return yaml.safe_load(f)
+
+
+def run_generate(output_dir, monkeypatch):
+    """Run generate.py in output_dir without the agent, returning the calls it made for the optional features."""
+    calls = {}
+
+    def perform_task(**kwargs):
+        calls["instructions"] = kwargs["instructions"]
+        with open(os.path.join(kwargs["cwd"], "notebook.ipynb"), "w") as f:
+            f.write("{}")
+        return types.SimpleNamespace(
+            total_prompt_tokens=0,
+            total_completion_tokens=0,
+            total_vision_prompt_tokens=0,
+            total_vision_completion_tokens=0,
+        )
+
+    monkeypatch.setitem(sys.modules, "minicline", types.SimpleNamespace(perform_task=perform_task))
+    monkeypatch.syspath_prepend(str(output_dir))
+    monkeypatch.chdir(output_dir)
+    monkeypatch.delitem(sys.modules, "generate", raising=False)
+    generate = importlib.import_module("generate")
+    def enable_range_cache(working_dir):
+        calls["range_cache"] = working_dir
+
+    def start_tools_server(working_dir):
+        calls["tools_server"] = working_dir
+
+    def prefetch_tool_results(dandiset_id):
+        calls["prefetch"] = dandiset_id
+        return []
+
+    def get_notebook_cell_profile(notebook_path, *, reexecute):
+        calls["profile_cells"] = reexecute
+        return {"cells": []}
+
+    for func in [enable_range_cache, start_tools_server, prefetch_tool_results, get_notebook_cell_profile]:
+        monkeypatch.setattr(generate, func.__name__, func)
+    generate.generate()
+    return calls
+
+
+def test_generate_notebook_options_reach_generate(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    os.symlink(os.path.join(repo_dir, "templates"), "templates")
+    ran = []
+    monkeypatch.setattr(generate_notebook, "subprocess", types.SimpleNamespace(
+        run=lambda args, cwd, check: ran.append(cwd), CalledProcessError=subprocess.CalledProcessError
+    ))
+
+    result = CliRunner().invoke(generate_notebook.main, [
+        "000673", "test/model", "prompt-a-5",
+        "--prefetch", "files", "--tools-server", "--range-cache", "--profile-cells",
+    ])
+    assert result.exit_code == 0, result.output
+    output_dir = tmp_path / ran[0]
+    assert read_config(output_dir) == {
+        "model": "test/model",
+        "prompt": "prompt-a-5",
+        "dandiset_id": "000673",
+        "prefetch": "files",
+        "tools_server": True,
+        "range_cache": True,
+        "profile_cells": True,
+    }
+
+    calls = run_generate(output_dir, monkeypatch)
+    assert calls["prefetch"] == "000673"
+    assert calls["range_cache"] == "working"
+    assert calls["tools_server"] == "working"
+    assert calls["profile_cells"] is True
+
+
+def test_generate_notebook_defaults(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    os.symlink(os.path.join(repo_dir, "templates"), "templates")
+    ran = []
+    monkeypatch.setattr(generate_notebook, "subprocess", types.SimpleNamespace(
+        run=lambda args, cwd, check: ran.append(cwd), CalledProcessError=subprocess.CalledProcessError
+    ))
+
+    result = CliRunner().invoke(generate_notebook.main, ["000673", "test/model", "prompt-a-5"])
+    assert result.exit_code == 0, result.output
+    output_dir = tmp_path / ran[0]
+    assert read_config(output_dir) == {"model": "test/model", "prompt": "prompt-a-5", "dandiset_id": "000673"}
+
+    calls = run_generate(output_dir, monkeypatch)
+    assert set(calls) == {"instructions", "profile_cells"}
+    assert calls["profile_cells"] is False
+
+
+def test_matrix_options_reach_config(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    os.symlink(os.path.join(repo_dir, "templates"), "templates")
+    with open("spec.yml", "w") as f:
+        yaml.dump({
+            "dandisets": ["000673"],
+            "models": ["test/model"],
+            "prompts": ["prompt-a-5", "prompt-b-5"],
+            "prefetch": "prompt",
+            "tools_server": True,
+            "range_cache": True,
+        }, f)
+    output_dirs = []
+
+    def run_generation(output_dir, **kwargs):
+        output_dirs.append(output_dir)
+        return {"status": "done", "returncode": 0, "elapsed_seconds": 0.0}
+
+    monkeypatch.setattr(generate_notebook_matrix, "run_generation", run_generation)
+
+    # command-line options take precedence over the spec
+    result = CliRunner().invoke(generate_notebook_matrix.main, ["--spec", "spec.yml", "--no-range-cache", "--profile-cells"])
+    assert result.exit_code == 0, result.output
+    assert len(output_dirs) == 2
+    for output_dir in output_dirs:
+        config = read_config(output_dir)
+        assert config["prefetch"] == "prompt"
+        assert config["tools_server"] is True
+        assert config["range_cache"] is False
+        assert config["profile_cells"] is True
@@ -0,0 +1,59 @@
+import json
+import os
+import subprocess
+import sys
+
+from click.testing import CliRunner
+
+import generate_notebook_matrix
+from generate_notebook_matrix import StatusTracker, lock_output_dir, run_generation, run_key
+
+
+def test_run_generation_applies_limits(tmp_path):
+    with open(tmp_path / "generate.py", "w") as f:
+        f.write(
+            "import json, resource\n"
+            "print(json.dumps([resource.getrlimit(resource.RLIMIT_CPU)[0], resource.getrlimit(resource.RLIMIT_AS)[0]]))\n"
+        )
+    result = run_generation(str(tmp_path), timeout_seconds=60, max_cpu_seconds=100, max_memory_gb=8)
+    assert result["status"] == "done"
+    with open(tmp_path / "generate.log") as f:
+        assert json.loads(f.read()) == [100, 8 * 1024 ** 3]
+
+
+def test_run_generation_keeps_output_dir_locked(tmp_path):
+    with open(tmp_path / "generate.py", "w") as f:
+        f.write("import time\ntime.sleep(2)\n")
+    lock_fd = lock_output_dir(str(tmp_path))
+    proc = subprocess.Popen([
+        sys.executable, "-c",
+        "import sys, generate_notebook_matrix as m; "
+        f"m.run_generation({str(tmp_path)!r}, timeout_seconds=60, max_cpu_seconds=None, max_memory_gb=None, lock_fd={lock_fd})",
+    ], pass_fds=[lock_fd], cwd=os.path.dirname(generate_notebook_matrix.__file__))
+    os.close(lock_fd)
+    # the lock is held by the runner and by generate.py until they exit
+    assert lock_output_dir(str(tmp_path)) is None
+    proc.wait()
+    lock_fd = lock_output_dir(str(tmp_path))
+    assert lock_fd is not None
+    os.close(lock_fd)
+
+
+def test_matrix_keeps_partial_output_dir_in_use(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    output_dir = tmp_path / "dandisets" / "000673" / "partial"
+    output_dir.mkdir(parents=True)
+    tracker = StatusTracker("generation_status.json")
+    key = run_key("000673", "test/model", "prompt-a-5")
+    tracker.update(key, output_dir=str(output_dir), status="running")
+    runs = []
+    monkeypatch.setattr(generate_notebook_matrix, "run_generation", lambda output_dir, **kwargs: runs.append(output_dir))
+
+    lock_fd = lock_output_dir(str(output_dir))
+    args = ["--dandiset", "000673", "--model", "test/model", "--prompt", "prompt-a-5"]
+    result = CliRunner().invoke(generate_notebook_matrix.main, args)
+    os.close(lock_fd)
+    assert result.exit_code == 0, result.output
+    assert "still in use by another run" in result.output
+    assert output_dir.exists()
+    assert runs == []
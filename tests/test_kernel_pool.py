@@ -0,0 +1,16 @@
+import nbformat
+
+from kernel_pool import profile_notebook
+
+
+def test_profile_notebook_removes_its_copy(tmp_path):
+    nb = nbformat.v4.new_notebook()
+    nb.cells = [nbformat.v4.new_code_cell("x = list(range(1000))"), nbformat.v4.new_code_cell("print(len(x))")]
+    notebook_path = tmp_path / "notebook.ipynb"
+    nbformat.write(nb, str(notebook_path))
+
+    result = profile_notebook(str(notebook_path))
+    assert [c["cell_index"] for c in result["cells"]] == [0, 1]
+    assert all(c["elapsed_seconds"] is not None and c["peak_memory_mb"] is not None for c in result["cells"])
+    assert "error" not in result
+    assert sorted(p.name for p in tmp_path.iterdir()) == ["notebook.ipynb"]
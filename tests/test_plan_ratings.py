@@ -0,0 +1,21 @@
+from plan_ratings import estimate_wall_time_seconds
+
+
+def test_wall_time_without_map_calls():
+    assert estimate_wall_time_seconds(
+        num_calls=27, num_map_calls_per_notebook=[0, 0], concurrency=1, map_concurrency=4, seconds_per_call=10
+    ) == 270
+    assert estimate_wall_time_seconds(
+        num_calls=27, num_map_calls_per_notebook=[0, 0], concurrency=4, map_concurrency=4, seconds_per_call=10
+    ) == 70
+
+
+def test_map_calls_run_concurrently_within_a_notebook():
+    # 9 segments take 3 rounds at 4 workers and 2 segments take 1, on top of the 27 serial rating calls
+    assert estimate_wall_time_seconds(
+        num_calls=27, num_map_calls_per_notebook=[9, 2], concurrency=1, map_concurrency=4, seconds_per_call=10
+    ) == (27 + 3 + 1) * 10
+    # the map steps of different notebooks don't overlap
+    assert estimate_wall_time_seconds(
+        num_calls=0, num_map_calls_per_notebook=[1, 1, 1], concurrency=8, map_concurrency=4, seconds_per_call=10
+    ) == 30
@@ -0,0 +1,115 @@
+import json
+import os
+import re
+import shutil
+import threading
+import time
+
+import nbformat
+import pytest
+import yaml
+from click.testing import CliRunner
+
+import run_plot_ratings
+
+repo_dir = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+# a 1x1 PNG
+png_base64 = "iVBORw0KGgoAAAANSUhEUgAAAAEAAAABCAYAAAAfFcSJAAAADUlEQVR42mNkYPhfDwAChwGA60e6kgAAAABJRU5ErkJggg=="
+
+
+class FakeCompletion:
+    """Answers rating requests with a fixed score, recording the plots per request and the requests in flight."""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.in_flight = 0
+        self.max_in_flight = 0
+        self.plots_per_request = []
+
+    def __call__(self, messages, **kwargs):
+        with self.lock:
+            self.in_flight += 1
+            self.max_in_flight = max(self.max_in_flight, self.in_flight)
+        time.sleep(0.02)
+        user_message = messages[-1]["content"]
+        plot_ids = re.search(r"The plot IDs are: (.*)", user_message)
+        if plot_ids:
+            ids = plot_ids.group(1).strip().split(", ")
+            content = "<plot_ratings>" + "".join(
+                f'<plot_rater id="{i}"><thinking>ok</thinking><score>4</score></plot_rater>' for i in ids
+            ) + "</plot_ratings>"
+        else:
+            ids = [None]
+            content = "<plot_rater><thinking>ok</thinking><score>4</score></plot_rater>"
+        with self.lock:
+            self.plots_per_request.append(len(ids))
+            self.in_flight -= 1
+        return content, messages, 10, 10
+
+
+def make_notebook(path, num_plots):
+    nb = nbformat.v4.new_notebook()
+    for i in range(num_plots):
+        cell = nbformat.v4.new_code_cell(f"plot({i})")
+        cell.outputs = [nbformat.v4.new_output("display_data", data={"image/png": png_base64})]
+        nb.cells.append(cell)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    nbformat.write(nb, path)
+
+
+@pytest.fixture
+def workspace(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    shutil.copy(os.path.join(repo_dir, "plot_rubric.yml"), "plot_rubric.yml")
+    make_notebook("dandisets/000673/2025-04-01-model-prompt-a-5/000673.ipynb", 5)
+    make_notebook("dandisets/001174/2025-04-01-model-prompt-a-5/001174.ipynb", 2)
+    completion = FakeCompletion()
+    monkeypatch.setattr(run_plot_ratings, "run_completion", completion)
+    with open("plot_rubric.yml") as f:
+        num_questions = len(yaml.safe_load(f)["questions"])
+    return completion, num_questions
+
+
+def check_ratings(num_questions):
+    with open("plot_ratings.json") as f:
+        ratings = json.load(f)
+    assert [len(r["plots"]) for r in ratings] == [5, 2]
+    for rating in ratings:
+        for plot in rating["plots"]:
+            assert len(plot["scores"]) == num_questions
+            for score in plot["scores"]:
+                assert sorted(rep["repnum"] for rep in score["reps"]) == list(range(run_plot_ratings.num_repeats))
+                assert score["score"] == 4
+
+
+@pytest.mark.parametrize("max_concurrent_requests", [1, 4])
+def test_plot_batches(workspace, max_concurrent_requests):
+    completion, num_questions = workspace
+    result = CliRunner().invoke(run_plot_ratings.main, [
+        "--plot-batch-size", "3", "--max-concurrent-requests", str(max_concurrent_requests)
+    ])
+    assert result.exit_code == 0, result.output
+    check_ratings(num_questions)
+    # 5 plots in batches of 3 and 2, and 2 plots in one batch, per question and repetition
+    assert sorted(completion.plots_per_request) == sorted([3, 2, 2] * num_questions * run_plot_ratings.num_repeats)
+    if max_concurrent_requests == 1:
+        assert completion.max_in_flight == 1
+    else:
+        assert 1 < completion.max_in_flight <= 4
+
+
+def test_concurrent_requests(workspace):
+    completion, num_questions = workspace
+    result = CliRunner().invoke(run_plot_ratings.main, ["--max-concurrent-requests", "4"])
+    assert result.exit_code == 0, result.output
+    check_ratings(num_questions)
+    assert completion.plots_per_request == [1] * 7 * num_questions * run_plot_ratings.num_repeats
+    assert 1 < completion.max_in_flight <= 4
+
+
+def test_serial_requests(workspace):
+    completion, num_questions = workspace
+    result = CliRunner().invoke(run_plot_ratings.main, ["--max-concurrent-requests", "1"])
+    assert result.exit_code == 0, result.output
+    check_ratings(num_questions)
+    assert completion.max_in_flight == 1
@@ -0,0 +1,117 @@
+import ast
+import os
+import subprocess
+import sys
+import textwrap
+import threading
+import types
+from functools import partial
+from http.server import SimpleHTTPRequestHandler, ThreadingHTTPServer
+
+import range_cache
+
+templates_dir = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "templates")
+
+# a remfile stand-in with the same entry point, since only the patching is under test
+remfile_package = """
+class File:
+    def __init__(self, url, *, verbose=False):
+        self.url = url
+"""
+
+
+def run_python(code, tmp_path, env_extra):
+    site_dir = tmp_path / "site"
+    env = dict(os.environ, **env_extra)
+    env["PYTHONPATH"] = os.pathsep.join([str(site_dir), str(tmp_path / "packages"), templates_dir])
+    result = subprocess.run(
+        [sys.executable, "-c", textwrap.dedent(code)], env=env, capture_output=True, text=True, cwd=tmp_path
+    )
+    assert result.returncode == 0, result.stderr
+    return result.stdout.split()
+
+
+def get_sitecustomize():
+    # generate.py imports the agent, so read the sitecustomize source without importing it
+    with open(os.path.join(templates_dir, "generate.py")) as f:
+        tree = ast.parse(f.read())
+    for node in tree.body:
+        if isinstance(node, ast.Assign) and node.targets[0].id == "range_cache_sitecustomize":
+            return node.value.value
+
+
+def setup_site(tmp_path):
+    range_cache_sitecustomize = get_sitecustomize()
+    (tmp_path / "site").mkdir()
+    with open(tmp_path / "site" / "sitecustomize.py", "w") as f:
+        f.write(range_cache_sitecustomize)
+    (tmp_path / "packages" / "remfile").mkdir(parents=True)
+    with open(tmp_path / "packages" / "remfile" / "__init__.py", "w") as f:
+        f.write(remfile_package)
+
+
+def test_sitecustomize_is_lazy(tmp_path):
+    setup_site(tmp_path)
+    out = run_python("""
+        import sys
+        print("remfile" in sys.modules, "requests" in sys.modules, "range_cache" in sys.modules)
+    """, tmp_path, {"DANDI_RANGE_CACHE": "1"})
+    assert out == ["False", "False", "True"]
+
+
+def test_remfile_is_patched_on_import(tmp_path):
+    setup_site(tmp_path)
+    out = run_python("""
+        import remfile
+        from remfile import File
+        import range_cache
+        original = remfile.File.__mro__[1]
+        print(isinstance(remfile.File, type), File is remfile.File, issubclass(remfile.File, original))
+        class Sub(remfile.File):
+            pass
+        print(issubclass(Sub, original), remfile.File._range_cache_installed)
+        range_cache.install()
+        print(remfile.File.__mro__[1] is original)
+    """, tmp_path, {"DANDI_RANGE_CACHE": "1"})
+    assert out == ["True", "True", "True", "True", "True", "True"]
+
+
+def test_remfile_is_not_patched_without_range_cache(tmp_path):
+    setup_site(tmp_path)
+    out = run_python("""
+        import remfile
+        print(hasattr(remfile.File, "_range_cache_installed"))
+    """, tmp_path, {"DANDI_RANGE_CACHE": "0"})
+    assert out == ["False"]
+
+
+def test_patched_file_reads_through_cache(tmp_path):
+    data = os.urandom(300_000)
+    with open(tmp_path / "data.bin", "wb") as f:
+        f.write(data)
+    handler = partial(SimpleHTTPRequestHandler, directory=str(tmp_path))
+    handler.log_message = lambda *args: None
+    server = ThreadingHTTPServer(("127.0.0.1", 0), handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    url = f"http://127.0.0.1:{server.server_address[1]}/data.bin"
+    remfile = types.ModuleType("remfile")
+    exec(remfile_package, remfile.__dict__)
+    original = remfile.File
+    cache = range_cache.BlockCache(str(tmp_path / "cache"), block_size=64 * 1024)
+    saved_cache = range_cache._default_cache
+    try:
+        range_cache._patch_remfile(remfile)
+        range_cache._default_cache = cache
+        f = remfile.File(url, verbose=True)
+        assert isinstance(f, original)
+        assert f.length == len(data)
+        f.seek(100_000)
+        assert f.read(1000) == data[100_000:101_000]
+        assert f.tell() == 101_000
+        f.seek(0)
+        assert f.read() == data
+        f.close()
+        assert cache.get_block(url, 0) == data[:64 * 1024]
+    finally:
+        range_cache._default_cache = saved_cache
+        server.shutdown()
@@ -0,0 +1,59 @@
+import numpy as np
+
+from helpers.rating_analytics import bootstrap_ci, leaderboard, load_reps, notebook_totals, unit_scores
+
+
+def make_rating(notebook, model, versions, score):
+    return {
+        "notebook": notebook,
+        "dandiset_id": "000673",
+        "subfolder": f"2025-04-01-{model}-prompt-a-5",
+        "scores": [
+            {"name": name, "version": version, "reps": [{"repnum": 0, "score": score}, {"repnum": 1, "score": score}]}
+            for name, version in versions.items()
+        ],
+    }
+
+
+def test_bootstrap_ci_matches_per_group_bootstrap():
+    rng = np.random.default_rng(1)
+    group_ids = rng.integers(0, 20, 2000)
+    group_ids[group_ids == 3] = 4
+    values = rng.normal(group_ids.astype(float), 1 + group_ids % 3)
+    low, high = bootstrap_ci(values, group_ids, num_samples=2000, max_draws_per_chunk=100_000)
+    assert np.isnan(low[3]) and np.isnan(high[3])
+    for g in [0, 4, 19]:
+        v = values[group_ids == g]
+        means = v[rng.integers(0, len(v), size=(2000, len(v)))].mean(axis=1)
+        expected_low, expected_high = np.quantile(means, [0.025, 0.975])
+        assert low[g] < v.mean() < high[g]
+        assert abs(low[g] - expected_low) < 0.1 * (expected_high - expected_low)
+        assert abs(high[g] - expected_high) < 0.1 * (expected_high - expected_low)
+
+
+def test_bootstrap_ci_single_value_groups():
+    low, high = bootstrap_ci(np.array([1.0, 2.0, 2.0]), np.array([0, 1, 1]))
+    assert list(low) == [1.0, 2.0] and list(high) == [1.0, 2.0]
+
+
+def test_versions_are_not_mixed():
+    ratings = [
+        make_rating("a.ipynb", "model-1", {"load-nwb": 1, "plot-quality": 1}, 4),
+        make_rating("b.ipynb", "model-1", {"load-nwb": 2, "plot-quality": 1}, 8),
+    ]
+    units = unit_scores(load_reps(ratings))
+    assert sorted(zip(units["notebook"], units["question"], units["version"])) == [
+        ("a.ipynb", "load-nwb", 1), ("a.ipynb", "plot-quality", 1),
+        ("b.ipynb", "load-nwb", 2), ("b.ipynb", "plot-quality", 1),
+    ]
+
+    board = leaderboard(units, ["model", "question"])
+    load_nwb = board[board["question"] == "load-nwb"].sort_values("version")
+    assert list(load_nwb["version"]) == [1, 2]
+    assert list(load_nwb["mean"]) == [4, 8]
+    plot_quality = board[board["question"] == "plot-quality"]
+    assert list(plot_quality["mean"]) == [6]
+
+    totals = notebook_totals(units)
+    assert sorted(totals["rubric_version"]) == ["load-nwb:1,plot-quality:1", "load-nwb:2,plot-quality:1"]
+    assert sorted(leaderboard(totals, ["model"])["mean"]) == [8, 16]
@@ -0,0 +1,291 @@
+#!/usr/bin/env python3
+
+"""Timeline of notebook generation runs, from the minicline log.
+
+    python trace_generation.py trace dandisets/000673/2025-04-16-claude-3.7-sonnet-prompt-a-4
+    python trace_generation.py summary
+
+trace writes a Chrome trace (open it in https://ui.perfetto.dev or
+chrome://tracing) with each LLM turn, tool call, notebook execution and
+retry wait of a run. summary aggregates where the wall time goes per model
+and prompt across all runs in dandisets/.
+
+Runs generated before generate.py recorded minicline.timestamps.jsonl only
+have the order of events, so durations are not available for them.
+"""
+
+import os
+import ast
+import json
+import statistics
+import click
+import yaml
+from typing import Any, Dict, List, Optional, Tuple
+
+# commands that execute the notebook, as opposed to exploration scripts and tool calls
+notebook_execution_markers = ["jupyter execute", "jupyter nbconvert", "tools_cli.py execute", "tools_client.py execute", "--execute"]
+
+thread_ids = {"llm": 1, "tool": 2, "command": 2, "notebook_execution": 2, "wait": 3}
+thread_names = {1: "LLM", 2: "Tools", 3: "Waits"}
+
+
+def read_log_lines(run_dir: str) -> Tuple[List[Tuple[Optional[float], str]], bool]:
+    """Read the log of a run as (time, line) pairs, and whether the times are known."""
+    timestamps_path = os.path.join(run_dir, "minicline.timestamps.jsonl")
+    if os.path.exists(timestamps_path):
+        lines = []
+        with open(timestamps_path, "r") as f:
+            for line in f:
+                entry = json.loads(line)
+                lines.append((entry["t"], entry["line"]))
+        return lines, True
+    with open(os.path.join(run_dir, "working", "minicline.log"), "r") as f:
+        return [(None, line) for line in f.read().split("\n")], False
+
+
+def parse_token_totals(line: str) -> Tuple[int, int]:
+    # e.g. "Total prompt tokens: 12345 + 678"
+    a, b = line.split(":", 1)[1].split("+")
+    return int(a), int(b)
+
+
+def classify_tool_call(tool_name: str, params: Dict[str, Any]) -> Tuple[str, str]:
+    """Get the (category, name) of a tool call event."""
+    if tool_name != "execute_command":
+        return "tool", tool_name
+    command = str(params.get("command", ""))
+    category = "notebook_execution" if any(m in command for m in notebook_execution_markers) else "command"
+    return category, command if len(command) <= 80 else command[:77] + "..."
+
+
+def parse_log(lines: List[Tuple[Optional[float], str]]) -> List[Dict[str, Any]]:
+    """Parse the log lines of a run into events with category, name, start, end and args.
+
+    Without timestamps, start and end are None.
+    """
+    events: List[Dict[str, Any]] = []
+    current_model = None
+    llm_event = None
+    tool_event = None
+    wait_event = None
+    # LLM turns whose tokens are not yet known (minicline only prints running totals after each tool call)
+    pending_llm_events: List[Dict[str, Any]] = []
+    prompt_totals = (0, 0)
+    completion_totals = (0, 0)
+
+    for t, line in lines:
+        if line.startswith("Using model: "):
+            current_model = line[len("Using model: "):].strip()
+        elif line.startswith("Submitting completion request..."):
+            if wait_event is not None:
+                wait_event["end"] = t
+                wait_event = None
+            llm_event = {"category": "llm", "name": "LLM turn", "start": t, "end": None, "args": {"model": current_model}}
+            events.append(llm_event)
+        elif line.startswith("Processing response...") and llm_event is not None:
+            llm_event["end"] = t
+            pending_llm_events.append(llm_event)
+            llm_event = None
+        elif line.startswith("Error running completion: "):
+            if llm_event is not None:
+                llm_event["end"] = t
+                llm_event["args"]["error"] = line[len("Error running completion: "):]
+                llm_event = None
+        elif line.startswith("Retrying in "):
+            wait_event = {"category": "wait", "name": "Retry wait", "start": t, "end": None, "args": {}}
+            events.append(wait_event)
+        elif line.startswith("Tool: "):
+            tool_event = {"category": "tool", "name": line[len("Tool: "):].strip(), "start": t, "end": None, "args": {}}
+            events.append(tool_event)
+        elif line.startswith("Params: ") and tool_event is not None:
+            try:
+                params = ast.literal_eval(line[len("Params: "):])
+            except (ValueError, SyntaxError):
+                params = None
+            if not isinstance(params, dict):
+                params = {"raw": line[len("Params: "):]}
+            tool_event["category"], tool_event["name"] = classify_tool_call(tool_event["name"], params)
+            tool_event["args"]["tool"] = tool_event["name"] if tool_event["category"] == "tool" else "execute_command"
+            tool_event["args"]["params"] = {k: v if len(str(v)) <= 200 else str(v)[:200] + "..." for k, v in params.items()}
+        elif line.startswith("Total prompt tokens: "):
+            totals = parse_token_totals(line)
+            if tool_event is not None:
+                tool_event["end"] = t
+                tool_event["args"]["vision_prompt_tokens"] = totals[1] - prompt_totals[1]
+            if pending_llm_events:
+                pending_llm_events[-1]["args"]["prompt_tokens"] = totals[0] - prompt_totals[0]
+            prompt_totals = totals
+        elif line.startswith("Total completion tokens: "):
+            totals = parse_token_totals(line)
+            if tool_event is not None:
+                tool_event["args"]["vision_completion_tokens"] = totals[1] - completion_totals[1]
+                tool_event = None
+            if pending_llm_events:
+                pending_llm_events[-1]["args"]["completion_tokens"] = totals[0] - completion_totals[0]
+                if len(pending_llm_events) > 1:
+                    # turns without a tool call are only counted in the following turn's totals
+                    pending_llm_events[-1]["args"]["num_turns_in_tokens"] = len(pending_llm_events)
+                pending_llm_events = []
+            completion_totals = totals
+
+    # close events that were cut off by the end of the log (e.g. a killed run)
+    last_t = lines[-1][0] if lines else None
+    for e in events:
+        if e["end"] is None and e["start"] is not None:
+            e["end"] = last_t
+            e["args"]["incomplete"] = True
+    return events
+
+
+def make_chrome_trace(events: List[Dict[str, Any]], *, has_timestamps: bool, metadata: Dict[str, Any]) -> Dict[str, Any]:
+    """Convert parsed events to the Chrome trace event format (complete events, in microseconds)."""
+    trace_events: List[Dict[str, Any]] = [
+        {"ph": "M", "name": "thread_name", "pid": 1, "tid": tid, "args": {"name": name}}
+        for tid, name in thread_names.items()
+    ]
+    t0 = next((e["start"] for e in events if e["start"] is not None), 0)
+    for i, e in enumerate(events):
+        if has_timestamps:
+            ts = (e["start"] - t0) * 1e6
+            dur = (e["end"] - e["start"]) * 1e6
+        else:
+            # only the order is known, so give every event the same nominal duration
+            ts = i * 1e6
+            dur = 1e6
+        trace_events.append({
+            "ph": "X",
+            "name": e["name"],
+            "cat": e["category"],
+            "pid": 1,
+            "tid": thread_ids[e["category"]],
+            "ts": ts,
+            "dur": dur,
+            "args": e["args"],
+        })
+    return {
+        "traceEvents": trace_events,
+        "displayTimeUnit": "ms",
+        "otherData": dict(metadata, has_timestamps=has_timestamps),
+    }
+
+
+def load_run_config(run_dir: str) -> Dict[str, Any]:
+    config_path = os.path.join(run_dir, "config.yaml")
+    if not os.path.exists(config_path):
+        return {}
+    with open(config_path, "r") as f:
+        return yaml.safe_load(f) or {}
+
+
+def summarize_run(run_dir: str) -> Dict[str, Any]:
+    """Get the time spent per category and the token counts of a run."""
+    lines, has_timestamps = read_log_lines(run_dir)
+    events = parse_log(lines)
+    config = load_run_config(run_dir)
+    summary: Dict[str, Any] = {
+        "run_dir": run_dir,
+        "model": config.get("model"),
+        "prompt": config.get("prompt"),
+        "has_timestamps": has_timestamps,
+        "num_llm_turns": sum(1 for e in events if e["category"] == "llm" and "error" not in e["args"]),
+        "num_failed_llm_requests": sum(1 for e in events if e["category"] == "llm" and "error" in e["args"]),
+        "num_tool_calls": sum(1 for e in events if e["category"] != "llm" and e["category"] != "wait"),
+        "num_notebook_executions": sum(1 for e in events if e["category"] == "notebook_execution"),
+        "prompt_tokens": sum(e["args"].get("prompt_tokens", 0) for e in events),
+        "completion_tokens": sum(e["args"].get("completion_tokens", 0) for e in events),
+    }
+    if has_timestamps and events:
+        seconds = {c: 0.0 for c in ["llm", "tool", "command", "notebook_execution", "wait"]}
+        for e in events:
+            seconds[e["category"]] += e["end"] - e["start"]
+        wall = lines[-1][0] - lines[0][0]
+        summary["wall_seconds"] = wall
+        summary.update({f"{c}_seconds": s for c, s in seconds.items()})
+        summary["other_seconds"] = wall - sum(seconds.values())
+    return summary
+
+
+def find_run_dirs(base_dir: str) -> List[str]:
+    """Find generation runs (dandisets/<DANDISET_ID>/<subfolder>/working/minicline.log)."""
+    run_dirs = []
+    for dandiset_id in sorted(os.listdir(base_dir)):
+        dandiset_path = os.path.join(base_dir, dandiset_id)
+        if not os.path.isdir(dandiset_path):
+            continue
+        for subfolder in sorted(os.listdir(dandiset_path)):
+            run_dir = os.path.join(dandiset_path, subfolder)
+            if os.path.isfile(os.path.join(run_dir, "working", "minicline.log")):
+                run_dirs.append(run_dir)
+    return run_dirs
+
+
+@click.group()
+def cli():
+    pass
+
+
+@cli.command()
+@click.argument("run_dir")
+@click.option("-o", "--output", default=None, help="Output file (default: <run_dir>/trace.json)")
+def trace(run_dir, output):
+    """Write a Chrome trace of a generation run."""
+    lines, has_timestamps = read_log_lines(run_dir)
+    events = parse_log(lines)
+    config = load_run_config(run_dir)
+    chrome_trace = make_chrome_trace(events, has_timestamps=has_timestamps, metadata={
+        "run_dir": run_dir, "model": config.get("model"), "prompt": config.get("prompt")
+    })
+    if output is None:
+        output = os.path.join(run_dir, "trace.json")
+    with open(output, "w") as f:
+        json.dump(chrome_trace, f)
+    if not has_timestamps:
+        print("No minicline.timestamps.jsonl for this run, so the trace only shows the order of events")
+    print(f"Wrote {len(events)} events to {output}")
+
+
+@cli.command()
+@click.option("--base-dir", default="dandisets", help="Directory containing the generated notebooks")
+@click.option("-o", "--output", default=None, help="Also write the per-run summaries to this JSON file")
+def summary(base_dir, output):
+    """Summarize where the generation wall time goes, per model and prompt."""
+    runs = [summarize_run(run_dir) for run_dir in find_run_dirs(base_dir)]
+    print(f"Found {len(runs)} runs ({sum(1 for r in runs if r['has_timestamps'])} with timestamps)")
+
+    groups: Dict[Tuple[str, str], List[Dict[str, Any]]] = {}
+    for r in runs:
+        groups.setdefault((r["model"] or "?", r["prompt"] or "?"), []).append(r)
+
+    columns = ["runs", "turns", "notebook execs", "prompt tok", "completion tok", "wall s", "llm s", "tools s", "notebook s", "wait s", "other s"]
+    print("\nMedian per run")
+    print(f"{'model':40} {'prompt':12} " + " ".join(f"{c:>14}" for c in columns))
+    for (model, prompt), group in sorted(groups.items()):
+        timed = [r for r in group if r["has_timestamps"]]
+
+        def median(key: str, runs: List[Dict[str, Any]], fmt: str = ".0f") -> str:
+            values = [r[key] for r in runs]
+            return format(statistics.median(values), fmt) if values else "-"
+
+        row = [
+            str(len(group)),
+            median("num_llm_turns", group),
+            median("num_notebook_executions", group),
+            median("prompt_tokens", group),
+            median("completion_tokens", group),
+            median("wall_seconds", timed, ".1f"),
+            median("llm_seconds", timed, ".1f"),
+            f"{statistics.median([r['tool_seconds'] + r['command_seconds'] for r in timed]):.1f}" if timed else "-",
+            median("notebook_execution_seconds", timed, ".1f"),
+            median("wait_seconds", timed, ".1f"),
+            median("other_seconds", timed, ".1f"),
+        ]
+        print(f"{model:40} {prompt:12} " + " ".join(f"{v:>14}" for v in row))
+
+    if output:
+        with open(output, "w") as f:
+            json.dump(runs, f, indent=2)
+        print(f"\nWrote {output}")
+
+
+if __name__ == "__main__":
+    cli()
@@ -0,0 +1,438 @@
+#!/usr/bin/env python3
+
+"""Watch dandisets/ and rate the notebooks that are added or changed.
+
+    python watch_notebooks.py [--tasks ratings,plot_ratings,critiques] [--debounce-seconds 10]
+
+Instead of rerunning run_ratings.py, run_plot_ratings.py and
+critique_notebooks.py after generate_notebook.py or
+scripts/update_submodules.sh, leave this running. It detects new and changed
+dandisets/<DANDISET_ID>/<subfolder>/<DANDISET_ID>.ipynb files with inotify
+(if inotify_simple is installed, on Linux) or by polling, and sends only
+those to a worker process that keeps the rating scripts imported between
+notebooks.
+
+- A notebook is picked up once its size and modification time have not changed
+  for --debounce-seconds, so that one being written is not rated half-way.
+- At most --max-queued notebooks wait for the worker; the others stay pending
+  until it catches up.
+- The SHA-256 of each processed notebook is kept in watch_state.json. A
+  notebook whose content changed since then is rated from scratch (its previous
+  ratings are replaced). A notebook seen for the first time resumes from the
+  existing ratings, so on the first start all notebooks are checked but only
+  the missing units are requested. --skip-existing records the notebooks present
+  at start-up as processed without checking them.
+- Critiques are only made for the subfolders that critique_notebooks.py
+  critiques (those starting with critique_prefix).
+"""
+
+import os
+import json
+import time
+import queue
+import hashlib
+import traceback
+import multiprocessing
+import click
+from typing import Any, Dict, List, Set, Tuple
+from helpers.json_io import save_json_atomic
+
+try:
+    import inotify_simple
+except ImportError:
+    inotify_simple = None
+
+all_tasks = ["ratings", "plot_ratings", "critiques"]
+# as in critique_notebooks.py
+critique_prefix = "2025-04-16"
+state_fname = "watch_state.json"
+# with inotify, everything is still rescanned this often, in case events were missed
+full_rescan_seconds = 60
+
+Stat = Tuple[int, int]
+
+
+def list_dirs(path: str) -> List[str]:
+    try:
+        return [entry.path for entry in os.scandir(path) if entry.is_dir()]
+    except (FileNotFoundError, NotADirectoryError):
+        return []
+
+
+def stat_notebook(subfolder_path: str) -> Tuple[str, Stat] | None:
+    """Get the path and (mtime_ns, size) of the notebook of a subfolder, if it has one."""
+    dandiset_id = os.path.basename(os.path.dirname(subfolder_path))
+    notebook_path = os.path.join(subfolder_path, f"{dandiset_id}.ipynb")
+    try:
+        st = os.stat(notebook_path)
+    except FileNotFoundError:
+        return None
+    return notebook_path, (st.st_mtime_ns, st.st_size)
+
+
+def hash_file(path: str) -> str:
+    h = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(1 << 20), b""):
+            h.update(chunk)
+    return h.hexdigest()
+
+
+class NotebookScanner:
+    """Keeps the (mtime_ns, size) of every notebook under base_dir up to date.
+
+    With inotify, wait() returns the directories that had events, and only those
+    are rescanned. Without it, wait() sleeps and everything is rescanned.
+    """
+
+    def __init__(self, base_dir: str, *, use_inotify: bool = True):
+        self.base_dir = base_dir.rstrip("/")
+        self.notebooks: Dict[str, Stat] = {}
+        self.inotify = None
+        self.watches: Dict[int, str] = {}
+        self.watched: Set[str] = set()
+        if use_inotify and inotify_simple is not None:
+            try:
+                self.inotify = inotify_simple.INotify()
+            except (OSError, AttributeError) as e:
+                print(f"inotify is not available ({e}), polling instead")
+        elif use_inotify:
+            print("inotify_simple is not installed, polling instead")
+
+    def add_watch(self, path: str):
+        if self.inotify is None or path in self.watched:
+            return
+        flags = inotify_simple.flags
+        mask = flags.CREATE | flags.CLOSE_WRITE | flags.MOVED_TO | flags.MOVED_FROM | flags.DELETE | flags.DELETE_SELF
+        try:
+            wd = self.inotify.add_watch(path, mask)
+        except OSError as e:
+            # e.g. the limit on watches was reached; the periodic full rescans still cover the directory
+            print(f"Could not watch {path}: {e}")
+            return
+        self.watches[wd] = path
+        self.watched.add(path)
+
+    def scan(self, path: str | None = None):
+        """Rescan the notebooks under path (a dandiset directory or a subfolder), or everything."""
+        path = path or self.base_dir
+        depth = 0 if path == self.base_dir else len(os.path.relpath(path, self.base_dir).split(os.sep))
+        while depth > 2:
+            # a directory inside a subfolder
+            path = os.path.dirname(path)
+            depth -= 1
+        if depth == 0:
+            self.notebooks = {}
+        else:
+            self.notebooks = {p: s for p, s in self.notebooks.items() if not p.startswith(path + os.sep)}
+        dirs = [path]
+        for _ in range(depth, 2):
+            for d in dirs:
+                self.add_watch(d)
+            dirs = [sub for d in dirs for sub in list_dirs(d)]
+        for subfolder_path in dirs:
+            self.add_watch(subfolder_path)
+            found = stat_notebook(subfolder_path)
+            if found is not None:
+                self.notebooks[found[0]] = found[1]
+
+    def wait(self, timeout: float) -> Set[str] | None:
+        """Wait for changes for at most timeout seconds; return the directories to rescan, or None for all of them."""
+        if self.inotify is None:
+            time.sleep(timeout)
+            return None
+        flags = inotify_simple.flags
+        dirty = set()
+        # read_delay gathers the events of a burst (e.g. a git checkout) into one wake-up
+        for event in self.inotify.read(timeout=int(timeout * 1000), read_delay=200):
+            if event.mask & flags.Q_OVERFLOW:
+                return None
+            path = self.watches.get(event.wd)
+            if path is None:
+                continue
+            if event.mask & flags.IGNORED:
+                del self.watches[event.wd]
+                self.watched.discard(path)
+                continue
+            if event.mask & flags.ISDIR:
+                if event.mask & (flags.CREATE | flags.MOVED_TO):
+                    dirty.add(os.path.join(path, event.name))
+                else:
+                    dirty.add(path)
+            elif event.name.endswith(".ipynb"):
+                dirty.add(path)
+        # a directory and one of its subdirectories only need the outer scan
+        return {d for d in dirty if not any(d.startswith(o + os.sep) for o in dirty)}
+
+
+def process_ratings(notebook_path: str, *, rerate: bool):
+    import run_ratings
+
+    ratings_fname = "ratings.json"
+    ratings = load_json_list(ratings_fname)
+    existing_rating = None
+    if not rerate:
+        existing_rating = next((r for r in ratings if r["notebook"] == notebook_path), None)
+
+    def checkpoint(partial_rating: Dict[str, Any]):
+        run_ratings.update_rating(ratings, partial_rating)
+        save_json_atomic(ratings_fname, ratings)
+
+    new_rating, _, _ = run_ratings.rate_notebook(
+        notebook_path_or_url=notebook_path,
+        model=run_ratings.model,
+        existing_ratings=existing_rating,
+        checkpoint=checkpoint,
+    )
+    run_ratings.update_rating(ratings, new_rating)
+    save_json_atomic(ratings_fname, ratings)
+    print(f"Rating saved for {notebook_path}")
+
+
+def process_plot_ratings(notebook_path: str, *, rerate: bool, executor=None, plot_batch_size: int = 1):
+    import run_plot_ratings
+
+    ratings_fname = "plot_ratings.json"
+    all_ratings = load_json_list(ratings_fname)
+    existing_rating = None
+    if not rerate:
+        existing_rating = next((r for r in all_ratings if r["notebook"] == notebook_path), None)
+
+    def checkpoint(partial_rating: Dict[str, Any]):
+        run_plot_ratings.update_rating(all_ratings, partial_rating)
+        save_json_atomic(ratings_fname, all_ratings)
+
+    new_rating = run_plot_ratings.rate_notebook_plots(
+        notebook_path=notebook_path,
+        model=run_plot_ratings.model,
+        existing_ratings=existing_rating,
+        checkpoint=checkpoint,
+        executor=executor,
+        plot_batch_size=plot_batch_size,
+    )
+    run_plot_ratings.update_rating(all_ratings, new_rating)
+    save_json_atomic(ratings_fname, all_ratings)
+    print(f"Ratings saved for {notebook_path}")
+
+
+def process_critiques(notebook_path: str, *, rerate: bool):
+    import critique_notebooks
+
+    if not os.path.basename(os.path.dirname(notebook_path)).startswith(critique_prefix):
+        return
+    critiques_fname = os.path.join(os.path.dirname(os.path.abspath(critique_notebooks.__file__)), "notebook_critiques.json")
+    critiques = load_json_list(critiques_fname)
+    critique = None
+    if not rerate:
+        critique = next((
+            c for c in critiques
+            if c["notebook"] == notebook_path and c["prompt_version"] == critique_notebooks.prompt_version
+        ), None)
+    if critique is not None and critique.get("summary_critique"):
+        print("Notebook already critiqued, skipping...")
+        return
+    if critique is None:
+        critique, _, _ = critique_notebooks.critique_notebook(notebook_path_or_url=notebook_path)
+    critique["summary_critique"], _, _ = critique_notebooks.get_summary_critique(critique["cell_critiques"])
+    critiques = [c for c in critiques if c["notebook"] != notebook_path]
+    critiques.append(critique)
+    critiques.sort(key=lambda x: x["notebook"])
+    save_json_atomic(critiques_fname, critiques)
+    print(f"Critiques saved to {critiques_fname}")
+
+
+def load_json_list(fname: str) -> List[Dict[str, Any]]:
+    if not os.path.exists(fname):
+        return []
+    with open(fname, "r") as f:
+        return json.load(f)
+
+
+def worker_main(jobs, done, tasks: List[str], plot_options: Dict[str, int]):
+    """Process (notebook_path, digest, rerate) jobs until None, reporting (notebook_path, digest, error) for each.
+
+    plot_options has the plot_batch_size and max_concurrent_requests of the plot ratings.
+    """
+    # imported once, so that each notebook only costs its own work
+    import run_ratings  # noqa: F401
+    import run_plot_ratings
+    import critique_notebooks  # noqa: F401
+    from concurrent.futures import ThreadPoolExecutor
+
+    # the plot rating requests of successive notebooks share one pool, as in run_plot_ratings.py
+    plot_executor = None
+    if plot_options["max_concurrent_requests"] > 1:
+        plot_executor = ThreadPoolExecutor(max_workers=plot_options["max_concurrent_requests"])
+    processors = {
+        "ratings": process_ratings,
+        "plot_ratings": lambda path, rerate: process_plot_ratings(
+            path, rerate=rerate, executor=plot_executor, plot_batch_size=plot_options["plot_batch_size"]
+        ),
+        "critiques": process_critiques,
+    }
+    try:
+        while True:
+            job = jobs.get()
+            if job is None:
+                break
+            notebook_path, digest, rerate = job
+            print(f"\nProcessing {notebook_path}" + (" (changed, rating from scratch)" if rerate else ""))
+            errors = []
+            for task in tasks:
+                try:
+                    processors[task](notebook_path, rerate=rerate)
+                except Exception as e:
+                    traceback.print_exc()
+                    errors.append(f"{task}: {e}")
+            done.put((notebook_path, digest, "; ".join(errors) or None))
+    except KeyboardInterrupt:
+        pass
+    finally:
+        if plot_executor is not None:
+            plot_executor.shutdown(wait=False, cancel_futures=True)
+
+
+class Worker:
+    def __init__(self, tasks: List[str], max_queued: int, plot_options: Dict[str, int]):
+        self.jobs = multiprocessing.Queue(maxsize=max_queued)
+        self.done = multiprocessing.Queue()
+        self.process = multiprocessing.Process(target=worker_main, args=(self.jobs, self.done, tasks, plot_options), daemon=True)
+        self.process.start()
+
+    def results(self) -> List[Tuple[str, str, str | None]]:
+        out = []
+        while True:
+            try:
+                out.append(self.done.get_nowait())
+            except queue.Empty:
+                return out
+
+    def stop(self, timeout: float):
+        try:
+            self.jobs.put(None, timeout=1)
+        except queue.Full:
+            pass
+        self.process.join(timeout)
+        if self.process.is_alive():
+            self.process.terminate()
+            self.process.join()
+
+
+@click.command()
+@click.option("--base-dir", default="dandisets", help="Directory with the <DANDISET_ID>/<subfolder>/<DANDISET_ID>.ipynb notebooks")
+@click.option("--tasks", default="ratings,plot_ratings", help=f"Comma-separated tasks to run for each notebook ({', '.join(all_tasks)})")
+@click.option("--debounce-seconds", type=float, default=10, help="How long a notebook must stay unchanged before it is processed")
+@click.option("--poll-seconds", type=float, default=5, help="Interval between scans when polling")
+@click.option("--max-queued", type=int, default=4, help="Notebooks waiting for the worker at most")
+@click.option("--skip-existing", is_flag=True, help="Record the notebooks present at start-up as processed")
+@click.option("--no-inotify", is_flag=True, help="Poll even if inotify is available (e.g. on network filesystems)")
+@click.option("--plot-batch-size", type=click.IntRange(min=1), default=1, show_default=True, help="Number of plots of a notebook rated together in one request")
+@click.option("--max-concurrent-requests", type=click.IntRange(min=1), default=4, show_default=True, help="Maximum number of plot rating requests in flight at once (1 rates serially)")
+def main(base_dir, tasks, debounce_seconds, poll_seconds, max_queued, skip_existing, no_inotify, plot_batch_size, max_concurrent_requests):
+    """Watch for new and changed notebooks and rate them as they appear."""
+    task_list = [t for t in tasks.split(",") if t]
+    for t in task_list:
+        if t not in all_tasks:
+            raise click.BadParameter(f"Unknown task {t}", param_hint="--tasks")
+    plot_options = {"plot_batch_size": plot_batch_size, "max_concurrent_requests": max_concurrent_requests}
+
+    state: Dict[str, str] = {}
+    if os.path.exists(state_fname):
+        with open(state_fname, "r") as f:
+            state = json.load(f)["notebooks"]
+
+    scanner = NotebookScanner(base_dir, use_inotify=not no_inotify)
+    scanner.scan()
+    print(f"Watching {len(scanner.notebooks)} notebooks in {base_dir} ({'inotify' if scanner.inotify else 'polling'})")
+    if skip_existing:
+        for notebook_path in scanner.notebooks:
+            state.setdefault(notebook_path, hash_file(notebook_path))
+        save_json_atomic(state_fname, {"notebooks": state})
+
+    # the stat of each notebook when it was last hashed, so that unchanged notebooks are not read again
+    checked: Dict[str, Stat] = {}
+    # notebooks that changed, with their stat and when it was first seen
+    candidates: Dict[str, Tuple[Stat, float]] = {}
+    # notebooks queued for or being processed by the worker
+    in_worker: Set[str] = set()
+    worker = Worker(task_list, max_queued, plot_options)
+    last_full_scan = time.monotonic()
+    dirty: Set[str] | None = set()
+
+    try:
+        while True:
+            now = time.monotonic()
+            if dirty is None or now - last_full_scan >= full_rescan_seconds:
+                scanner.scan()
+                last_full_scan = now
+            else:
+                for path in dirty:
+                    scanner.scan(path)
+
+            for notebook_path in list(candidates):
+                if notebook_path not in scanner.notebooks:
+                    del candidates[notebook_path]
+            for notebook_path, st in scanner.notebooks.items():
+                if checked.get(notebook_path) == st:
+                    continue
+                if notebook_path not in candidates or candidates[notebook_path][0] != st:
+                    candidates[notebook_path] = (st, now)
+
+            for notebook_path, (st, since) in sorted(candidates.items(), key=lambda x: x[1][1]):
+                if now - since < debounce_seconds or notebook_path in in_worker:
+                    # a notebook being processed is checked again once the worker is done with it
+                    continue
+                try:
+                    digest = hash_file(notebook_path)
+                except FileNotFoundError:
+                    del candidates[notebook_path]
+                    continue
+                checked[notebook_path] = st
+                if state.get(notebook_path) == digest:
+                    # e.g. touched, or checked out again with the same content
+                    del candidates[notebook_path]
+                    continue
+                try:
+                    worker.jobs.put_nowait((notebook_path, digest, notebook_path in state))
+                except queue.Full:
+                    # picked up again once the worker catches up
+                    del checked[notebook_path]
+                    break
+                del candidates[notebook_path]
+                in_worker.add(notebook_path)
+                print(f"Queued {notebook_path} ({len(in_worker)} in the worker, {len(candidates)} pending)")
+
+            for notebook_path, digest, error in worker.results():
+                in_worker.discard(notebook_path)
+                if error is not None:
+                    # left for the next change of the notebook or the next start, like a failed run of the scripts
+                    print(f"Error processing {notebook_path}: {error}")
+                    continue
+                state[notebook_path] = digest
+                save_json_atomic(state_fname, {"notebooks": state})
+                print(f"Done with {notebook_path}")
+
+            if not worker.process.is_alive():
+                print(f"Worker exited with code {worker.process.exitcode}, restarting it")
+                # the queued and unfinished notebooks are found again by the next scan
+                for notebook_path in in_worker:
+                    checked.pop(notebook_path, None)
+                in_worker.clear()
+                worker = Worker(task_list, max_queued, plot_options)
+                last_full_scan = float("-inf")
+
+            if scanner.inotify is None:
+                timeout = poll_seconds
+            elif candidates or in_worker:
+                timeout = 1
+            else:
+                timeout = max(0.0, full_rescan_seconds - (time.monotonic() - last_full_scan))
+            dirty = scanner.wait(timeout)
+    except KeyboardInterrupt:
+        print("Stopping")
+    finally:
+        worker.stop(timeout=10)
+
+
+if __name__ == "__main__":
+    main()